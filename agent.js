@@ -1,34 +1,248 @@
 function Emulator() {
+    var self = this;
+
+    // request id -> [resolve, reject], settled by the plugin replies
+    this.pending = {};
+    this.nextId = 1;
+
+    this.onReply = function (message) {
+        recv('ucdwarf_emulator', self.onReply);
+
+        var request = self.pending[message.id];
+        if (!isDefined(request)) {
+            return;
+        }
+        delete self.pending[message.id];
+        if (message.error !== null && isDefined(message.error)) {
+            request[1](new Error(message.error));
+        } else {
+            request[0](message.result);
+        }
+    };
+
+    this.request = function (cmd) {
+        var id = self.nextId++;
+        return new Promise(function (resolve, reject) {
+            self.pending[id] = [resolve, reject];
+            loggedSend('emulator:::' + id + ':::' + cmd);
+        });
+    };
+
     this.clean = function () {
-        loggedSend('emulator:::clean')
+        return this.request('clean')
     };
 
     this.setup = function (tid, arch, mode) {
         if (typeof tid !== 'number') {
             tid = Process.getCurrentThreadId();
         }
-        var msg = 'emulator:::setup:::' + tid;
+        var msg = 'setup:::' + tid;
         if (isDefined(arch) && isDefined(mode)) {
             msg += ':::' + arch + ':::' + mode;
         }
-        loggedSend(msg)
+        return this.request(msg)
     };
 
     this.start = function (until) {
-        loggedSend('emulator:::start:::' + until)
+        // resolves once the run is over with {stop_reason, pc, registers, stats}
+        return this.request('start:::' + until)
+    };
+
+    this.run = function (until, count, timeout) {
+        // no tracing while running: stops before until, after count instructions or timeout ms
+        var msg = 'run:::' + (isDefined(until) ? until : 0);
+        msg += ':::' + (isDefined(count) ? count : 0);
+        msg += ':::' + (isDefined(timeout) ? timeout : 0);
+        return this.request(msg)
+    };
+
+    this.read = function (address, size) {
+        // hex of the emulator memory
+        return this.request('read:::' + address + ':::' + size)
+    };
+
+    this.registers = function () {
+        return this.request('regs')
+    };
+
+    this.writeRegisters = function (registers) {
+        // {r0: 1, pc: '0x1000'}
+        return this.request('write_regs:::' + JSON.stringify(registers))
+    };
+
+    this.write = function (address, hex) {
+        return this.request('write:::' + address + ':::' + hex)
+    };
+
+    this.batch = function (commands) {
+        // one message and one thread start for the whole sequence, i.e.
+        // [['setup'], ['write_regs', {x0: 1}], ['write', '0x1000', '41414141'], ['run', until], ['read', '0x1000', 4]]
+        // resolves with {results: [one per command], error: null or the failure which stopped the batch}
+        return this.request('batch:::' + JSON.stringify(commands.map(function (command) {
+            if (!Array.isArray(command)) {
+                command = [command];
+            }
+            return command.map(function (arg) {
+                if (arg instanceof NativePointer || typeof arg === 'number') {
+                    return arg.toString();
+                }
+                return arg;
+            });
+        })))
+    };
+
+    this.traceRange = function (start, end) {
+        // only start runs inside the traced ranges are hooked, everything else runs hook free
+        return this.request('trace_range:::add:::' + start + ':::' + end)
+    };
+
+    this.traceModule = function (name) {
+        return this.request('trace_range:::module:::' + name)
+    };
+
+    this.clearTraceRanges = function () {
+        return this.request('trace_range:::clear')
+    };
+
+    this.exportTrace = function (path) {
+        // stream the traced runs into a compressed file, replayed offline by EmulatorTraceReader
+        return this.request('export:::start:::' + path)
+    };
+
+    this.stopExport = function () {
+        return this.request('export:::stop')
+    };
+
+    this.dumpSnapshot = function (path, tid) {
+        // dump the whole process memory, the emulator can then run from it even once detached
+        if (typeof tid !== 'number') {
+            tid = Process.getCurrentThreadId();
+        }
+        return this.request('snapshot:::dump:::' + path + ':::' + tid)
+    };
+
+    this.useSnapshot = function (path) {
+        if (isDefined(path)) {
+            return this.request('snapshot:::use:::' + path)
+        }
+        return this.request('snapshot:::none')
+    };
+
+    this.checkpoint = function () {
+        // checkpoint ids are sequential, starting from 1 after each setup
+        return this.request('checkpoint')
+    };
+
+    this.restore = function (id) {
+        return this.request('restore:::' + id)
+    };
+
+    this.batchRun = function (variations, until, options) {
+        // variations: [{registers: {r0: 1}, memory: {'0x1000': 'hex'}, read: [['0x2000', 16]]}]
+        // options: {checkpoint: id, count: n, timeout: ms, workers: n}
+        var args = isDefined(options) ? options : {};
+        args.variations = variations;
+        args.until = isDefined(until) ? until.toString() : 0;
+        return this.request('batch_run:::' + JSON.stringify(args))
+    };
+
+    this.profile = function (action, arg) {
+        // start, stop, clear, hotspots (arg: count) or drcov (arg: path)
+        var msg = 'profile';
+        if (isDefined(action)) {
+            msg += ':::' + action;
+            if (isDefined(arg)) {
+                msg += ':::' + arg;
+            }
+        }
+        return this.request(msg)
+    };
+
+    this.stats = function (reset) {
+        return this.request('stats' + (reset ? ':::reset' : ''))
     };
 
     this.step = function () {
-        loggedSend('emulator:::step:::1')
+        return this.request('step:::1')
     };
 
     this.stepFunction = function () {
-        loggedSend('emulator:::step:::2')
+        return this.request('step:::2')
     };
 
     this.stop = function () {
-        loggedSend('emulator:::stop')
+        // handled right away, even while a run is in progress
+        return this.request('stop')
     };
+
+    recv('ucdwarf_emulator', this.onReply);
 }
 
 global.emulator = new Emulator();
+
+function describeRange(range) {
+    var info = {
+        base: range.base.toString(),
+        size: range.size,
+        protection: range.protection
+    };
+    if (isDefined(range.file)) {
+        info.file = range.file.path;
+        info.offset = range.file.offset;
+    }
+    return info;
+}
+
+// rpc used by the emulator pager to describe target pages (page cache keys)
+rpc.exports.ucdwarfGetRanges = function (addresses) {
+    return addresses.map(function (address) {
+        var range = Process.findRangeByAddress(ptr(address));
+        return range === null ? null : describeRange(range);
+    });
+};
+
+// rpc used to dump a full memory snapshot of the target
+rpc.exports.ucdwarfEnumerateRanges = function () {
+    return Process.enumerateRanges('r--').map(describeRange);
+};
+
+// rpc used by the emulator pager to read several ranges with a single round trip.
+// unreadable parts are skipped. layout: u32 count, then for each chunk u64 address, u32 size and the data
+rpc.exports.ucdwarfReadRanges = function (ranges) {
+    var chunks = [];
+    var total = 4;
+    ranges.forEach(function (r) {
+        var address = ptr(r[0]);
+        var end = address.add(r[1]);
+        while (address.compare(end) < 0) {
+            var range = Process.findRangeByAddress(address);
+            if (range === null || range.protection[0] !== 'r') {
+                address = address.add(0x1000);
+                continue;
+            }
+            var rangeEnd = range.base.add(range.size);
+            var stop = rangeEnd.compare(end) < 0 ? rangeEnd : end;
+            var size = stop.sub(address).toInt32();
+            try {
+                chunks.push([address, size, address.readByteArray(size)]);
+                total += 12 + size;
+            } catch (e) {
+            }
+            address = stop;
+        }
+    });
+
+    var buffer = new ArrayBuffer(total);
+    var view = new DataView(buffer);
+    var bytes = new Uint8Array(buffer);
+    view.setUint32(0, chunks.length, true);
+    var offset = 4;
+    chunks.forEach(function (chunk) {
+        view.setUint32(offset, chunk[0].and(0xffffffff).toUInt32(), true);
+        view.setUint32(offset + 4, chunk[0].shr(32).toUInt32(), true);
+        view.setUint32(offset + 8, chunk[1], true);
+        bytes.set(new Uint8Array(chunk[2]), offset + 12);
+        offset += 12 + chunk[1];
+    });
+    return buffer;
+};
@@ -0,0 +1,276 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+
+emulator benchmarks, without dwarf nor a target: canned code blobs are served by a local stand-in
+through the same demand paging path used against a live process.
+
+    cd ~/.dwarf/plugins
+    python3 -m ucdwarf.benchmarks.emulator_benchmark -o results.json
+
+every case runs in a fresh process so that peak memory is per case
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import sys
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+
+import capstone
+import unicorn
+
+from ucdwarf.src.emulator_access_log import format_ranges
+from ucdwarf.src.emulator_core import (EmulatorCore, EmulatorConfig, EmulatorListener, ContextProvider,
+                                       MemoryProvider, EMULATOR_PAGE_CACHE_SIZE, EMULATOR_TRACE_REGISTERS,
+                                       EMULATOR_ACCESS_FILTERS)
+from ucdwarf.src.emulator_snapshot import SnapshotContext
+
+BENCHMARK_VERSION = 1
+
+CODE_BASE = 0x100000
+DATA_BASE = 0x200000
+DATA_SIZE = 0x10000
+STACK_BASE = 0x300000
+STACK_SIZE = 0x10000
+PAGE_SIZE = 0x1000
+
+# loop: 20000 iterations of add/dec/branch
+# memcpy: 16k copied a word at a time from DATA_BASE to DATA_BASE + 0x8000
+# calls: 5000 calls to a leaf function
+# memory: read, modify and write back 4096 words starting at DATA_BASE
+# every blob ends with a nop, which is the end address of the run
+BLOBS = {
+    'x64': {
+        'loop': 'b9204e00004801c848ffc975f890',
+        'memcpy': 'be00002000bf00802000b900080000488b064889074883c6084883c70848ffc975ed90',
+        'calls': 'b988130000e80700000048ffc975f6eb054883c001c390',
+        'memory': 'be00002000b900100000488b064801c84889064883c60848ffc975ee90',
+    },
+    'ia32': {
+        'loop': 'b9204e000001c84975fb90',
+        'memcpy': 'be00002000bf00802000b9001000008b06890783c60483c7044975f390',
+        'calls': 'b988130000e8050000004975f8eb0483c001c390',
+        'memory': 'be00002000b9001000008b0601c8890683c6044975f490',
+    },
+    'arm': {
+        'loop': '200e04e3001081e0010050e2fcffff1a00f020e3',
+        'memcpy': '001000e3201040e3002008e3202040e3000001e3043091e4043082e4010050e2fbffff1a00f020e3',
+        'calls': '880301e3020000eb010050e2fcffff1a010000ea011081e21eff2fe100f020e3',
+        'memory': '001000e3201040e3000001e3003091e5003083e0043081e4010050e2faffff1a00f020e3',
+    },
+    'thumb': {
+        'loop': '44f620600144401efcd100bf',
+        'memcpy': '40f20001c0f2200148f20002c0f2200241f2000051f8043b42f8043b401ef9d100bf',
+        'calls': '41f2883000f003f8401efbd102e001f10101704700bf',
+        'memory': '40f20001c0f2200141f200000b68034441f8043b401ef9d100bf',
+    },
+    'arm64': {
+        'loop': '00c489d22100008b000400f1c1ffff541f2003d5',
+        'memcpy': '0104a0d2020090d20204a0f2000081d2238440f8438400f8000400f1a1ffff541f2003d5',
+        'calls': '007182d204000094000400f1c1ffff540300001421040091c0035fd61f2003d5',
+        'memory': '0104a0d2000082d2230040f96300008b238400f8000400f181ffff541f2003d5',
+    },
+}
+
+# benchmark arch -> dwarf arch, nop, pc and sp register names
+ARCHS = {
+    'x64': ('x64', bytes.fromhex('90'), 'rip', 'rsp'),
+    'ia32': ('ia32', bytes.fromhex('90'), 'eip', 'esp'),
+    'arm': ('arm', bytes.fromhex('00f020e3'), 'pc', 'sp'),
+    'thumb': ('arm', bytes.fromhex('00bf'), 'pc', 'sp'),
+    'arm64': ('arm64', bytes.fromhex('1f2003d5'), 'pc', 'sp'),
+}
+
+# hook configurations. fast runs without any hook, the others trace every instruction
+CONFIGS = {
+    'fast': {},
+    'trace': {},
+    'trace_registers': {EMULATOR_TRACE_REGISTERS: True},
+    # memory accesses only recorded on the stack, which the blobs don't touch
+    'trace_filtered': {EMULATOR_ACCESS_FILTERS: format_ranges([(STACK_BASE, STACK_BASE + STACK_SIZE)])},
+}
+
+
+class BenchmarkTarget(ContextProvider, MemoryProvider):
+    """
+    stand-in for dwarf and the target process: a code page holding the blob, a data buffer and a stack
+    """
+
+    def __init__(self, name, blob):
+        self.name = name
+        self.arch, nop, self._pc_name, self._sp_name = ARCHS[name]
+        self.code = bytes.fromhex(BLOBS[name][blob])
+        self.end = CODE_BASE + len(self.code) - len(nop)
+
+        code_size = (len(self.code) + PAGE_SIZE) & ~(PAGE_SIZE - 1)
+        self.regions = [
+            (CODE_BASE, self.code + nop * ((code_size - len(self.code)) // len(nop))),
+            (DATA_BASE, bytes(i & 0xff for i in range(DATA_SIZE))),
+            (STACK_BASE, bytes(STACK_SIZE))
+        ]
+
+    def get_context(self, tid):
+        registers = {'pc': CODE_BASE, self._pc_name: CODE_BASE, self._sp_name: STACK_BASE + STACK_SIZE // 2}
+        return SnapshotContext(registers, thumb=self.name == 'thumb')
+
+    def read_ranges(self, runs):
+        chunks = []
+        for address, size in runs:
+            for base, data in self.regions:
+                start = max(address, base)
+                end = min(address + size, base + len(data))
+                if start < end:
+                    chunks.append((start, data[start - base:end - base]))
+        return chunks
+
+
+class BenchmarkListener(EmulatorListener):
+    def __init__(self):
+        self.events = 0
+        self.batches = 0
+
+    def on_emulator_events(self, events):
+        self.events += len(events)
+        self.batches += 1
+
+
+def _build(name, blob, config):
+    target = BenchmarkTarget(name, blob)
+    settings = {EMULATOR_PAGE_CACHE_SIZE: 0}
+    settings.update(CONFIGS[config])
+    listener = BenchmarkListener()
+    core = EmulatorCore(target, target, config=EmulatorConfig(settings), listener=listener)
+    return target, core, listener
+
+
+def _count_instructions(name, blob):
+    """
+    instructions executed by a blob, counted per block outside of the measured runs
+    """
+    target, core, _ = _build(name, blob, 'fast')
+    core.setup()
+    counts = {}
+    executed = [0]
+
+    def on_block(uc, address, size, user_data):
+        if address not in counts:
+            counts[address] = sum(1 for _ in core.cs.disasm_lite(bytes(uc.mem_read(address, size)), address))
+        executed[0] += counts[address]
+
+    core.uc.hook_add(unicorn.UC_HOOK_BLOCK, on_block)
+    core.emulate(until=target.end | (1 if core.thumb else 0), fast=True)
+    return executed[0]
+
+
+def run_case(name, blob, config, repeat=3):
+    """
+    :return: dict with the measures of one arch/blob/configuration
+    """
+    instructions = _count_instructions(name, blob)
+    setup_times = []
+    run_times = []
+    last = None
+    for _ in range(repeat):
+        target, core, listener = _build(name, blob, config)
+        started = time.perf_counter()
+        err = core.setup()
+        setup_times.append(time.perf_counter() - started)
+        if err:
+            return {'arch': name, 'blob': blob, 'config': config, 'error': 'setup failed: %d' % err}
+
+        until = target.end | (1 if core.thumb else 0)
+        started = time.perf_counter()
+        core.emulate(until=until, fast=config == 'fast')
+        run_times.append(time.perf_counter() - started)
+        last = core, listener
+
+    core, listener = last
+    pager = core.pager.stats()
+    best = min(run_times)
+    return {
+        'arch': name,
+        'blob': blob,
+        'config': config,
+        'instructions': instructions,
+        'setup_time': min(setup_times),
+        'run_time': best,
+        'run_time_median': statistics.median(run_times),
+        'instructions_per_second': instructions / best if best else 0,
+        'events': listener.events,
+        'event_batches': listener.batches,
+        'traced': len(core.trace),
+        'faults': pager['faults'],
+        'bytes_mapped': pager['bytes_mapped'],
+        'avg_fault_time': pager['avg_fault_time'],
+        'max_fault_time': pager['max_fault_time'],
+        # kilobytes on linux, bytes on macos
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def run(archs=None, blobs=None, configs=None, repeat=3, log=None):
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name in archs or BLOBS:
+        for blob in blobs or BLOBS[name]:
+            for config in configs or CONFIGS:
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    try:
+                        result = pool.submit(run_case, name, blob, config, repeat).result()
+                    except Exception as e:
+                        result = {'arch': name, 'blob': blob, 'config': config, 'error': str(e)}
+                results.append(result)
+                if log is not None:
+                    if 'error' in result:
+                        log('%-6s %-7s %-16s error: %s' % (name, blob, config, result['error']))
+                    else:
+                        log('%-6s %-7s %-16s %12.0f ins/s  setup %.4fs  faults %d' % (
+                            name, blob, config, result['instructions_per_second'], result['setup_time'],
+                            result['faults']))
+    return {
+        'version': BENCHMARK_VERSION,
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'unicorn': unicorn.__version__,
+        'capstone': capstone.__version__,
+        'repeat': repeat,
+        'results': results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ucdwarf emulator benchmarks')
+    parser.add_argument('-o', '--output', default='emulator_benchmark.json', help='json results file')
+    parser.add_argument('-a', '--arch', action='append', choices=list(BLOBS))
+    parser.add_argument('-b', '--blob', action='append', choices=list(BLOBS['x64']))
+    parser.add_argument('-c', '--config', action='append', choices=list(CONFIGS))
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    report = run(archs=args.arch, blobs=args.blob, configs=args.config, repeat=max(args.repeat, 1), log=print)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('results saved to %s' % args.output)
+    return 0 if all('error' not in result for result in report['results']) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,21 +14,26 @@ Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
     You should have received a copy of the GNU General Public License
     along with this program.  If not, see <https://www.gnu.org/licenses/>
 """
+import json
 import os
 
+from collections import deque
+
 from PyQt5.QtCore import QObject, pyqtSignal
 
 from dwarf.ui.widgets.widget_console import DwarfConsoleWidget
 from ucdwarf.src.emulator import Emulator, EmulatorThread
 from ucdwarf.src.emulator_context_widget import EmulatorContextList
-
-
-EMULATOR_CALLBACKS_PATH = 'emulator_callbacks_path'
-EMULATOR_INSTRUCTIONS_DELAY = 'emulator_instructions_delay'
+# prefs keys are shared with the headless core
+from ucdwarf.src.emulator_core import (EMULATOR_CALLBACKS_PATH, EMULATOR_INSTRUCTIONS_DELAY, EMULATOR_TRACE_SIZE,
+                                       EMULATOR_TRACE_REGISTERS, EMULATOR_ACCESS_FILTERS, EMULATOR_PAGE_CACHE_SIZE,
+                                       EMULATOR_FAULT_SIZE, EMULATOR_PREFETCH_PAGES, EMULATOR_SNAPSHOT_PATH,
+                                       EMULATOR_MAX_INSTRUCTIONS, EMULATOR_RUN_TIMEOUT, EMULATOR_LOOP_THRESHOLD,
+                                       EMULATOR_TRACE_RANGES, EMULATOR_TRACE_SPILL, EMULATOR_TRACE_EXPORT_PATH)
 
 
 class Plugin(QObject):
-    onEmulatorApi = pyqtSignal(list, name='onEmulatorApi')
+    onEmulatorApi = pyqtSignal(str, list, name='onEmulatorApi')
 
     @staticmethod
     def __get_plugin_info__():
@@ -57,7 +62,8 @@ class Plugin(QObject):
         self.console = None
         self.emulator_panel = None
         self.emulator = None
-        self._emu_queue = []
+        # (request id, cmd parts) waiting for the emulator thread
+        self._emu_queue = deque()
         self._emu_thread = None
 
         self.app.session_manager.sessionCreated.connect(self._on_session_created)
@@ -70,6 +76,7 @@ class Plugin(QObject):
         self._emu_thread = EmulatorThread(self)
         self._emu_thread.onCmdCompleted.connect(self._on_emu_completed)
         self._emu_thread.onError.connect(self._on_emu_error)
+        self._emu_thread.finished.connect(self._on_emu_finished)
         self._emu_thread.emulator = self.emulator
 
         self.onEmulatorApi.connect(self._on_emulator_api)
@@ -84,35 +91,66 @@ class Plugin(QObject):
         message, data = args
         if 'payload' in message:
             what = message['payload']
+            # emulator:::request id:::cmd[:::args]
             parts = what.split(':::')
-            if len(parts) < 2:
+            if len(parts) < 3:
                 return
 
             cmd = parts[0]
             if cmd == 'emulator':
-                self.onEmulatorApi.emit(parts[1:])
-
-    def _on_emulator_api(self, data):
-        if self.emulator and self._emu_thread:
-            if not self._emu_thread.isRunning():
-                self._emu_thread.cmd = data
-                self._emu_thread.start()
-            else:
-                self._emu_queue.append(data)
-
-    def _on_emu_completed(self, result):
-        self.log(result)  # todo: send back to script???
-        if self._emu_queue:
-            self._emu_thread.cmd = self._emu_queue[0]
-            self._emu_queue = self._emu_queue[1:]
-            self._emu_thread.start()
-        else:
-            self._emu_thread.cmd = ''
-
-    def _on_emu_error(self, err_str):
+                self.onEmulatorApi.emit(parts[1], parts[2:])
+
+    def _on_emulator_api(self, request_id, parts):
+        if not self.emulator or not self._emu_thread:
+            self._reply_emu(request_id, error='no emulator')
+            return
+
+        if parts[0] == 'stop':
+            # out of band, the emulator thread is busy with the run to stop
+            self._reply_emu(request_id, result=self.emulator.api(parts))
+            return
+
+        self._emu_queue.append((request_id, parts))
+        self._next_emu_cmd()
+
+    def _next_emu_cmd(self):
+        if not self._emu_queue or self._emu_thread.isRunning():
+            return
+        self._emu_thread.request_id, self._emu_thread.cmd = self._emu_queue.popleft()
+        self._emu_thread.start()
+
+    def _on_emu_completed(self, request_id, result):
+        self._reply_emu(request_id, result=result)
+
+    def _on_emu_error(self, request_id, err_str):
         self.log(err_str)
-        if self._emu_queue:
-            self._emu_queue.clear()
+        self._reply_emu(request_id, error=err_str)
+        # queued commands relied on the failed one
+        while self._emu_queue:
+            self._reply_emu(self._emu_queue.popleft()[0], error='cancelled: ' + err_str)
+
+    def _on_emu_finished(self):
+        self._emu_thread.wait()
+        self._emu_thread.cmd = ''
+        self._next_emu_cmd()
+
+    def _reply_emu(self, request_id, result=None, error=None):
+        """
+        resolves (or rejects) the promise of the agent request
+        """
+        script = getattr(self.app.dwarf, '_script', None)
+        if script is None:
+            return
+        try:
+            # anything json can't take (bytes, tuples keys...) is sent as a string
+            result = json.loads(json.dumps(result, default=str))
+        except (TypeError, ValueError) as e:
+            result = None
+            error = error or str(e)
+        try:
+            script.post({'type': 'ucdwarf_emulator', 'id': request_id, 'result': result, 'error': error})
+        except Exception as e:
+            self.log('failed to reply to the agent: %s' % str(e))
 
     def _on_ui_element_created(self, elem, widget):
         if elem == 'console':
@@ -138,4 +176,5 @@ class Plugin(QObject):
         return self.emulator_panel
 
     def log(self, what):
-        self.console.log(str(what))
+        if self.console is not None:
+            self.console.log(str(what))
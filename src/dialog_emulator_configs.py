@@ -17,7 +17,16 @@ Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
 from PyQt5.QtWidgets import *
 
 from dwarf.lib.prefs import Prefs
-from ucdwarf.plugin import EMULATOR_INSTRUCTIONS_DELAY, EMULATOR_CALLBACKS_PATH
+from ucdwarf.plugin import (EMULATOR_INSTRUCTIONS_DELAY, EMULATOR_CALLBACKS_PATH, EMULATOR_TRACE_SIZE,
+                            EMULATOR_TRACE_REGISTERS, EMULATOR_ACCESS_FILTERS, EMULATOR_PAGE_CACHE_SIZE,
+                            EMULATOR_FAULT_SIZE, EMULATOR_PREFETCH_PAGES, EMULATOR_SNAPSHOT_PATH,
+                            EMULATOR_MAX_INSTRUCTIONS, EMULATOR_RUN_TIMEOUT, EMULATOR_LOOP_THRESHOLD,
+                            EMULATOR_TRACE_RANGES, EMULATOR_TRACE_SPILL, EMULATOR_TRACE_EXPORT_PATH)
+from ucdwarf.src.emulator_access_log import parse_ranges
+from ucdwarf.src.emulator_limits import DEFAULT_MAX_INSTRUCTIONS, DEFAULT_RUN_TIMEOUT, DEFAULT_LOOP_THRESHOLD
+from ucdwarf.src.emulator_page_cache import DEFAULT_PAGE_CACHE_SIZE
+from ucdwarf.src.emulator_pager import DEFAULT_FAULT_SIZE, DEFAULT_PREFETCH_PAGES
+from ucdwarf.src.emulator_trace import DEFAULT_TRACE_SIZE
 
 
 class EmulatorConfigsDialog(QDialog):
@@ -42,11 +51,86 @@ class EmulatorConfigsDialog(QDialog):
         callbacks_layout.addWidget(self.callbacks_path_label)
         layout.addLayout(callbacks_layout)
 
+        layout.addWidget(QLabel('memory snapshot (seed the emulator from a full dump)'))
+        snapshot_layout = QHBoxLayout()
+        pick_snapshot = QPushButton('choose')
+        pick_snapshot.clicked.connect(self.pick_snapshot_path)
+        clear_snapshot = QPushButton('none')
+        clear_snapshot.clicked.connect(self.clear_snapshot_path)
+        current_snapshot_path = self._prefs.get(EMULATOR_SNAPSHOT_PATH, '')
+        if current_snapshot_path == '':
+            current_snapshot_path = 'none'
+        self.snapshot_path_label = QLabel(current_snapshot_path)
+        snapshot_layout.addWidget(pick_snapshot)
+        snapshot_layout.addWidget(clear_snapshot)
+        snapshot_layout.addWidget(self.snapshot_path_label)
+        layout.addLayout(snapshot_layout)
+
         layout.addWidget(QLabel('delay between instructions'))
         self.instructions_delay = QLineEdit()
         self.instructions_delay.setText(str(self._prefs.get(EMULATOR_INSTRUCTIONS_DELAY, 0.5)))
         layout.addWidget(self.instructions_delay)
 
+        layout.addWidget(QLabel('max instructions per run (0 for no limit)'))
+        self.max_instructions = QLineEdit()
+        self.max_instructions.setText(str(self._prefs.get(EMULATOR_MAX_INSTRUCTIONS, DEFAULT_MAX_INSTRUCTIONS)))
+        layout.addWidget(self.max_instructions)
+
+        layout.addWidget(QLabel('max milliseconds per run (0 for no limit)'))
+        self.run_timeout = QLineEdit()
+        self.run_timeout.setText(str(self._prefs.get(EMULATOR_RUN_TIMEOUT, DEFAULT_RUN_TIMEOUT)))
+        layout.addWidget(self.run_timeout)
+
+        layout.addWidget(QLabel('loop iterations between loop detector checks (0 to disable)'))
+        self.loop_threshold = QLineEdit()
+        self.loop_threshold.setText(str(self._prefs.get(EMULATOR_LOOP_THRESHOLD, DEFAULT_LOOP_THRESHOLD)))
+        layout.addWidget(self.loop_threshold)
+
+        layout.addWidget(QLabel('max instructions kept in the trace'))
+        self.trace_size = QLineEdit()
+        self.trace_size.setText(str(self._prefs.get(EMULATOR_TRACE_SIZE, DEFAULT_TRACE_SIZE)))
+        layout.addWidget(self.trace_size)
+
+        self.trace_registers = QCheckBox('track register changes in the trace')
+        self.trace_registers.setChecked(bool(self._prefs.get(EMULATOR_TRACE_REGISTERS, False)))
+        layout.addWidget(self.trace_registers)
+
+        self.trace_spill = QCheckBox('keep instructions dropped from the trace in a temporary file')
+        self.trace_spill.setChecked(bool(self._prefs.get(EMULATOR_TRACE_SPILL, False)))
+        layout.addWidget(self.trace_spill)
+
+        layout.addWidget(QLabel('trace start runs only in, hook free elsewhere (i.e 0x1000-0x2000)'))
+        self.trace_ranges = QLineEdit()
+        self.trace_ranges.setText(self._prefs.get(EMULATOR_TRACE_RANGES, ''))
+        layout.addWidget(self.trace_ranges)
+
+        layout.addWidget(QLabel('stream traced runs to a file (compressed, one per setup, named after the time)'))
+        self.trace_export_path = QLineEdit()
+        self.trace_export_path.setPlaceholderText('none')
+        self.trace_export_path.setText(self._prefs.get(EMULATOR_TRACE_EXPORT_PATH, ''))
+        layout.addWidget(self.trace_export_path)
+
+        layout.addWidget(QLabel('record memory accesses only in (i.e 0x1000-0x2000, 0x8000-0x9000)'))
+        self.access_filters = QLineEdit()
+        self.access_filters.setText(self._prefs.get(EMULATOR_ACCESS_FILTERS, ''))
+        layout.addWidget(self.access_filters)
+
+        layout.addWidget(QLabel('page cache size in MB (0 to disable, applied on restart)'))
+        self.page_cache_size = QLineEdit()
+        self.page_cache_size.setText(
+            str(int(self._prefs.get(EMULATOR_PAGE_CACHE_SIZE, DEFAULT_PAGE_CACHE_SIZE)) // (1024 * 1024)))
+        layout.addWidget(self.page_cache_size)
+
+        layout.addWidget(QLabel('max KB mapped per memory fault'))
+        self.fault_size = QLineEdit()
+        self.fault_size.setText(str(int(self._prefs.get(EMULATOR_FAULT_SIZE, DEFAULT_FAULT_SIZE)) // 1024))
+        layout.addWidget(self.fault_size)
+
+        layout.addWidget(QLabel('pages prefetched after a faulting page'))
+        self.prefetch_pages = QLineEdit()
+        self.prefetch_pages.setText(str(self._prefs.get(EMULATOR_PREFETCH_PAGES, DEFAULT_PREFETCH_PAGES)))
+        layout.addWidget(self.prefetch_pages)
+
         buttons = QHBoxLayout()
         cancel = QPushButton('cancel')
         cancel.clicked.connect(self.close)
@@ -63,6 +147,16 @@ class EmulatorConfigsDialog(QDialog):
             self._prefs.put(EMULATOR_CALLBACKS_PATH, r[0])
             self.callbacks_path_label.setText(r[0])
 
+    def pick_snapshot_path(self):
+        r = QFileDialog.getOpenFileName()
+        if len(r) > 0 and len(r[0]) > 0:
+            self._prefs.put(EMULATOR_SNAPSHOT_PATH, r[0])
+            self.snapshot_path_label.setText(r[0])
+
+    def clear_snapshot_path(self):
+        self._prefs.put(EMULATOR_SNAPSHOT_PATH, '')
+        self.snapshot_path_label.setText('none')
+
     @staticmethod
     def show_dialog(dwarf):
         dialog = EmulatorConfigsDialog(dwarf)
@@ -73,3 +167,44 @@ class EmulatorConfigsDialog(QDialog):
                 dialog._prefs.put(EMULATOR_INSTRUCTIONS_DELAY, float(dialog.instructions_delay.text()))
             except:
                 pass
+            try:
+                dialog._prefs.put(EMULATOR_TRACE_SIZE, int(dialog.trace_size.text()))
+            except:
+                pass
+            dialog._prefs.put(EMULATOR_TRACE_REGISTERS, dialog.trace_registers.isChecked())
+            dialog._prefs.put(EMULATOR_TRACE_SPILL, dialog.trace_spill.isChecked())
+            dialog._prefs.put(EMULATOR_TRACE_EXPORT_PATH, dialog.trace_export_path.text().strip())
+            try:
+                parse_ranges(dialog.access_filters.text())
+                dialog._prefs.put(EMULATOR_ACCESS_FILTERS, dialog.access_filters.text())
+            except ValueError:
+                pass
+            try:
+                parse_ranges(dialog.trace_ranges.text())
+                dialog._prefs.put(EMULATOR_TRACE_RANGES, dialog.trace_ranges.text())
+            except ValueError:
+                pass
+            try:
+                dialog._prefs.put(EMULATOR_PAGE_CACHE_SIZE, int(dialog.page_cache_size.text()) * 1024 * 1024)
+            except ValueError:
+                pass
+            try:
+                dialog._prefs.put(EMULATOR_FAULT_SIZE, int(dialog.fault_size.text()) * 1024)
+            except ValueError:
+                pass
+            try:
+                dialog._prefs.put(EMULATOR_PREFETCH_PAGES, int(dialog.prefetch_pages.text()))
+            except ValueError:
+                pass
+            try:
+                dialog._prefs.put(EMULATOR_MAX_INSTRUCTIONS, max(int(dialog.max_instructions.text()), 0))
+            except ValueError:
+                pass
+            try:
+                dialog._prefs.put(EMULATOR_RUN_TIMEOUT, max(int(dialog.run_timeout.text()), 0))
+            except ValueError:
+                pass
+            try:
+                dialog._prefs.put(EMULATOR_LOOP_THRESHOLD, max(int(dialog.loop_threshold.text()), 0))
+            except ValueError:
+                pass
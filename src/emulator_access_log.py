@@ -0,0 +1,87 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+from ucdwarf.src.emulator_trace import ColumnStore, DEFAULT_TRACE_SIZE
+from ucdwarf.src.emulator_trace_ranges import EmulatorTraceRanges
+
+
+def parse_ranges(text):
+    """
+    :param text: 'start-end' items separated by commas, i.e '0x1000-0x2000, 0x8000-0x9000'
+    :return: list of (start, end) tuples, end excluded
+    """
+    ranges = []
+    for item in text.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        start, end = item.split('-')
+        ranges.append((int(start.strip(), 0), int(end.strip(), 0)))
+    return ranges
+
+
+def format_ranges(ranges):
+    return ', '.join('0x%x-0x%x' % (start, end) for start, end in ranges)
+
+
+class EmulatorAccessLog(ColumnStore):
+    """
+    memory accesses: pc, address, size, kind (unicorn access) and value.
+    only accesses inside the range filters are recorded, everything if no filter is set.
+    overlapping filters are merged
+    """
+
+    def __init__(self, capacity=DEFAULT_TRACE_SIZE):
+        super().__init__([('pc', 'Q'), ('address', 'Q'), ('size', 'B'), ('kind', 'B'), ('value', 'Q')],
+                         capacity=capacity)
+        self._append_pc = self._columns[0].append
+        self._append_address = self._columns[1].append
+        self._append_size = self._columns[2].append
+        self._append_kind = self._columns[3].append
+        self._append_value = self._columns[4].append
+
+        self._filters = EmulatorTraceRanges()
+
+    @property
+    def filters(self):
+        return list(self._filters)
+
+    def set_filters(self, ranges):
+        self._filters.set(ranges)
+
+    def add_filter(self, start, end):
+        self._filters.add(start, end)
+
+    def clear_filters(self):
+        self._filters.clear()
+
+    def accepts(self, address):
+        return not self._filters or address in self._filters
+
+    def append(self, pc, address, size, kind, value):
+        self._append_pc(pc)
+        self._append_address(address)
+        self._append_size(size & 0xff)
+        self._append_kind(kind & 0xff)
+        self._append_value(value & 0xffffffffffffffff)
+        if len(self._columns[0]) >= self.capacity:
+            self._check_capacity()
+
+    def window(self, start, count):
+        """
+        :return: rows between the absolute index start and start + count, clamped to what is stored
+        """
+        return self[max(start, self.first):start + count]
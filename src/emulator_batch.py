@@ -0,0 +1,230 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import binascii
+import os
+import time
+
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+import capstone
+import unicorn
+
+from ucdwarf.src.emulator_checkpoints import EmulatorCheckpoints
+from ucdwarf.src.emulator_context import CURATED_REGISTERS, unicorn_registers
+from ucdwarf.src.emulator_limits import DEFAULT_BATCH_TIMEOUT
+from ucdwarf.src.emulator_snapshot import MemorySnapshot
+
+# dwarf arch -> unicorn arch, unicorn mode, capstone arch, capstone mode
+ARCHS = {
+    'arm': (unicorn.UC_ARCH_ARM, unicorn.UC_MODE_ARM, capstone.CS_ARCH_ARM, capstone.CS_MODE_ARM),
+    'arm64': (unicorn.UC_ARCH_ARM64, unicorn.UC_MODE_LITTLE_ENDIAN,
+              capstone.CS_ARCH_ARM64, capstone.CS_MODE_LITTLE_ENDIAN),
+    'ia32': (unicorn.UC_ARCH_X86, unicorn.UC_MODE_32, capstone.CS_ARCH_X86, capstone.CS_MODE_32),
+    'x64': (unicorn.UC_ARCH_X86, unicorn.UC_MODE_64, capstone.CS_ARCH_X86, capstone.CS_MODE_64),
+}
+
+PC_REGISTERS = {'arm': 'pc', 'arm64': 'pc', 'ia32': 'eip', 'x64': 'rip'}
+
+# the worker of the current process, see _init_worker
+_worker = None
+
+
+def _to_int(value):
+    if isinstance(value, str):
+        return int(value, 0)
+    return value
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return binascii.unhexlify(value)
+    return bytes(value)
+
+
+class BatchWorker(object):
+    """
+    one unicorn seeded from a snapshot. every run starts from the snapshot state, which is brought back
+    through a copy on write checkpoint instead of re-mapping memory
+    """
+
+    def __init__(self, snapshot_path):
+        self.snapshot = MemorySnapshot(snapshot_path)
+        self.arch = self.snapshot.arch
+        uc_arch, uc_mode, cs_arch, cs_mode = ARCHS[self.arch]
+        self.thumb = self.arch == 'arm' and self.snapshot.index.get('thumb', False)
+        if self.thumb:
+            uc_mode = unicorn.UC_MODE_THUMB
+            cs_mode = capstone.CS_MODE_THUMB
+
+        self.uc = unicorn.Uc(uc_arch, uc_mode)
+        self.cs = capstone.Cs(cs_arch, cs_mode)
+        self.snapshot.map_into(self.uc)
+
+        self.registers = unicorn_registers(self.arch)
+        for reg, value in self.snapshot.index.get('registers', {}).items():
+            self.write_register(reg, value)
+
+        self.checkpoints = EmulatorCheckpoints()
+        self.base = self.checkpoints.create(self.uc)
+
+        # block address -> instructions in the block
+        self._block_sizes = {}
+        self._instructions = 0
+        self.uc.hook_add(unicorn.UC_HOOK_BLOCK, self._on_block)
+        # only what the parent emulator had mapped is in the snapshot, there is no target to read the rest from
+        self._unmapped = None
+        self.uc.hook_add(unicorn.UC_HOOK_MEM_UNMAPPED, self._on_unmapped)
+
+    def write_register(self, reg, value):
+        if reg not in self.registers:
+            return False
+        try:
+            self.uc.reg_write(self.registers[reg], _to_int(value))
+        except (unicorn.UcError, TypeError, ValueError):
+            return False
+        return True
+
+    def _on_block(self, uc, address, size, user_data):
+        count = self._block_sizes.get(address)
+        if count is None:
+            try:
+                count = sum(1 for _ in self.cs.disasm_lite(bytes(uc.mem_read(address, size)), address))
+            except unicorn.UcError:
+                count = 0
+            self._block_sizes[address] = count
+        self._instructions += count
+
+    def _on_unmapped(self, uc, access, address, size, value, user_data):
+        self._unmapped = address
+        return False
+
+    def run(self, variation, until=0, count=0, timeout=0):
+        """
+        :param variation: {registers: {name: value}, memory: {address: hex}, read: [[address, size]]}
+        :param timeout: DEFAULT_BATCH_TIMEOUT when there is neither a count nor a timeout
+        :return: {registers, memory, instructions, time, error, unmapped}. unmapped is the address of
+                 a page the parent emulator never mapped, which stops the run
+        """
+        for reg, value in variation.get('registers', {}).items():
+            self.write_register(reg, value)
+        for address, data in variation.get('memory', {}).items():
+            address = _to_int(address)
+            data = _to_bytes(data)
+            self.checkpoints.touch(self.uc, address, len(data))
+            self.uc.mem_write(address, data)
+
+        start = self.uc.reg_read(self.registers[PC_REGISTERS[self.arch]])
+        if self.thumb:
+            start |= 1
+        until = _to_int(variation.get('until', until)) or 0xffffffffffffffff
+        if self.thumb:
+            # unicorn stops on the address without the thumb bit
+            until &= ~1
+
+        if not count and not timeout:
+            timeout = DEFAULT_BATCH_TIMEOUT
+
+        self._instructions = 0
+        self._unmapped = None
+        error = None
+        started = time.perf_counter()
+        # no memory hook, the written pages are found by comparing memory
+        self.checkpoints.begin_run(self.uc, hooked=False)
+        try:
+            self.uc.emu_start(start, until, timeout=timeout * 1000, count=count)
+        except unicorn.UcError as e:
+            error = str(e)
+            if self._unmapped is not None:
+                error = 'unmapped memory at %s, not mapped by the emulator before the batch' % hex(self._unmapped)
+        elapsed = time.perf_counter() - started
+        self.checkpoints.end_run(self.uc)
+
+        result = {
+            'registers': {reg: self.uc.reg_read(self.registers[reg])
+                          for reg in CURATED_REGISTERS[self.arch] if reg in self.registers},
+            'memory': {},
+            'instructions': self._instructions,
+            'time': elapsed,
+            'error': error,
+            'unmapped': self._unmapped
+        }
+        for address, size in variation.get('read', []):
+            address = _to_int(address)
+            try:
+                result['memory'][hex(address)] = bytes(self.uc.mem_read(address, size)).hex()
+            except unicorn.UcError:
+                result['memory'][hex(address)] = None
+
+        self.checkpoints.restore(self.uc, self.base)
+        return result
+
+
+def _init_worker(snapshot_path):
+    global _worker
+    _worker = BatchWorker(snapshot_path)
+
+
+def _run_variation(args):
+    variation, until, count, timeout = args
+    try:
+        return _worker.run(variation, until=until, count=count, timeout=timeout)
+    except Exception as e:
+        return {'error': str(e)}
+
+
+class EmulatorBatchRunner(object):
+    """
+    run the same emulation over many input variations, fanned out over a process pool.
+    every worker builds its own unicorn from the shared snapshot file
+    """
+
+    def __init__(self, snapshot_path, workers=None):
+        self.snapshot_path = snapshot_path
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+
+    def run(self, variations, until=0, count=0, timeout=0):
+        """
+        :param until: end address, unless a variation has its own
+        :param count: max instructions per run
+        :param timeout: max milliseconds per run
+        :return: one result per variation, in order. variations dropped by cancel() have a 'cancelled' error
+        """
+        jobs = [(variation, until, count, timeout) for variation in variations]
+        if not jobs:
+            return []
+        workers = min(self.workers, len(jobs))
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.snapshot_path,)) as pool:
+            self._pool = pool
+            try:
+                for result in pool.map(_run_variation, jobs, chunksize=max(1, len(jobs) // (workers * 4))):
+                    results.append(result)
+            except CancelledError:
+                pass
+            finally:
+                self._pool = None
+        return results + [{'error': 'cancelled'}] * (len(jobs) - len(results))
+
+    def cancel(self):
+        """
+        drop the variations which didn't start, the running ones end within their limits. any thread
+        """
+        pool = self._pool
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,149 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import os
+
+from importlib._bootstrap import spec_from_loader, module_from_spec
+from importlib._bootstrap_external import SourceFileLoader
+
+import unicorn
+
+HOOK_CODE = 'code'
+HOOK_MEMORY = 'memory'
+
+# callbacks module function of each hook
+HOOK_FUNCTIONS = {
+    HOOK_CODE: 'hook_code',
+    HOOK_MEMORY: 'hook_memory_access',
+}
+
+
+def _parse_ranges(ranges):
+    """
+    :param ranges: [(start, end)], end excluded. ints or strings
+    :return: [(start, end)] or None for the whole address space
+    """
+    if not ranges:
+        return None
+    parsed = []
+    for start, end in ranges:
+        start = int(start, 0) if isinstance(start, str) else start
+        end = int(end, 0) if isinstance(end, str) else end
+        if end > start:
+            parsed.append((start, end))
+    return parsed
+
+
+class EmulatorCallbacks(object):
+    """
+    the user callbacks module, executed once and again only when the file changes.
+
+    hooks are the functions the module defines, hook_code(emulator, instruction, address, size) and
+    hook_memory_access(emulator, access, address, size, value). optionally the module declares:
+
+        HOOKS = ['code']                # hooks to install, the defined functions otherwise
+        CODE_RANGES = [(start, end)]    # pc ranges of hook_code, end excluded
+        MEMORY_RANGES = [(start, end)]  # accessed addresses of hook_memory_access
+        RANGES = [(start, end)]         # both, when the specific one is missing
+
+    unicorn only calls back inside the declared ranges
+    """
+
+    def __init__(self):
+        self.path = ''
+        self.module = None
+        self.hooks = {}
+        self.ranges = {}
+        self.loads = 0
+        self._mtime = None
+        self._uc = None
+        self._handles = []
+
+    def load(self, path):
+        """
+        :return: True when the module was (re)loaded. raises if the module can't be executed
+        """
+        if not path:
+            self.unload()
+            return False
+
+        mtime = os.stat(path).st_mtime_ns
+        if path == self.path and mtime == self._mtime:
+            return False
+
+        self.unload()
+        spec = spec_from_loader('callbacks', SourceFileLoader('callbacks', path))
+        module = module_from_spec(spec)
+        spec.loader.exec_module(module)
+
+        declared = getattr(module, 'HOOKS', None)
+        hooks = {}
+        ranges = {}
+        for hook, name in HOOK_FUNCTIONS.items():
+            fn = getattr(module, name, None)
+            if not callable(fn) or (declared is not None and hook not in declared):
+                continue
+            hooks[hook] = fn
+            ranges[hook] = _parse_ranges(getattr(module, hook.upper() + '_RANGES', None) or
+                                         getattr(module, 'RANGES', None))
+
+        self.path = path
+        self.module = module
+        self.hooks = hooks
+        self.ranges = ranges
+        self.loads += 1
+        self._mtime = mtime
+        return True
+
+    def unload(self):
+        self.path = ''
+        self.module = None
+        self.hooks = {}
+        self.ranges = {}
+        self._mtime = None
+
+    def __contains__(self, hook):
+        return hook in self.hooks
+
+    def __call__(self, hook, *args):
+        return self.hooks[hook](*args)
+
+    def install(self, uc, on_code, on_memory):
+        """
+        one unicorn hook per declared range and hook, see remove
+        """
+        self.remove()
+        self._uc = uc
+        for hook, uc_hook, callback in [(HOOK_CODE, unicorn.UC_HOOK_CODE, on_code),
+                                        (HOOK_MEMORY, unicorn.UC_HOOK_MEM_READ | unicorn.UC_HOOK_MEM_WRITE, on_memory)]:
+            if hook not in self.hooks:
+                continue
+            ranges = self.ranges[hook]
+            if ranges is None:
+                self._handles.append(uc.hook_add(uc_hook, callback))
+                continue
+            for start, end in ranges:
+                # unicorn end is included
+                self._handles.append(uc.hook_add(uc_hook, callback, begin=start, end=end - 1))
+
+    def remove(self):
+        for handle in self._handles:
+            try:
+                self._uc.hook_del(handle)
+            except unicorn.UcError:
+                pass
+        self._handles = []
+        self._uc = None
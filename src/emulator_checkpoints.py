@@ -0,0 +1,217 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import zlib
+
+from array import array
+from collections import OrderedDict
+
+import unicorn
+
+PAGE_SIZE = 0x1000
+PAGE_MASK = PAGE_SIZE - 1
+
+# pages read at once when comparing a region with its reference
+COMPARE_CHUNK_PAGES = 256
+
+
+class Checkpoint(object):
+    def __init__(self, checkpoint_id, context):
+        self.id = checkpoint_id
+        self.context = context
+        # page -> content when the checkpoint was taken, saved on the first write after it
+        self.pages = {}
+
+
+class EmulatorCheckpoints(object):
+    """
+    cpu state through uc.context_save plus copy on write memory.
+
+    while at least one checkpoint exists the original content of a page is saved the first time it is written,
+    so restore only rewrites the pages that changed. runs with a memory hook announce their writes with touch(),
+    which is called before unicorn writes. hook free runs are wrapped by begin_run() and end_run(): the pages
+    of the writable regions are compared with their digest when the newest checkpoint was taken, the original
+    content is kept compressed and only expanded for the pages that changed.
+    writes done outside emulation (uc.mem_write) must be announced with touch()
+    """
+
+    def __init__(self):
+        self._checkpoints = OrderedDict()
+        self._next_id = 1
+        self._uc = None
+        # (begin, end) -> crc32 of every page of the writable regions when the newest checkpoint was taken,
+        # built by the first hook free run
+        self._reference = None
+        # (begin, end) -> compressed content of the region when its digests were taken
+        self._blobs = {}
+        # page -> reference content when it differs from the blob
+        self._patched = {}
+        self._comparing = False
+
+    def __len__(self):
+        return len(self._checkpoints)
+
+    def __contains__(self, checkpoint_id):
+        return checkpoint_id in self._checkpoints
+
+    def ids(self):
+        return list(self._checkpoints.keys())
+
+    def create(self, uc):
+        if self._uc is not uc:
+            self.clear()
+            self._uc = uc
+
+        checkpoint = Checkpoint(self._next_id, uc.context_save())
+        self._next_id += 1
+        self._checkpoints[checkpoint.id] = checkpoint
+        self._drop_reference()
+        return checkpoint.id
+
+    def touch(self, uc, address, size):
+        if not self._checkpoints:
+            return
+        newest = next(reversed(self._checkpoints.values()))
+        first = address & ~PAGE_MASK
+        last = (address + max(size, 1) - 1) & ~PAGE_MASK
+        for page in range(first, last + PAGE_SIZE, PAGE_SIZE):
+            if page in newest.pages:
+                # already saved by every checkpoint
+                continue
+            try:
+                data = bytes(uc.mem_read(page, PAGE_SIZE))
+            except unicorn.UcError:
+                continue
+            self._save(page, data)
+
+    def _save(self, page, data):
+        for checkpoint in self._checkpoints.values():
+            if page not in checkpoint.pages:
+                checkpoint.pages[page] = data
+
+    def begin_run(self, uc, hooked):
+        """
+        :param hooked: the run has a memory hook calling touch() on writes
+        """
+        self._comparing = not hooked and len(self._checkpoints) > 0 and self._uc is uc
+        if not self._comparing or self._reference is not None:
+            return
+        # what changed since the newest checkpoint is saved in its pages
+        self._reference = {}
+        self.mapped(uc)
+        for page, data in next(reversed(self._checkpoints.values())).pages.items():
+            self._patch_reference(page, data)
+
+    def mapped(self, uc):
+        """
+        add the regions mapped since the reference was taken, while their content is still the original one
+        """
+        if self._reference is None:
+            return
+        for begin, end, perms in uc.mem_regions():
+            if not perms & unicorn.UC_PROT_WRITE or (begin, end) in self._reference:
+                continue
+            try:
+                data = uc.mem_read(begin, end - begin + 1)
+            except unicorn.UcError:
+                continue
+            view = memoryview(data)
+            self._reference[(begin, end)] = array('I', (zlib.crc32(view[offset:offset + PAGE_SIZE])
+                                                        for offset in range(0, len(data), PAGE_SIZE)))
+            self._blobs[(begin, end)] = zlib.compress(data, 1)
+
+    def _drop_reference(self):
+        self._reference = None
+        self._blobs = {}
+        self._patched = {}
+
+    def _patch_reference(self, page, data):
+        for (begin, end), digests in self._reference.items():
+            if begin <= page <= end:
+                index = (page - begin) // PAGE_SIZE
+                digest = zlib.crc32(data)
+                if digests[index] != digest:
+                    digests[index] = digest
+                    self._patched[page] = bytes(data)
+                return
+
+    def end_run(self, uc):
+        """
+        save the pages a hook free run changed
+        :return: number of changed pages
+        """
+        if not self._comparing:
+            return 0
+        self._comparing = False
+        newest = next(reversed(self._checkpoints.values()))
+        changed = {}
+        for region, digests in self._reference.items():
+            begin = region[0]
+            for first in range(0, len(digests), COMPARE_CHUNK_PAGES):
+                count = min(COMPARE_CHUNK_PAGES, len(digests) - first)
+                try:
+                    after = memoryview(uc.mem_read(begin + first * PAGE_SIZE, count * PAGE_SIZE))
+                except unicorn.UcError:
+                    continue
+                for index in range(first, first + count):
+                    offset = (index - first) * PAGE_SIZE
+                    if zlib.crc32(after[offset:offset + PAGE_SIZE]) != digests[index]:
+                        page = begin + index * PAGE_SIZE
+                        if page not in newest.pages:
+                            changed.setdefault(region, []).append(page)
+
+        saved = 0
+        for region, pages in changed.items():
+            content = None
+            for page in pages:
+                data = self._patched.get(page)
+                if data is None:
+                    if content is None:
+                        content = zlib.decompress(self._blobs[region])
+                    data = content[page - region[0]:page - region[0] + PAGE_SIZE]
+                self._save(page, data)
+                saved += 1
+        return saved
+
+    def restore(self, uc, checkpoint_id):
+        """
+        :return: number of pages rewritten
+        """
+        checkpoint = self._checkpoints[checkpoint_id]
+        for page, data in checkpoint.pages.items():
+            uc.mem_write(page, data)
+            if self._reference is not None:
+                # the reference becomes the content when this checkpoint was taken
+                self._patch_reference(page, data)
+        uc.context_restore(checkpoint.context)
+
+        # newer checkpoints describe a future which is gone
+        for newer in [i for i in self._checkpoints if i > checkpoint_id]:
+            del self._checkpoints[newer]
+        restored = len(checkpoint.pages)
+        checkpoint.pages = {}
+        return restored
+
+    def remove(self, checkpoint_id):
+        self._checkpoints.pop(checkpoint_id, None)
+        # the reference may belong to the removed checkpoint
+        self._drop_reference()
+
+    def clear(self):
+        self._checkpoints.clear()
+        self._drop_reference()
+        self._comparing = False
+        self._uc = None
@@ -1,37 +1,121 @@
 from unicorn import unicorn
 
 
+# registers refreshed on every set_context, anything else is read from unicorn on access
+CURATED_REGISTERS = {
+    'arm': ['r%d' % i for i in range(13)] + ['sp', 'lr', 'pc', 'cpsr'],
+    'arm64': ['x%d' % i for i in range(31)] + ['sp', 'pc', 'nzcv'],
+    'ia32': ['eax', 'ebx', 'ecx', 'edx', 'esi', 'edi', 'ebp', 'esp', 'eip', 'eflags'],
+    'x64': ['rax', 'rbx', 'rcx', 'rdx', 'rsi', 'rdi', 'rbp', 'rsp'] +
+           ['r%d' % i for i in range(8, 16)] + ['rip', 'rflags'],
+}
+
+
+def unicorn_registers(arch):
+    """
+    :return: dict register name -> unicorn register id for a dwarf arch
+    """
+    import unicorn
+
+    # map unicorn registers for the correct arch
+    if arch == 'arm':
+        unicorn_consts = unicorn.arm_const
+    elif arch == 'arm64':
+        unicorn_consts = unicorn.arm64_const
+    elif arch == 'ia32' or arch == 'x64':
+        unicorn_consts = unicorn.x86_const
+    else:
+        raise Exception('unsupported arch')
+
+    registers = {}
+    for v in unicorn_consts.__dict__:
+        if '_REG_' in v:
+            reg = v.lower().split('_')[-1]
+            if reg == 'invalid' or reg == 'ending':
+                continue
+            registers[reg] = unicorn_consts.__dict__[v]
+    return registers
+
+
 class EmulatorContext(object):
     """
     holds emulator context related stuffs
+
+    set_context only reads the curated register set of the arch (in a single batch when unicorn supports it).
+    other registers are read lazily on attribute access, materialize() reads the full snapshot
     """
 
-    def __init__(self, dwarf):
-        import unicorn
-
-        # map unicorn registers for the correct arch
-        if dwarf.arch == 'arm':
-            unicorn_consts = unicorn.arm_const
-        elif dwarf.arch == 'arm64':
-            unicorn_consts = unicorn.arm64_const
-        elif dwarf.arch == 'ia32' or dwarf.arch == 'x64':
-            unicorn_consts = unicorn.x86_const
-        else:
-            raise Exception('unsupported arch')
-
-        self._unicorn_registers = {}
-
-        for v in unicorn_consts.__dict__:
-            if '_REG_' in v:
-                reg = v.lower().split('_')[-1]
-                if reg == 'invalid' or reg == 'ending':
-                    continue
-                self.__dict__[reg] = 0
-                self._unicorn_registers[reg] = unicorn_consts.__dict__[v]
+    def __init__(self, arch):
+        self._uc = None
+        self._arch = arch
+        self._unicorn_registers = unicorn_registers(arch)
+        # registers unicorn refused to read once. we don't try them again
+        self._unreadable = set()
+        # lazily read registers, dropped on the next set_context
+        self._lazy = []
+
+        self._curated = [reg for reg in CURATED_REGISTERS[arch] if reg in self._unicorn_registers]
+        self._curated_ids = [self._unicorn_registers[reg] for reg in self._curated]
+        for reg in self._curated:
+            self.__dict__[reg] = 0
+        self._values = [0] * len(self._curated)
+
+    def __getattr__(self, name):
+        # only reached for registers which are not part of the current snapshot
+        if name.startswith('_') or name not in self.__dict__.get('_unicorn_registers', {}):
+            raise AttributeError(name)
+        value = self._read_register(name)
+        self.__dict__[name] = value
+        self._lazy.append(name)
+        return value
+
+    def _read_register(self, reg):
+        if self._uc is None or reg in self._unreadable:
+            return 0
+        try:
+            return self._uc.reg_read(self._unicorn_registers[reg])
+        except unicorn.UcError:
+            self._unreadable.add(reg)
+            return 0
 
     def set_context(self, uc):
+        self._uc = uc
+
+        for reg in self._lazy:
+            self.__dict__.pop(reg, None)
+        self._lazy = []
+
+        try:
+            values = uc.reg_read_batch(self._curated_ids)
+        except AttributeError:
+            # unicorn < 2.1
+            values = [uc.reg_read(reg_id) for reg_id in self._curated_ids]
+        self.__dict__.update(zip(self._curated, values))
+        self._values = values
+
+    def materialize(self):
+        """
+        read every register of the arch, needed by anything iterating the context __dict__
+        """
         for reg in self._unicorn_registers:
-            try:
-                self.__dict__[reg] = uc.reg_read(self._unicorn_registers[reg])
-            except unicorn.UcError:
-                pass
+            if reg not in self.__dict__:
+                getattr(self, reg)
+        return self
+
+    def registers(self):
+        """
+        :return: dict with the curated registers of the current snapshot
+        """
+        return {reg: self.__dict__[reg] for reg in self._curated}
+
+    def curated(self):
+        """
+        :return: names of the curated registers, in the order of values()
+        """
+        return list(self._curated)
+
+    def values(self):
+        """
+        :return: values of the curated registers as read by the last set_context
+        """
+        return self._values
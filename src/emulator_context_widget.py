@@ -4,6 +4,9 @@ from PyQt5.QtWidgets import QHeaderView, QMenu
 
 from dwarf.ui.widgets.list_view import DwarfListView
 
+# values changed by the last step or run
+CHANGED_COLOR = QColor('#ef5350')
+
 
 class EmulatorContextList(DwarfListView):
     def __init__(self, parent):
@@ -26,6 +29,15 @@ class EmulatorContextList(DwarfListView):
         self.setContextMenuPolicy(Qt.CustomContextMenu)
         self.customContextMenuRequested.connect(self._on_emulator_contextmenu)
 
+        # arch -> registers shown, in order
+        self._sorted = {}
+        # one persistent row per register, only changed values are written
+        self._registers = None
+        self._values = []
+        self._changed = set()
+        self._first_snapshot = True
+        self._ptr = 0
+
     def _on_emulator_contextmenu(self, pos):
         index = self.indexAt(pos).row()
         glbl_pt = self.mapToGlobal(pos)
@@ -35,38 +47,79 @@ class EmulatorContextList(DwarfListView):
             context_menu.exec_(glbl_pt)
 
     def set_context(self, ptr, context):
-        self._emulatorctx_model.setRowCount(0)
-
         self.context_tab_widget.setCurrentIndex(self.context_tab_widget.indexOf(self))
 
-        context_ptr = ptr
-        context = context.__dict__
+        registers = self._sorted_registers(context)
+        if registers is not self._registers:
+            self._build_rows(registers)
 
-        sorted_regs = self.context_tab_widget.get_sort_order()
-
-        for register in sorted(context, key=lambda x: sorted_regs[x] if x in sorted_regs else len(sorted_regs)):
-            if register.startswith('_') or register not in sorted_regs:
+        changed = []
+        for row, register in enumerate(registers):
+            # only the shown registers are read, not the hundreds of unicorn constants
+            value = getattr(context, register, None)
+            if value == self._values[row]:
                 continue
-
+            self._values[row] = value
+            value_x = self._emulatorctx_model.item(row, 1)
+            value_dec = self._emulatorctx_model.item(row, 2)
+            if isinstance(value, int):
+                str_fmt = '0x{0:x}'
+                if self.uppercase_hex:
+                    str_fmt = '0x{0:X}'
+                value_x.setText(str_fmt.format(value))
+                value_dec.setText('{0:d}'.format(value))
+            else:
+                value_x.setText('')
+                value_dec.setText('')
+            changed.append(row)
+
+        if self._ptr != ptr:
+            self._ptr = ptr
+            for row in range(len(registers)):
+                self._emulatorctx_model.item(row, 0).setData(ptr, Qt.UserRole + 1)
+
+        # highlight what changed since the previous snapshot, the first one excluded
+        if self._first_snapshot:
+            self._first_snapshot = False
+            changed = []
+        for row in self._changed.difference(changed):
+            self._set_highlight(row, False)
+        for row in changed:
+            self._set_highlight(row, True)
+        self._changed = set(changed)
+
+    def _sorted_registers(self, context):
+        """
+        registers shown for the arch of context, in the order of the dwarf context widget.
+        computed once per arch
+        """
+        arch = context._arch
+        registers = self._sorted.get(arch)
+        if registers is None:
+            sorted_regs = self.context_tab_widget.get_sort_order()
+            registers = sorted((register for register in context._unicorn_registers if register in sorted_regs),
+                               key=lambda x: sorted_regs[x])
+            self._sorted[arch] = registers
+        return registers
+
+    def _build_rows(self, registers):
+        self._emulatorctx_model.setRowCount(0)
+        for register in registers:
             reg_name = QStandardItem()
             reg_name.setTextAlignment(Qt.AlignCenter)
             reg_name.setForeground(QColor('#39c'))
-            value_x = QStandardItem()
-            # value_x.setTextAlignment(Qt.AlignCenter)
-            value_dec = QStandardItem()
-            # value_dec.setTextAlignment(Qt.AlignCenter)
-
             reg_name.setText(register)
-            reg_name.setData(context_ptr, Qt.UserRole + 1)
-
-            if context[register] is not None:
-                if isinstance(context[register], int):
-                    str_fmt = '0x{0:x}'
-                    if self.uppercase_hex:
-                        str_fmt = '0x{0:X}'
-                    value_x.setText(str_fmt.format(context[register]))
-                    value_dec.setText('{0:d}'.format(context[register]))
-
-            self._emulatorctx_model.appendRow([reg_name, value_x, value_dec])
-            self.resizeColumnToContents(0)
-            self.resizeColumnToContents(1)
+            reg_name.setData(self._ptr, Qt.UserRole + 1)
+            self._emulatorctx_model.appendRow([reg_name, QStandardItem(), QStandardItem()])
+        self._registers = registers
+        self._values = [None] * len(registers)
+        self._changed = set()
+        self._first_snapshot = True
+
+    def _set_highlight(self, row, highlight):
+        for column in (1, 2):
+            item = self._emulatorctx_model.item(row, column)
+            if highlight:
+                item.setForeground(CHANGED_COLOR)
+            else:
+                item.setData(None, Qt.ForegroundRole)
@@ -0,0 +1,1716 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import binascii
+import json
+import os
+import tempfile
+import time
+import zlib
+
+import capstone
+import unicorn
+
+from capstone import (Cs, CS_ARCH_ARM, CS_ARCH_ARM64, CS_ARCH_X86, CS_MODE_32,
+                      CS_MODE_64, CS_MODE_ARM, CS_MODE_THUMB,
+                      CS_MODE_LITTLE_ENDIAN)
+from ucdwarf.src.emulator_batch import EmulatorBatchRunner
+from ucdwarf.src.emulator_callbacks import EmulatorCallbacks, HOOK_CODE, HOOK_MEMORY
+from ucdwarf.src.emulator_checkpoints import EmulatorCheckpoints
+from ucdwarf.src.emulator_access_log import EmulatorAccessLog, format_ranges, parse_ranges
+from ucdwarf.src.emulator_context import EmulatorContext
+from ucdwarf.src.emulator_disasm_cache import EmulatorDisasmCache
+from ucdwarf.src.emulator_limits import (EmulatorLoopDetector, min_limit, DEFAULT_MAX_INSTRUCTIONS,
+                                         DEFAULT_RUN_TIMEOUT, DEFAULT_LOOP_THRESHOLD, STOP_END, STOP_STEP,
+                                         STOP_COUNT, STOP_TIMEOUT, STOP_LOOP, STOP_ERROR, STOP_USER)
+from ucdwarf.src.emulator_profiler import EmulatorProfiler
+from ucdwarf.src.emulator_page_cache import (EmulatorPageCache, EmulatorSessionPageCache, PAGE_SIZE,
+                                             DEFAULT_PAGE_CACHE_SIZE, page_key, persistent_page)
+from ucdwarf.src.emulator_snapshot import MemorySnapshot
+from ucdwarf.src.emulator_stats import EmulatorStats
+from ucdwarf.src.emulator_telescope import EmulatorTelescope
+from ucdwarf.src.emulator_pager import EmulatorPager, page_runs, DEFAULT_FAULT_SIZE, DEFAULT_PREFETCH_PAGES
+from ucdwarf.src.emulator_trace import EmulatorTrace, DEFAULT_TRACE_SIZE
+from ucdwarf.src.emulator_trace_export import EmulatorTraceWriter, setup_export_path
+from ucdwarf.src.emulator_trace_ranges import EmulatorTraceRanges
+
+# configuration keys, stored in the dwarf prefs when running inside dwarf
+EMULATOR_CALLBACKS_PATH = 'emulator_callbacks_path'
+EMULATOR_INSTRUCTIONS_DELAY = 'emulator_instructions_delay'
+EMULATOR_TRACE_SIZE = 'emulator_trace_size'
+EMULATOR_TRACE_REGISTERS = 'emulator_trace_registers'
+EMULATOR_ACCESS_FILTERS = 'emulator_access_filters'
+EMULATOR_PAGE_CACHE_SIZE = 'emulator_page_cache_size'
+EMULATOR_FAULT_SIZE = 'emulator_fault_size'
+EMULATOR_PREFETCH_PAGES = 'emulator_prefetch_pages'
+EMULATOR_SNAPSHOT_PATH = 'emulator_snapshot_path'
+EMULATOR_MAX_INSTRUCTIONS = 'emulator_max_instructions'
+EMULATOR_RUN_TIMEOUT = 'emulator_run_timeout'
+EMULATOR_LOOP_THRESHOLD = 'emulator_loop_threshold'
+EMULATOR_TRACE_RANGES = 'emulator_trace_ranges'
+EMULATOR_TRACE_SPILL = 'emulator_trace_spill'
+EMULATOR_TRACE_EXPORT_PATH = 'emulator_trace_export_path'
+
+VFP = "4ff4700001ee500fbff36f8f4ff08043e8ee103a"
+
+STEP_MODE_NONE = 0
+STEP_MODE_SINGLE = 1
+STEP_MODE_FUNCTION = 2
+
+# events delivered to the listeners in batches through on_emulator_events
+# [EVENT_INSTRUCTION, instruction, {reg_name: value}, trace index] - values of the previous instruction
+#                                                                  register operands
+# [EVENT_MEMORY, access, address, value, trace index of the accessing instruction]
+EVENT_INSTRUCTION = 0
+EVENT_MEMORY = 1
+
+# flush pending events at ~30hz or when the batch is big enough
+EVENTS_FLUSH_INTERVAL = 1 / 30
+EVENTS_FLUSH_SIZE = 4096
+
+# instruction count of unbounded scoped run segments, unicorn has to count for the single instruction ones
+SCOPED_RUN_COUNT = 1 << 62
+
+
+class EmulatorListener(object):
+    """
+    receives everything the emulator reports. methods are called from the thread running the emulation
+    """
+
+    def on_emulator_setup(self, args):
+        pass
+
+    def on_emulator_start(self):
+        pass
+
+    def on_emulator_stop(self):
+        pass
+
+    def on_emulator_events(self, events):
+        pass
+
+    def on_emulator_range_mapped(self, range_):
+        pass
+
+    def on_emulator_log(self, what):
+        pass
+
+
+class EmulatorConfig(dict):
+    """
+    configuration store used when no dwarf prefs are around. same get/put interface
+    """
+
+    def put(self, key, value):
+        self[key] = value
+
+
+class ContextProvider(object):
+    """
+    arch and thread contexts of the target. a context exposes its registers as attributes
+    with a value (and thumb for arm pc) and is_native_context
+    """
+
+    arch = None
+    pid = 0
+
+    def current_tid(self):
+        return 0
+
+    def get_context(self, tid):
+        return None
+
+
+class MemoryProvider(object):
+    """
+    target memory. everything is optional, the emulator only maps what it gets
+    """
+
+    def read_ranges(self, runs):
+        """
+        :param runs: [(address, size)]
+        :return: [(address, data)] of the readable parts
+        """
+        return []
+
+    def describe_pages(self, pages):
+        """
+        :return: one {base, size, protection, file, offset} (or None) per page
+        """
+        return [None] * len(pages)
+
+    def enumerate_ranges(self):
+        """
+        :return: [{base, size, protection, file}] of every readable range
+        """
+        return []
+
+
+class EmulatorInstruction(object):
+    """
+    capstone instruction plus the control flow details the emulator needs.
+    anything else is read from the capstone instruction
+    """
+
+    def __init__(self, arch, insn, context=None, thumb=False):
+        self._insn = insn
+        self.thumb = thumb
+        self.is_jump = False
+        self.is_call = False
+        self.jump_address = 0
+        self.call_address = 0
+        self.should_change_arm_instruction_set = False
+
+        groups = insn.groups
+        self.is_call = capstone.CS_GRP_CALL in groups
+        self.is_jump = not self.is_call and (capstone.CS_GRP_JUMP in groups or capstone.CS_GRP_RET in groups)
+        if not self.is_jump and not self.is_call:
+            return
+
+        target = 0
+        for op in insn.operands:
+            if op.type == capstone.CS_OP_IMM:
+                target = op.value.imm
+                break
+            elif op.type == capstone.CS_OP_REG and context is not None:
+                target = getattr(context, insn.reg_name(op.value.reg), 0) or 0
+                break
+        if self.is_call:
+            self.call_address = target
+        else:
+            self.jump_address = target
+
+        if arch == 'arm' and insn.mnemonic.startswith(('bx', 'blx')):
+            if insn.mnemonic.startswith('blx') and insn.operands and \
+                    insn.operands[0].type == capstone.CS_OP_IMM:
+                # blx imm always switches
+                self.should_change_arm_instruction_set = True
+            else:
+                self.should_change_arm_instruction_set = (target & 1 == 1) != thumb
+
+    def __getattr__(self, name):
+        return getattr(self._insn, name)
+
+
+class EmulatorCore(object):
+    """
+    the emulation engine, without qt and dwarf.
+
+    target memory and contexts come from the providers, configuration from a get/put store
+    and everything happening is reported to the listeners. emulate() runs synchronously unless
+    a launcher is set, in which case the launcher is expected to call run() (i.e from a thread)
+    """
+
+    class EmulatorSetupFailedError(Exception):
+        """ Setup Failed
+        """
+
+    class EmulatorAlreadyRunningError(Exception):
+        """ isrunning
+        """
+
+    # setup errors
+    ERR_INVALID_TID = 1
+    ERR_INVALID_CONTEXT = 2
+    ERR_SETUP_FAILED = 3
+
+    def __init__(self, context_provider=None, memory_provider=None, config=None, listener=None,
+                 instruction_factory=None):
+        self.context_provider = context_provider or ContextProvider()
+        self.memory_provider = memory_provider or MemoryProvider()
+        self.config = config if config is not None else EmulatorConfig()
+        self.listeners = []
+        if listener is not None:
+            self.listeners.append(listener)
+        # (capstone instruction, context) -> instruction reported to listeners and callbacks
+        self.instruction_factory = instruction_factory or self._build_instruction
+        # called by emulate() instead of running in place
+        self.launcher = None
+
+        self._setup_done = False
+        self._running = False
+        self._blacklist_regs = []
+
+        self.cs = None
+        self.uc = None
+
+        self.context = None
+        self.thumb = False
+        self.end_ptr = 0
+        self.step_mode = STEP_MODE_NONE
+
+        self.current_context = None
+
+        # decoded instructions, invalidated by emulated writes into code pages
+        self.disasm_cache = EmulatorDisasmCache()
+        # executed instructions, read by views and scripts
+        self.trace = EmulatorTrace()
+        # memory accesses inside the configured filters
+        self.access_log = EmulatorAccessLog()
+        # what addresses point to, dropped by emulated writes
+        self.telescope = EmulatorTelescope(self._read_target)
+        # code traced by start runs, everything else runs hook free
+        self.trace_ranges = EmulatorTraceRanges()
+        self._scoped_run = False
+        # scoped runs, see _run_scoped: whether the running segment is traced, stopped at a boundary,
+        # the instruction running alone as it may leave the ranges
+        self._segment_traced = False
+        self._segment_exit = False
+        self._exit_step = None
+        self._leave_cache = {}
+        # traced runs streamed to a file, see start_export
+        self.trace_export = None
+        self.trace_export_path = ''
+        # target code pages kept on disk across sessions, other read only pages in memory for this target
+        self.page_cache = None
+        self.session_pages = EmulatorSessionPageCache()
+        # demand paging, target memory is mapped synchronously when unicorn faults
+        self.pager = EmulatorPager(self._read_target_pages)
+        # saved cpu states with copy on write memory
+        self.checkpoints = EmulatorCheckpoints()
+        # batch in progress, see run_batch
+        self._batch = None
+        # full memory snapshot the unicorn instance is seeded from, if any
+        self.snapshot_path = ''
+        self.snapshot = None
+        # counters and timings, see stats()
+        self.stats = EmulatorStats()
+        # executions per basic block, see profile_modules()
+        self.profiler = EmulatorProfiler()
+
+        self._current_instruction = 0
+        self._next_instruction = 0
+        self._current_cpu_mode = 0
+        self._last_emulated_instruction = None
+
+        self._request_stop = False
+        # why the last run stopped, one of the STOP_ values
+        self.stop_reason = None
+
+        # fast run: no per instruction/memory hooks, unicorn stops by itself at end/count/timeout
+        self.fast_run = False
+        self._run_count = 0
+        self._run_timeout = 0
+
+        # limits of every run, enforced by unicorn, plus the block based loop detector
+        self.max_instructions = DEFAULT_MAX_INSTRUCTIONS
+        self.run_timeout = DEFAULT_RUN_TIMEOUT
+        self.loop_detector = EmulatorLoopDetector()
+        # writes seen by hook_mem_access, part of the state compared by the loop detector
+        self._memory_writes = 0
+        self._trace_hooks = []
+
+        # events waiting for the next flush
+        self._events = []
+        self._events_flushed_at = 0
+        # register operands of the last instruction, their values are sent along with the next one
+        self._pending_regs = []
+
+        # configurations
+        self.callbacks_path = None
+        self.callbacks = EmulatorCallbacks()
+        # instruction built by the last traced hook_code, handed to the code callback
+        self._last_instruction = None
+        self.instructions_delay = 0
+
+        self._start_address = 0
+        self._end_address = 0
+
+        # reset single instance preferences
+        self.config.put(EMULATOR_CALLBACKS_PATH, '')
+
+        page_cache_size = int(self.config.get(EMULATOR_PAGE_CACHE_SIZE, DEFAULT_PAGE_CACHE_SIZE))
+        if page_cache_size > 0:
+            try:
+                self.page_cache = EmulatorPageCache(max_size=page_cache_size)
+            except OSError as e:
+                self.log_to_ui('ucdwarf: page cache disabled - %s' % str(e))
+
+    @property
+    def arch(self):
+        return self.context_provider.arch
+
+    def add_listener(self, listener):
+        if listener not in self.listeners:
+            self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _notify(self, name, *args):
+        self.stats.notifications += 1
+        for listener in self.listeners:
+            getattr(listener, name)(*args)
+
+    def _build_instruction(self, insn, context):
+        return EmulatorInstruction(self.arch, insn, context=context, thumb=self.thumb)
+
+    def is_running(self):
+        return self._running
+
+    def setup_arm(self):
+        self.thumb = self.context.pc.thumb
+        if self.thumb:
+            self._current_cpu_mode = unicorn.UC_MODE_THUMB
+            self.cs = Cs(CS_ARCH_ARM, CS_MODE_THUMB)
+            self.uc = unicorn.Uc(unicorn.UC_ARCH_ARM, unicorn.UC_MODE_THUMB)
+            # Enable VFP instr
+            self.uc.mem_map(0x1000, 1024)
+            self.uc.mem_write(0x1000, binascii.unhexlify(VFP))
+            self.uc.emu_start(0x1000 | 1, 0x1000 + len(VFP))
+            self.uc.mem_unmap(0x1000, 1024)
+        else:
+            self.cs = Cs(CS_ARCH_ARM, CS_MODE_ARM)
+            self.uc = unicorn.Uc(unicorn.UC_ARCH_ARM, unicorn.UC_MODE_ARM)
+            self._current_cpu_mode = unicorn.UC_MODE_ARM
+
+    def setup_arm64(self):
+        self.uc = unicorn.Uc(unicorn.UC_ARCH_ARM64, unicorn.UC_MODE_LITTLE_ENDIAN)
+        self.cs = Cs(CS_ARCH_ARM64, CS_MODE_LITTLE_ENDIAN)
+        self._current_cpu_mode = unicorn.UC_MODE_LITTLE_ENDIAN
+
+    def setup_x86(self):
+        self.uc = unicorn.Uc(unicorn.UC_ARCH_X86, unicorn.UC_MODE_32)
+        self.cs = Cs(CS_ARCH_X86, CS_MODE_32)
+
+    def setup_x64(self):
+        self.uc = unicorn.Uc(unicorn.UC_ARCH_X86, unicorn.UC_MODE_64)
+        self.cs = Cs(CS_ARCH_X86, CS_MODE_64)
+
+    def _setup(self, user_arch=None, user_mode=None, cs_arch=None, cs_mode=None):
+        if user_arch is not None and user_mode is not None:
+            try:
+                self.uc = unicorn.Uc(user_arch, user_mode)
+                self.cs = Cs(cs_arch, cs_mode)
+
+                self.thumb = user_mode == unicorn.UC_MODE_THUMB
+            except:
+                raise self.EmulatorSetupFailedError('Unsupported arch')
+        else:
+            if self.arch == 'arm':
+                self.setup_arm()
+            elif self.arch == 'arm64':
+                self.setup_arm64()
+            elif self.arch == 'ia32':
+                self.setup_x86()
+            elif self.arch == 'x64':
+                self.setup_x64()
+            else:
+                # unsupported arch
+                raise self.EmulatorSetupFailedError('Unsupported arch')
+
+        if not self.uc or not self.cs:
+            raise self.EmulatorSetupFailedError('Unicorn or Capstone missing')
+
+        # enable capstone details
+        if self.cs is not None:
+            self.cs.detail = True
+
+        if not self.context.is_native_context:
+            raise self.EmulatorSetupFailedError('Cannot run emulator on non-native context')
+
+        self.disasm_cache.clear()
+        self.trace.clear()
+        self.access_log.clear()
+        self.telescope.clear()
+        self.telescope.pointer_size = 8 if self.uc._arch == unicorn.UC_ARCH_ARM64 or (
+            self.uc._arch == unicorn.UC_ARCH_X86 and self.uc._mode == unicorn.UC_MODE_64) else 4
+        self.pager.reset()
+        self.checkpoints.clear()
+        self.stats.reset()
+        self.profiler.clear()
+
+        if self.snapshot is not None:
+            # the previous unicorn instance is gone, release its mapping
+            self.snapshot.close()
+            self.snapshot = None
+        if self.snapshot_path:
+            try:
+                self.snapshot = MemorySnapshot(self.snapshot_path)
+                for base, size in self.snapshot.map_into(self.uc):
+                    self._notify('on_emulator_range_mapped', [base, size])
+                self.log_to_ui('[*] %d ranges mapped from snapshot %s' % (
+                    len(self.snapshot.ranges), self.snapshot_path))
+            except (OSError, ValueError, KeyError) as e:
+                raise self.EmulatorSetupFailedError('Snapshot failed: %s' % str(e))
+        else:
+            try:
+                self.pager.set_modules(self.memory_provider.enumerate_ranges())
+            except Exception:
+                self.pager.set_modules([])
+            err = self.map_range(self.context.pc.value)
+            if err:
+                raise self.EmulatorSetupFailedError('Mapping failed')
+
+        self.current_context = EmulatorContext(self.arch)
+        for reg in self.current_context._unicorn_registers:
+            if reg in self.context.__dict__:
+                if reg not in self._blacklist_regs:
+                    self.uc.reg_write(self.current_context._unicorn_registers[reg], self.context.__dict__[reg].value)
+
+        # code and memory access hooks are installed per run, see _install_trace_hooks
+        self._trace_hooks = []
+        self.uc.hook_add(
+            unicorn.UC_HOOK_MEM_FETCH_UNMAPPED |
+            unicorn.UC_HOOK_MEM_WRITE_UNMAPPED |
+            unicorn.UC_HOOK_MEM_READ_UNMAPPED, self.hook_unmapped)
+        self.current_context.set_context(self.uc)
+        return 0
+
+    def run(self):
+        # dont call this func, emulate() does
+        if not self._setup_done:
+            return
+        self.stats.run_started(not self.fast_run)
+        self.profiler.attach(self.uc)
+        self.loop_detector.reset()
+        count = min_limit(self._run_count, self.max_instructions)
+        timeout = min_limit(self._run_timeout, self.run_timeout)
+        started = time.perf_counter()
+        try:
+            if self.thumb and self._start_address % 2 != 1:
+                self._start_address += 1
+            if self.fast_run:
+                end = self._end_address
+                if end == 0:
+                    end = 0xffffffffffffffff
+                elif self.thumb:
+                    end &= ~1
+                if not count and not timeout and self.loop_detector.threshold > 0:
+                    # only bounded by the end address, watch for loops going nowhere
+                    self._trace_hooks.append(self.uc.hook_add(unicorn.UC_HOOK_BLOCK, self.hook_block))
+                self.checkpoints.begin_run(self.uc, hooked=False)
+                self.callbacks.install(self.uc, self.hook_callback_code, self.hook_callback_memory)
+                self.stats.uncounted_runs += 1
+                self.uc.emu_start(self._start_address, end, timeout=timeout * 1000, count=count)
+            else:
+                # steps need every instruction hooked, only start runs are scoped
+                self._scoped_run = len(self.trace_ranges) > 0 and self.step_mode == STEP_MODE_NONE
+                # hook_mem_access only sees the writes of traced code
+                self.checkpoints.begin_run(self.uc, hooked=not self._scoped_run)
+                if self._scoped_run:
+                    self.stats.uncounted_runs += 1
+                    self._run_scoped(count, timeout, started)
+                else:
+                    self._install_trace_hooks()
+                    # after the trace hooks, which build the instruction handed to the code callback
+                    self.callbacks.install(self.uc, self.hook_callback_code, self.hook_callback_memory)
+                    # end is handled in hook_code
+                    self.uc.emu_start(self._start_address, 0xffffffffffffffff, timeout=timeout * 1000, count=count)
+        except unicorn.UcError as e:
+            self.stop_reason = STOP_ERROR
+            self.log_to_ui('[*] error: ' + str(e))
+        except Exception as e:
+            self.stop_reason = STOP_ERROR
+            self.log_to_ui('[*] error: ' + str(e))
+        finally:
+            self._remove_trace_hooks()
+            self.callbacks.remove()
+            self.checkpoints.end_run(self.uc)
+            self._last_instruction = None
+            self.profiler.detach()
+            self.stats.run_stopped()
+
+        if self.stop_reason is None:
+            # unicorn returned by itself
+            pc = self._read_pc()
+            if self.thumb:
+                pc |= 1
+            if self._end_address and pc == self._end_address:
+                self.stop_reason = STOP_END
+            elif timeout and time.perf_counter() - started >= timeout / 1000:
+                self.stop_reason = STOP_TIMEOUT
+            elif count:
+                self.stop_reason = STOP_COUNT
+            else:
+                self.stop_reason = STOP_END
+        if self.stop_reason in (STOP_COUNT, STOP_TIMEOUT):
+            self.log_to_ui('[*] emulation stopped - %s limit reached' % (
+                'instructions' if self.stop_reason == STOP_COUNT else 'time'))
+
+        if self.fast_run:
+            # nothing was tracked while running, rebuild from the final state
+            self._sync_cpu_state()
+            self.telescope.clear()
+            self.log_to_ui('[*] fast run stopped at %s' % hex(self._next_instruction))
+        elif self._scoped_run:
+            # the run may have stopped outside of the traced code
+            self._sync_cpu_state()
+            # the next runs don't get the calls of the range bound hooks
+            self.uc.ctl_flush_tb()
+            # writes outside of the traced ranges were not seen
+            self.telescope.clear()
+        else:
+            self.current_context.set_context(self.uc)
+        self._flush_events()
+        self._pending_regs = []
+        if self.trace_export is not None:
+            # whatever the run recorded is readable from the file
+            self.trace_export.flush()
+            if self.trace_export.error is not None:
+                self.log_to_ui('[*] trace export failed: %s' % self.trace_export.error)
+                self.stop_export()
+        if self.page_cache is not None:
+            # pages cached by the faults of the run
+            self.page_cache.save_later()
+
+        self._setup_done = False
+        self._running = False
+        self._notify('on_emulator_stop')
+
+    def _push_event(self, event):
+        self._events.append(event)
+        if len(self._events) >= EVENTS_FLUSH_SIZE or \
+                time.monotonic() - self._events_flushed_at >= EVENTS_FLUSH_INTERVAL:
+            self._flush_events()
+
+    def _flush_events(self):
+        self._events_flushed_at = time.monotonic()
+        if self._events:
+            events = self._events
+            self._events = []
+            self.stats.events += len(events)
+            self._notify('on_emulator_events', events)
+
+    def _run_scoped(self, count, timeout, started):
+        """
+        start run with trace ranges, as a sequence of segments: traced ones inside the ranges and hook free
+        ones elsewhere. code hooks are bound to the ranges for the whole run, as unicorn keeps them in the
+        translated blocks, only the memory hook is attached while a traced segment runs.
+
+        a traced segment stops before any instruction which may leave the ranges, that instruction runs
+        alone and the next segment starts where it landed. a hook free segment stops on the first
+        instruction inside the ranges
+        """
+        # end is handled in hook_code when traced, by unicorn otherwise
+        end = 0xffffffffffffffff
+        if self._end_address:
+            untraced_end = self._end_address & ~1 if self.thumb else self._end_address
+            if untraced_end not in self.trace_ranges:
+                end = untraced_end
+
+        self._leave_cache = {}
+        self._exit_step = None
+        # blocks translated by earlier runs have neither the hooks bound below nor the instruction count
+        self.uc.ctl_flush_tb()
+        for start, range_end in self.trace_ranges:
+            self._trace_hooks.append(self.uc.hook_add(unicorn.UC_HOOK_CODE, self.hook_scoped_code,
+                                                      begin=start, end=range_end - 1))
+            self._trace_hooks.append(self.uc.hook_add(unicorn.UC_HOOK_BLOCK, self.hook_block,
+                                                      begin=start, end=range_end - 1))
+        # after the trace hooks, which build the instruction handed to the code callback
+        self.callbacks.install(self.uc, self.hook_callback_code, self.hook_callback_memory)
+
+        address = self._start_address
+        instructions = self.stats.instructions
+        while True:
+            self._segment_traced = (address & ~1 if self.thumb else address) in self.trace_ranges
+            self._segment_exit = False
+            stepping = self._exit_step is not None
+
+            # limits are shared by the segments. untraced instructions are not counted, each hook free
+            # segment is bounded by what is left. unicorn only counts in blocks translated while counting,
+            # which the single instruction segments rely on
+            segment_count = SCOPED_RUN_COUNT
+            if count:
+                segment_count = count - (self.stats.instructions - instructions)
+                if segment_count <= 0:
+                    return
+            if stepping:
+                segment_count = 1
+            segment_timeout = 0
+            if timeout:
+                segment_timeout = int((timeout - (time.perf_counter() - started) * 1000) * 1000)
+                if segment_timeout <= 0:
+                    return
+
+            mem_hook = None
+            if self._segment_traced:
+                # memory hooks can't be bound to the pc
+                mem_hook = self.uc.hook_add(unicorn.UC_HOOK_MEM_WRITE | unicorn.UC_HOOK_MEM_READ,
+                                            self.hook_mem_access)
+            try:
+                self.uc.emu_start(address, end, timeout=segment_timeout, count=segment_count)
+            finally:
+                if mem_hook is not None:
+                    self.uc.hook_del(mem_hook)
+
+            if self.stop_reason is not None:
+                return
+            if stepping:
+                self._exit_step = None
+                if self._request_stop:
+                    # the end was the instruction leaving the ranges
+                    self.stop_reason = STOP_END
+                    return
+            elif not self._segment_exit:
+                return
+            # untraced code may have switched the arm instruction set
+            self._sync_cpu_state()
+            address = self._next_instruction | 1 if self.thumb else self._next_instruction
+
+    def _may_leave(self, address, size):
+        """
+        :return: True when the instruction at address may be followed by one out of the trace ranges
+        """
+        key = (address, self._current_cpu_mode)
+        leave = self._leave_cache.get(key)
+        if leave is None:
+            leave = self._leave_cache[key] = self._check_leave(address, size)
+        return leave
+
+    def _check_leave(self, address, size):
+        if address + size not in self.trace_ranges:
+            return True
+        try:
+            i = self.disasm_cache.disasm(self.cs, self._current_cpu_mode, address,
+                                         bytes(self.uc.mem_read(address, size)))
+        except (unicorn.UcError, capstone.CsError):
+            return True
+        if i is None:
+            return True
+        groups = i.groups
+        if capstone.CS_GRP_INT in groups or capstone.CS_GRP_IRET in groups or capstone.CS_GRP_RET in groups:
+            return True
+        if capstone.CS_GRP_JUMP in groups or capstone.CS_GRP_CALL in groups:
+            operands = i.operands
+            if len(operands) == 1 and operands[0].type == capstone.CS_OP_IMM:
+                return operands[0].imm not in self.trace_ranges
+            return True
+        if self.uc._arch == unicorn.UC_ARCH_ARM:
+            # pop {pc}, ldr pc and friends are not in the jump group
+            try:
+                return capstone.arm.ARM_REG_PC in i.regs_access()[1]
+            except capstone.CsError:
+                return True
+        return False
+
+    def _install_trace_hooks(self):
+        self._trace_hooks.append(self.uc.hook_add(unicorn.UC_HOOK_CODE, self.hook_code))
+        self._trace_hooks.append(self.uc.hook_add(unicorn.UC_HOOK_BLOCK, self.hook_block))
+        self._trace_hooks.append(self.uc.hook_add(unicorn.UC_HOOK_MEM_WRITE | unicorn.UC_HOOK_MEM_READ,
+                                                  self.hook_mem_access))
+
+    def _remove_trace_hooks(self):
+        for hook in self._trace_hooks:
+            try:
+                self.uc.hook_del(hook)
+            except unicorn.UcError:
+                pass
+        self._trace_hooks = []
+
+    def _sync_cpu_state(self):
+        if self.uc._arch == unicorn.UC_ARCH_ARM:
+            thumb = self.uc.reg_read(unicorn.arm_const.UC_ARM_REG_CPSR) & 0x20 != 0
+            if thumb != self.thumb:
+                self.thumb = thumb
+                self._current_cpu_mode = unicorn.UC_MODE_THUMB if thumb else unicorn.UC_MODE_ARM
+                self.cs.mode = self._current_cpu_mode
+
+        self._next_instruction = self._read_pc()
+        self.current_context.set_context(self.uc)
+
+    def _read_sp(self):
+        if self.uc._arch == unicorn.UC_ARCH_ARM:
+            return self.uc.reg_read(unicorn.arm_const.UC_ARM_REG_SP)
+        elif self.uc._arch == unicorn.UC_ARCH_ARM64:
+            return self.uc.reg_read(unicorn.arm64_const.UC_ARM64_REG_SP)
+        elif self.uc._arch == unicorn.UC_ARCH_X86 and self.uc._mode == unicorn.UC_MODE_32:
+            return self.uc.reg_read(unicorn.x86_const.UC_X86_REG_ESP)
+        elif self.uc._arch == unicorn.UC_ARCH_X86 and self.uc._mode == unicorn.UC_MODE_64:
+            return self.uc.reg_read(unicorn.x86_const.UC_X86_REG_RSP)
+        return None
+
+    def _read_pc(self):
+        if self.uc._arch == unicorn.UC_ARCH_ARM:
+            return self.uc.reg_read(unicorn.arm_const.UC_ARM_REG_PC)
+        elif self.uc._arch == unicorn.UC_ARCH_ARM64:
+            return self.uc.reg_read(unicorn.arm64_const.UC_ARM64_REG_PC)
+        elif self.uc._arch == unicorn.UC_ARCH_X86 and self.uc._mode == unicorn.UC_MODE_32:
+            return self.uc.reg_read(unicorn.x86_const.UC_X86_REG_EIP)
+        elif self.uc._arch == unicorn.UC_ARCH_X86 and self.uc._mode == unicorn.UC_MODE_64:
+            return self.uc.reg_read(unicorn.x86_const.UC_X86_REG_RIP)
+        raise self.EmulatorSetupFailedError('Unsupported arch')
+
+    def api(self, parts, synchronous=False):
+        """
+        expose api to js side for allowing emulator interaction while scripting
+        :param parts: arr -> cmd api split by ":::"
+        :param synchronous: emulations run in the calling thread, see emulate
+        :return: the result from the api
+        """
+        cmd = parts[0]
+        if cmd == 'clean':
+            return self.clean()
+        elif cmd == 'setup':
+            custom_uc_arch = None
+            custom_cs_arch = None
+            custom_uc_mode = None
+            custom_cs_mode = None
+            if len(parts) > 3:
+                try:
+                    arch = 'UC_ARCH_' + parts[2].upper()
+                    if arch in unicorn.__dict__:
+                        custom_uc_arch = unicorn.__dict__[arch]
+                        arch = 'CS_ARCH_' + parts[2].upper()
+                        custom_cs_arch = capstone.__dict__[arch]
+                    mode = 'UC_MODE_' + parts[3].upper()
+                    if mode in unicorn.__dict__:
+                        custom_uc_mode = unicorn.__dict__[mode]
+                        mode = 'CS_MODE_' + parts[3].upper()
+                        custom_cs_mode = capstone.__dict__[mode]
+                except:
+                    custom_uc_arch = None
+                    custom_cs_arch = None
+                    custom_uc_mode = None
+                    custom_cs_mode = None
+
+            if custom_uc_arch is not None and custom_uc_mode is not None:
+                err = self.setup(
+                    parts[1], user_arch=custom_uc_arch, user_mode=custom_uc_mode,
+                    cs_arch=custom_cs_arch, cs_mode=custom_cs_mode)
+            else:
+                err = self.setup(parts[1] if len(parts) > 1 else 0)
+            if err > 0:
+                self.context = None
+            return err
+        elif cmd == 'start':
+            until = 0
+            if len(parts) > 1:
+                try:
+                    until = int(parts[1], 0)
+                except:
+                    pass
+            return self.emulate(until=until, synchronous=synchronous)
+        elif cmd == 'step':
+            step_mode = STEP_MODE_SINGLE
+            if len(parts) > 1:
+                try:
+                    step_mode = int(parts[1])
+                except:
+                    pass
+            return self.emulate(step_mode=step_mode, synchronous=synchronous)
+        elif cmd == 'run':
+            # hook free run: run:::until[:::count[:::timeout ms]]
+            args = [0, 0, 0]
+            for i, part in enumerate(parts[1:4]):
+                try:
+                    args[i] = int(part, 0)
+                except ValueError:
+                    pass
+            return self.emulate(until=args[0], fast=True, count=args[1], timeout=args[2], synchronous=synchronous)
+        elif cmd == 'disasm_cache':
+            return self.disasm_cache.stats()
+        elif cmd == 'trace':
+            # trace[:::start[:::count]] - defaults to the last 100 instructions
+            count = 100
+            if len(parts) > 2:
+                try:
+                    count = int(parts[2], 0)
+                except ValueError:
+                    pass
+            start = max(len(self.trace) - count, self.trace.first)
+            if len(parts) > 1:
+                try:
+                    start = int(parts[1], 0)
+                except ValueError:
+                    pass
+            return [[hex(address), size, mode] for address, size, mode in self.trace[start:start + count]]
+        elif cmd == 'access_log':
+            # access_log[:::start[:::count]] - defaults to the last 100 accesses
+            count = 100
+            if len(parts) > 2:
+                try:
+                    count = int(parts[2], 0)
+                except ValueError:
+                    pass
+            start = max(len(self.access_log) - count, self.access_log.first)
+            if len(parts) > 1:
+                try:
+                    start = int(parts[1], 0)
+                except ValueError:
+                    pass
+            return [[hex(pc), hex(address), size, kind, hex(value)]
+                    for pc, address, size, kind, value in self.access_log.window(start, count)]
+        elif cmd == 'checkpoint':
+            return self.checkpoint()
+        elif cmd == 'restore':
+            return self.restore(int(parts[1], 0))
+        elif cmd == 'batch_run':
+            # batch_run:::{"checkpoint": id, "until": ptr, "count": n, "timeout": ms, "variations": [...]}
+            args = json.loads(':::'.join(parts[1:]))
+            until = args.get('until', 0)
+            if isinstance(until, str):
+                until = int(until, 0)
+            return self.run_batch(args.get('variations', []), until=until, count=args.get('count', 0),
+                                  timeout=args.get('timeout', 0), checkpoint_id=args.get('checkpoint'),
+                                  workers=args.get('workers'))
+        elif cmd == 'snapshot':
+            # snapshot:::dump:::path[:::tid] / snapshot:::use:::path / snapshot:::none
+            if len(parts) > 2 and parts[1] == 'dump':
+                tid = parts[3] if len(parts) > 3 else 0
+                return len(self.dump_snapshot(parts[2], tid=tid)['ranges'])
+            elif len(parts) > 2 and parts[1] == 'use':
+                self.config.put(EMULATOR_SNAPSHOT_PATH, parts[2])
+            elif len(parts) > 1 and parts[1] == 'none':
+                self.config.put(EMULATOR_SNAPSHOT_PATH, '')
+            self.snapshot_path = self.config.get(EMULATOR_SNAPSHOT_PATH, '')
+            return self.snapshot_path
+        elif cmd == 'pager':
+            return self.pager.stats()
+        elif cmd == 'export':
+            # export:::start:::path / export:::stop / export
+            if len(parts) > 2 and parts[1] == 'start':
+                self.start_export(parts[2])
+            elif len(parts) > 1 and parts[1] == 'stop':
+                return self.stop_export()
+            return self.trace_export.stats() if self.trace_export is not None else None
+        elif cmd == 'profile':
+            # profile:::start / profile:::stop / profile:::clear
+            # profile[:::hotspots[:::count]] / profile:::drcov:::path
+            action = parts[1] if len(parts) > 1 else 'hotspots'
+            if action == 'start':
+                self.profiler.clear()
+                self.profiler.enabled = True
+            elif action == 'stop':
+                self.profiler.enabled = False
+            elif action == 'clear':
+                self.profiler.clear()
+            elif action == 'drcov':
+                return self.profiler.export_drcov(parts[2], self.profile_modules())
+            elif action == 'hotspots':
+                count = int(parts[2], 0) if len(parts) > 2 else 20
+                hotspots = self.profiler.hotspots(count=count, modules=self.profile_modules())
+                for hotspot in hotspots:
+                    hotspot['address'] = hex(hotspot['address'])
+                    if hotspot['offset'] is not None:
+                        hotspot['offset'] = hex(hotspot['offset'])
+                return hotspots
+            return {'enabled': self.profiler.enabled, 'blocks': len(self.profiler),
+                    'executions': self.profiler.executions()}
+        elif cmd == 'stats':
+            # stats[:::reset]
+            if len(parts) > 1 and parts[1] == 'reset':
+                self.stats.reset()
+            return self.get_stats()
+        elif cmd == 'page_cache':
+            # page_cache / page_cache:::clear[:::key prefix]
+            if self.page_cache is None:
+                return None
+            if len(parts) > 1 and parts[1] == 'clear':
+                self.page_cache.invalidate(parts[2] if len(parts) > 2 else None)
+                if len(parts) <= 2:
+                    self.session_pages.clear()
+            stats = self.page_cache.stats()
+            stats['session'] = self.session_pages.stats()
+            return stats
+        elif cmd == 'access_filter':
+            # access_filter:::add:::start:::end / access_filter:::clear
+            if len(parts) > 3 and parts[1] == 'add':
+                self.access_log.add_filter(int(parts[2], 0), int(parts[3], 0))
+            elif len(parts) > 1 and parts[1] == 'clear':
+                self.access_log.clear_filters()
+            self.config.put(EMULATOR_ACCESS_FILTERS, format_ranges(self.access_log.filters))
+            return self.access_log.filters
+        elif cmd == 'trace_range':
+            # trace_range:::add:::start:::end / trace_range:::module:::name / trace_range:::clear
+            if len(parts) > 3 and parts[1] == 'add':
+                self.add_trace_range(int(parts[2], 0), int(parts[3], 0))
+            elif len(parts) > 2 and parts[1] == 'module':
+                self.add_trace_module(parts[2])
+            elif len(parts) > 1 and parts[1] == 'clear':
+                self.clear_trace_ranges()
+            return [[hex(start), hex(end)] for start, end in self.trace_ranges]
+        elif cmd == 'read':
+            # read:::address:::size - hex of the emulator memory
+            return self.read_memory(int(parts[1], 0), int(parts[2], 0)).hex()
+        elif cmd == 'write':
+            # write:::address:::hex
+            return self.write_memory(int(parts[1], 0), binascii.unhexlify(parts[2]))
+        elif cmd == 'regs':
+            return self.run_result()['registers']
+        elif cmd == 'write_regs':
+            # write_regs:::{"r0": 1, "pc": "0x1000"}
+            return self.write_registers(json.loads(':::'.join(parts[1:])))
+        elif cmd == 'batch':
+            # batch:::[["setup"], ["write_regs", {...}], ["run", until], ["read", address, size]]
+            return self.run_commands(json.loads(':::'.join(parts[1:])))
+        elif cmd == 'stop':
+            self.stop()
+            return self.stop_reason
+
+    def clean(self):
+        if self.is_running():
+            raise self.EmulatorAlreadyRunningError()
+
+        self._current_instruction = 0
+        self._next_instruction = 0
+        self._current_cpu_mode = 0
+        self.context = None
+        self._last_emulated_instruction = None
+        self.disasm_cache.clear()
+        self.trace.clear()
+        self.access_log.clear()
+        self.telescope.clear()
+        self.checkpoints.clear()
+        self.stats.reset()
+        self.profiler.clear()
+        self.stop_export()
+        if self.page_cache is not None:
+            self.page_cache.save()
+        return 0
+
+    def start_export(self, path):
+        """
+        stream the traced runs into path, see EmulatorTraceWriter. fast runs and code outside
+        of the trace ranges are not recorded
+        """
+        if self.is_running():
+            raise self.EmulatorAlreadyRunningError()
+        if self.current_context is None:
+            raise self.EmulatorSetupFailedError('Emulator is not setup')
+        self.stop_export()
+        self.trace_export = EmulatorTraceWriter(path, self.current_context.curated(), arch=self.arch)
+        self.log_to_ui('[*] streaming the trace to %s' % path)
+
+    def stop_export(self):
+        """
+        :return: stats of the closed export, None if there was none
+        """
+        if self.trace_export is None:
+            return None
+        writer = self.trace_export
+        self.trace_export = None
+        writer.close()
+        self.log_to_ui('[*] trace export closed, %d instructions in %s' % (writer.instructions, writer.path))
+        return writer.stats()
+
+    def checkpoint(self):
+        """
+        :return: id of the checkpoint, to be used with restore
+        """
+        self._require_setup()
+        checkpoint_id = self.checkpoints.create(self.uc)
+        self.log_to_ui('[*] checkpoint %d at %s' % (checkpoint_id, hex(self._read_pc())))
+        return checkpoint_id
+
+    def run_commands(self, commands):
+        """
+        api commands executed back to back, runs included, without leaving the calling thread
+        :param commands: [[cmd, args...]], objects args are sent as json
+        :return: {results: [one per command executed], error: message of the failed command or None}
+        """
+        results = []
+        for command in commands:
+            if isinstance(command, str):
+                command = [command]
+            parts = [arg if isinstance(arg, str) else json.dumps(arg) for arg in command]
+            if not parts or parts[0] == 'batch':
+                return {'results': results, 'error': 'invalid command: %s' % str(command)}
+            try:
+                results.append(self.api(parts, synchronous=True))
+            except Exception as e:
+                # commands after a failed one are not executed
+                return {'results': results, 'error': '%s: %s' % (parts[0], str(e))}
+        return {'results': results, 'error': None}
+
+    def _require_setup(self):
+        if self.is_running():
+            raise self.EmulatorAlreadyRunningError()
+        if self.uc is None or self.context is None:
+            raise self.EmulatorSetupFailedError('Emulator is not setup')
+
+    def read_memory(self, address, size):
+        self._require_setup()
+        try:
+            return bytes(self.uc.mem_read(address, size))
+        except unicorn.UcError:
+            # not mapped yet
+            self.map_range(address, size)
+            return bytes(self.uc.mem_read(address, size))
+
+    def write_memory(self, address, data):
+        """
+        :return: number of bytes written. pages are mapped from the target first
+        """
+        self.read_memory(address, len(data))
+        self.checkpoints.touch(self.uc, address, len(data))
+        self.uc.mem_write(address, data)
+        self.telescope.invalidate(address, len(data))
+        return len(data)
+
+    def write_registers(self, registers):
+        """
+        :param registers: {name: int or string value}
+        :return: number of registers written, unknown names are ignored
+        """
+        self._require_setup()
+        pc = self._read_pc()
+        written = 0
+        for reg, value in registers.items():
+            const = self.current_context._unicorn_registers.get(reg)
+            if const is None:
+                continue
+            self.uc.reg_write(const, int(value, 0) if isinstance(value, str) else value)
+            written += 1
+        if self._read_pc() != pc:
+            # next run starts from the new pc
+            self._sync_cpu_state()
+        else:
+            self.current_context.set_context(self.uc)
+        return written
+
+    def run_batch(self, variations, until=0, count=0, timeout=0, checkpoint_id=None, workers=None):
+        """
+        run the emulation from a checkpoint (or the current state) once per variation, on a process pool.
+        see EmulatorBatchRunner and BatchWorker.run for the variation and result formats
+        """
+        if checkpoint_id is not None:
+            self.restore(checkpoint_id)
+        self._require_setup()
+
+        self.current_context.set_context(self.uc)
+        registers = {reg: value for reg, value in self.current_context.materialize().__dict__.items()
+                     if not reg.startswith('_') and isinstance(value, int)}
+
+        # limits of the options apply to every variation, the workers bound the unlimited ones
+        count = min_limit(count, self.max_instructions)
+        timeout = min_limit(timeout, self.run_timeout)
+
+        fd, path = tempfile.mkstemp(prefix='ucdwarf_batch_')
+        os.close(fd)
+        try:
+            MemorySnapshot.save_uc(path, self.uc, arch=self.arch, registers=registers, thumb=self.thumb)
+            self.log_to_ui('[*] batch of %d runs' % len(variations))
+            started = time.time()
+            self._batch = EmulatorBatchRunner(path, workers=workers)
+            results = self._batch.run(variations, until=until, count=count, timeout=timeout)
+            self.log_to_ui('[*] batch done in %.2fs' % (time.time() - started))
+            return results
+        finally:
+            self._batch = None
+            for f in [path, path + '.json']:
+                if os.path.exists(f):
+                    os.remove(f)
+
+    def restore(self, checkpoint_id):
+        """
+        restore the cpu state of a checkpoint and rewrite the pages written since then.
+        checkpoints taken after it are discarded
+        """
+        if self.is_running():
+            raise self.EmulatorAlreadyRunningError()
+        if checkpoint_id not in self.checkpoints:
+            raise self.EmulatorSetupFailedError('Invalid checkpoint %d' % checkpoint_id)
+        pages = self.checkpoints.restore(self.uc, checkpoint_id)
+        self.telescope.clear()
+        self._sync_cpu_state()
+        self._request_stop = False
+        self.log_to_ui('[*] restored checkpoint %d (%d pages) at %s' % (
+            checkpoint_id, pages, hex(self._next_instruction)))
+        self._notify('on_emulator_stop')
+        return pages
+
+    def hook_code(self, uc, address, size, user_data):
+        started = time.perf_counter()
+        self._trace_instruction(uc, address, size)
+        self.stats.hook_code_time += time.perf_counter() - started
+
+    def hook_block(self, uc, address, size, user_data):
+        self.stats.blocks += 1
+        # hook_mem_access doesn't see every write of fast and scoped runs
+        read_memory = self._loop_memory if self.fast_run or self._scoped_run else None
+        if self.loop_detector.on_block(address, self._loop_state, read_memory):
+            self.log_to_ui('Error: Emulator stopped - looping at %s' % hex(address))
+            self.stop(reason=STOP_LOOP)
+
+    def hook_scoped_code(self, uc, address, size, user_data):
+        if not self._segment_traced:
+            # entering the ranges, a traced segment resumes from here
+            self._segment_exit = True
+            uc.emu_stop()
+            return
+        if self._exit_step is None:
+            if self._may_leave(address, size):
+                # resumed as a single instruction segment
+                self._exit_step = address
+                self._segment_exit = True
+                uc.emu_stop()
+                return
+        elif address != self._exit_step:
+            uc.emu_stop()
+            return
+        self.hook_code(uc, address, size, user_data)
+
+    def _loop_state(self):
+        self.current_context.set_context(self.uc)
+        # a loop may only make progress in memory
+        return tuple(self.current_context.registers().values()) + (self._memory_writes,)
+
+    def _loop_memory(self):
+        digest = 0
+        for begin, end, perms in self.uc.mem_regions():
+            if perms & unicorn.UC_PROT_WRITE:
+                digest = zlib.crc32(self.uc.mem_read(begin, end - begin + 1), digest)
+        return digest
+
+    def _trace_instruction(self, uc, address, size):
+        if self._request_stop:
+            self.log_to_ui('Error: Emulator stopped - reached end')
+            self.stop(reason=STOP_END)
+            return
+
+        self._current_instruction = address
+        self._last_instruction = None
+
+        # check if pc/eip is end_ptr
+        pc = self._read_pc()
+        if self.thumb:
+            pc = pc | 1
+
+        if pc == self._end_address:
+            self._request_stop = True
+
+        # set the current context
+        self.current_context.set_context(uc)
+
+        instruction = None
+        try:
+            try:
+                data = bytes(uc.mem_read(address, size))
+                i = self.disasm_cache.disasm(self.cs, self._current_cpu_mode, address, data)
+            except:
+                i = None
+            if i is None:
+                self.log_to_ui('Error: Emulator stopped - disasm')
+                self.stop(reason=STOP_ERROR)
+                return
+
+            self.stats.instructions += 1
+            self.trace.append(address, size, self._current_cpu_mode,
+                              self.current_context.registers() if self.trace.track_registers else None)
+            if self.trace_export is not None:
+                self.trace_export.instruction(address, size, self._current_cpu_mode, self.current_context.values())
+
+            instruction = self.instruction_factory(i, self.current_context)
+
+            regs = {}
+            for reg in self._pending_regs:
+                regs[reg] = getattr(self.current_context, reg, None)
+            self._pending_regs = [i.reg_name(op.value.reg) for op in i.operands if op.type == capstone.CS_OP_REG]
+            self._push_event([EVENT_INSTRUCTION, instruction, regs, len(self.trace) - 1])
+            self._last_instruction = instruction
+
+            if not instruction.is_jump and not instruction.is_call:
+                self._next_instruction = address + i.size
+            else:
+                if instruction.is_call:
+                    self._next_instruction = instruction.call_address
+
+                if instruction.should_change_arm_instruction_set:
+                    if self.thumb:
+                        self._current_cpu_mode = unicorn.UC_MODE_ARM
+                        self.thumb = False
+                    else:
+                        self._current_cpu_mode = unicorn.UC_MODE_THUMB
+                        self.thumb = True
+                    self.cs.mode = self._current_cpu_mode
+
+            # time.sleep(self.instructions_delay)
+        except:
+            self.log_to_ui('Error: Emulator stopped')
+            self.stop(reason=STOP_ERROR)
+            return
+
+        if self.step_mode != STEP_MODE_NONE:
+            if instruction.is_jump:
+                # do not break at jump as we should calculate next instruction properly
+                return
+
+            if self.step_mode == STEP_MODE_SINGLE:
+                self.stop(reason=STOP_STEP)
+            else:
+                if instruction.is_call and self.step_mode == STEP_MODE_FUNCTION:
+                    self.stop(reason=STOP_STEP)
+        self._last_emulated_instruction = instruction
+
+    def hook_mem_access(self, uc, access, address, size, value, user_data):
+        started = time.perf_counter()
+        self._trace_memory_access(uc, access, address, size, value)
+        self.stats.hook_mem_time += time.perf_counter() - started
+
+    def _trace_memory_access(self, uc, access, address, size, value):
+        self.stats.memory_accesses += 1
+        if access == unicorn.UC_MEM_WRITE:
+            # self modifying code, drop what we decoded from that page
+            self.disasm_cache.invalidate(address, size)
+            self.telescope.invalidate(address, size)
+            # unicorn didn't write yet
+            self.checkpoints.touch(uc, address, size)
+            self._memory_writes += 1
+
+        if self.trace_export is not None:
+            if access == unicorn.UC_MEM_WRITE:
+                # unicorn hands 8 bytes at most of what is written
+                data_size = min(size, 8)
+                data = (value & ((1 << data_size * 8) - 1)).to_bytes(data_size, 'little')
+            else:
+                data = bytes(uc.mem_read(address, size))
+            self.trace_export.memory(access, address, data, size)
+
+        if not self.access_log.accepts(address):
+            return
+
+        v = value
+        if access == unicorn.UC_MEM_READ:
+            v = int.from_bytes(uc.mem_read(address, size), 'little')
+        self.access_log.append(self._current_instruction, address, size, access, v)
+        self._push_event([EVENT_MEMORY, access, address, v, len(self.trace) - 1])
+
+    def hook_callback_code(self, uc, address, size, user_data):
+        if self.stop_reason is not None:
+            return
+        callback_started = time.perf_counter()
+        instruction = self._last_instruction
+        if instruction is None or self._current_instruction != address:
+            # fast run, nothing was decoded for us
+            self.current_context.set_context(uc)
+            i = self.disasm_cache.disasm(self.cs, self._current_cpu_mode, address, bytes(uc.mem_read(address, size)))
+            instruction = self.instruction_factory(i, self.current_context) if i is not None else None
+        if instruction is not None:
+            self._run_callback(HOOK_CODE, instruction, address, size)
+        self.stats.callbacks_time += time.perf_counter() - callback_started
+
+    def hook_callback_memory(self, uc, access, address, size, value, user_data):
+        if self.stop_reason is not None:
+            return
+        callback_started = time.perf_counter()
+        if access == unicorn.UC_MEM_READ:
+            value = int.from_bytes(uc.mem_read(address, size), 'little')
+        self._run_callback(HOOK_MEMORY, access, address, size, value)
+        self.stats.callbacks_time += time.perf_counter() - callback_started
+
+    def _run_callback(self, hook, *args):
+        try:
+            self.callbacks(hook, self, *args)
+        except Exception as e:
+            self.log_to_ui('[*] error in callbacks %s: %s' % (hook, str(e)))
+            self.stop(reason=STOP_ERROR)
+
+    def hook_unmapped(self, uc, access, address, size, value, user_data):
+        self.log_to_ui(
+            "[*] Trying to access an unmapped memory address at 0x%x" %
+            address)
+        err = self.map_range(address, size)
+        if err > 0:
+            self.log_to_ui(
+                '[*] Error %d mapping range at %s' % (err, hex(address)))
+            return False
+        self.checkpoints.mapped(uc)
+        return True
+
+    def add_trace_range(self, start, end):
+        self.trace_ranges.add(start, end)
+        self.config.put(EMULATOR_TRACE_RANGES, format_ranges(self.trace_ranges))
+        return list(self.trace_ranges)
+
+    def add_trace_module(self, name):
+        """
+        trace a whole module, by path or file name
+        :return: the traced ranges
+        """
+        for base, end, path in self.profile_modules():
+            if path == name or os.path.basename(path) == name:
+                return self.add_trace_range(base, end)
+        raise self.EmulatorSetupFailedError('Module %s not found' % name)
+
+    def clear_trace_ranges(self):
+        self.trace_ranges.clear()
+        self.config.put(EMULATOR_TRACE_RANGES, '')
+        return []
+
+    def profile_modules(self):
+        """
+        :return: sorted [(base, end, path)] of the target modules. mapped memory outside of them
+                 is reported as anonymous modules so that every profiled block belongs somewhere
+        """
+        if self.snapshot is not None:
+            ranges = self.snapshot.ranges
+        else:
+            try:
+                ranges = self.memory_provider.enumerate_ranges()
+            except Exception:
+                ranges = []
+
+        modules = []
+        for info in ranges:
+            if not info.get('file'):
+                continue
+            base = info['base']
+            if isinstance(base, str):
+                base = int(base, 16)
+            modules.append([base, base + info['size'], info['file']])
+        modules.sort()
+
+        merged = []
+        for module in modules:
+            # segments of the same file
+            if merged and merged[-1][2] == module[2]:
+                merged[-1][1] = max(merged[-1][1], module[1])
+            else:
+                merged.append(module)
+
+        if self.uc is not None:
+            for begin, end, _ in self.uc.mem_regions():
+                if not any(begin < module_end and end >= module_base for module_base, module_end, _ in merged):
+                    merged.append([begin, end + 1, 'anonymous_%x' % begin])
+            merged.sort()
+        return [tuple(module) for module in merged]
+
+    def get_stats(self):
+        """
+        :return: dict with the emulator counters, plus the pager and disasm cache ones
+        """
+        stats = self.stats.as_dict()
+        pager = self.pager.stats()
+        stats['faults'] = pager['faults']
+        stats['failed_faults'] = pager['failed_faults']
+        stats['bytes_mapped'] = pager['bytes_mapped']
+        stats['fault_time'] = pager['fault_time']
+        disasm = self.disasm_cache.stats()
+        stats['disasm_hits'] = disasm['hits']
+        stats['disasm_misses'] = disasm['misses']
+        return stats
+
+    def run_result(self):
+        """
+        :return: dict with the outcome of the last run, stop reason, pc, curated registers and counters
+        """
+        result = {'stop_reason': self.stop_reason, 'pc': None, 'registers': {}, 'stats': self.get_stats()}
+        if self.uc is not None and self.current_context is not None:
+            result['pc'] = hex(self._read_pc())
+            result['registers'] = {reg: hex(value) if isinstance(value, int) else value
+                                   for reg, value in self.current_context.registers().items()}
+        return result
+
+    def invalidate_configurations(self):
+        self.callbacks_path = self.config.get(EMULATOR_CALLBACKS_PATH, '')
+        self.instructions_delay = self.config.get(EMULATOR_INSTRUCTIONS_DELAY, 0)
+        if self.page_cache is not None:
+            self.page_cache.max_size = int(self.config.get(EMULATOR_PAGE_CACHE_SIZE, DEFAULT_PAGE_CACHE_SIZE))
+        self.snapshot_path = self.config.get(EMULATOR_SNAPSHOT_PATH, '')
+        self.pager.max_fault_size = int(self.config.get(EMULATOR_FAULT_SIZE, DEFAULT_FAULT_SIZE))
+        self.pager.prefetch_pages = int(self.config.get(EMULATOR_PREFETCH_PAGES, DEFAULT_PREFETCH_PAGES))
+        self.trace.capacity = max(int(self.config.get(EMULATOR_TRACE_SIZE, DEFAULT_TRACE_SIZE)), 2)
+        self.trace.track_registers = bool(self.config.get(EMULATOR_TRACE_REGISTERS, False))
+        self.trace.spill = bool(self.config.get(EMULATOR_TRACE_SPILL, False))
+        self.trace_export_path = self.config.get(EMULATOR_TRACE_EXPORT_PATH, '')
+        self.access_log.capacity = self.trace.capacity
+        self.max_instructions = int(self.config.get(EMULATOR_MAX_INSTRUCTIONS, DEFAULT_MAX_INSTRUCTIONS))
+        self.run_timeout = int(self.config.get(EMULATOR_RUN_TIMEOUT, DEFAULT_RUN_TIMEOUT))
+        self.loop_detector.threshold = int(self.config.get(EMULATOR_LOOP_THRESHOLD, DEFAULT_LOOP_THRESHOLD))
+        try:
+            self.access_log.set_filters(parse_ranges(self.config.get(EMULATOR_ACCESS_FILTERS, '')))
+        except ValueError:
+            self.log_to_ui('[*] invalid access log filters')
+        try:
+            self.trace_ranges.set(parse_ranges(self.config.get(EMULATOR_TRACE_RANGES, '')))
+        except ValueError:
+            self.log_to_ui('[*] invalid trace ranges')
+
+    def map_range(self, address, size=1):
+        """
+        synchronously map the page(s) of address, plus predicted neighbours
+        """
+        sp = None
+        try:
+            sp = self._read_sp()
+        except Exception:
+            pass
+
+        mapped = self.pager.fault(self.uc, address, size=size, sp=sp)
+        for base, mapped_size in mapped:
+            self.log_to_ui("[*] Mapped %d at 0x%x" % (mapped_size, base))
+            self._notify('on_emulator_range_mapped', [base, mapped_size])
+
+        if not self.pager.is_mapped(self.uc, address, size):
+            return 301
+        return 0
+
+    def _read_target_pages(self, runs):
+        """
+        pager backend. read only pages come from the page cache when possible,
+        everything else is read from the memory provider at once
+        :return: [(address, data)]
+        """
+        cached = []
+        fetch = runs
+        infos = {}
+        if self.page_cache is not None:
+            pages = [page for address, size in runs for page in range(address, address + size, PAGE_SIZE)]
+            try:
+                infos = dict(zip(pages, self.memory_provider.describe_pages(pages)))
+            except Exception:
+                infos = {}
+
+            missing = []
+            for page in pages:
+                info = infos.get(page)
+                if info is None:
+                    # not in the target or not described, let the read decide
+                    missing.append(page)
+                    continue
+                if 'r' not in info['protection']:
+                    continue
+                if 'w' in info['protection']:
+                    missing.append(page)
+                    continue
+                if persistent_page(info):
+                    data = self.page_cache.get(self._page_cache_key(page, info))
+                else:
+                    data = self.session_pages.get(self._session_page_key(page, info))
+                if data is None:
+                    missing.append(page)
+                else:
+                    cached.append((page, data))
+            fetch = page_runs(missing)
+
+        fetched = self._read_target(fetch) if fetch else []
+
+        if self.page_cache is not None and fetched:
+            for address, data in fetched:
+                for offset in range(0, len(data), PAGE_SIZE):
+                    info = infos.get(address + offset)
+                    if info is None or 'w' in info['protection']:
+                        continue
+                    if persistent_page(info):
+                        self.page_cache.put(self._page_cache_key(address + offset, info),
+                                            data[offset:offset + PAGE_SIZE])
+                    else:
+                        self.session_pages.put(self._session_page_key(address + offset, info),
+                                               data[offset:offset + PAGE_SIZE])
+
+        # merge contiguous chunks so that they are mapped at once
+        chunks = []
+        for address, data in sorted(cached + fetched, key=lambda chunk: chunk[0]):
+            if chunks and chunks[-1][0] + len(chunks[-1][1]) == address:
+                chunks[-1][1] += data
+            else:
+                chunks.append([address, bytearray(data)])
+        return chunks
+
+    def _read_target(self, runs):
+        """
+        :return: [(address, data)] readable parts of runs
+        """
+        try:
+            return self.memory_provider.read_ranges(runs)
+        except Exception as e:
+            # i.e. detached target while running on a snapshot
+            self.log_to_ui('[*] failed to read target memory: %s' % str(e))
+            return []
+
+    def dump_snapshot(self, path, tid=0):
+        """
+        dump every readable range of the target, plus the registers of tid, into path
+        """
+        if tid == 0 or tid == '0':
+            tid = self.context_provider.current_tid()
+        registers = {}
+        thumb = False
+        context = self.context_provider.get_context(tid)
+        if context is not None and context.is_native_context:
+            for reg, value in context.__dict__.items():
+                if isinstance(getattr(value, 'value', None), int):
+                    registers[reg] = value.value
+            if self.arch == 'arm':
+                thumb = context.pc.thumb
+
+        ranges = self.memory_provider.enumerate_ranges()
+        self.log_to_ui('[*] dumping %d ranges to %s' % (len(ranges), path))
+        index = MemorySnapshot.dump(path, ranges, self._read_target, arch=self.arch,
+                                    registers=registers, thumb=thumb)
+        self.log_to_ui('[*] snapshot saved to %s' % path)
+        return index
+
+    @staticmethod
+    def _page_cache_key(page, info):
+        """
+        key of a persistent_page. the size of the mapping stands for the identity of the file,
+        it changes with most rebuilds
+        """
+        base = int(info['base'], 16)
+        return page_key('%s#%x' % (info['file'], info['size']), info.get('offset', 0) + page - base,
+                        info['protection'])
+
+    def _session_page_key(self, page, info):
+        return self.context_provider.pid, page, info['protection']
+
+    def setup(self, tid=0, user_arch=None, user_mode=None, cs_arch=None, cs_mode=None):
+        if tid == 0:
+            # get current context tid if none provided
+            tid = self.context_provider.current_tid()
+
+        # make sure it's int < pp: why make sure its int and then using str(tid) later??
+        #                       when calling from api its str
+        if isinstance(tid, str):
+            try:
+                tid = int(tid)
+            except ValueError:
+                return self.ERR_INVALID_TID
+
+        if not isinstance(tid, int):
+            return self.ERR_INVALID_TID
+
+        self.context = self.context_provider.get_context(tid)
+
+        self.invalidate_configurations()
+        if self.context is None and self.snapshot_path:
+            # no live context (i.e detached), use the registers stored in the snapshot
+            try:
+                self.context = MemorySnapshot(self.snapshot_path).context()
+            except (OSError, ValueError, KeyError):
+                pass
+
+        if self.context is None or not self.context.is_native_context:
+            # prevent emulation if out-of-context
+            return self.ERR_INVALID_CONTEXT
+
+        try:
+            self._setup(user_arch=user_arch, user_mode=user_mode, cs_arch=cs_arch, cs_mode=cs_mode)
+            self._notify('on_emulator_setup', [user_arch, user_mode])
+        except self.EmulatorSetupFailedError:
+            return self.ERR_SETUP_FAILED
+        if self.trace_export_path:
+            # one file per setup
+            try:
+                self.start_export(setup_export_path(self.trace_export_path))
+            except OSError as e:
+                self.log_to_ui('[*] trace export failed: %s' % str(e))
+        return 0
+
+    def emulate(self, until=0, step_mode=STEP_MODE_NONE, user_arch=None, user_mode=None, cs_arch=None, cs_mode=None,
+                fast=False, count=0, timeout=0, synchronous=False):
+        """
+        :param fast: run without code/memory hooks. unicorn stops right before until, after count instructions
+                     or after timeout milliseconds. context is rebuilt once the run is over
+        :param synchronous: run in the calling thread and return the result even when a launcher is set
+        """
+        if self.is_running():
+            raise self.EmulatorAlreadyRunningError()
+
+        if fast and not until and not count and not timeout:
+            raise self.EmulatorSetupFailedError('Fast run requires an end address, a count or a timeout')
+
+        if isinstance(until, str):
+            try:
+                until = int(until, 16)
+            except ValueError:
+                until = 0
+
+        if until and isinstance(until, int):
+            self.end_ptr = until
+            if self.end_ptr <= 0:
+                # invalid end pointer
+                raise self.EmulatorSetupFailedError('Invalid EndPtr')
+
+        if self.context is None:
+            err = self.setup(user_arch=user_arch, user_mode=user_mode, cs_arch=cs_arch, cs_mode=cs_mode)
+            if err > 0:
+                # make sure context is None if setup failed for any reason. we want a clean setup later
+                self.context = None
+
+                err_msg = 'unhandled error'
+                if err == self.ERR_INVALID_TID:
+                    err_msg = 'invalid thread id'
+                elif err == self.ERR_INVALID_CONTEXT:
+                    err_msg = 'invalid context'
+                raise self.EmulatorSetupFailedError('Setup failed: %s' % err_msg)
+
+        # calculate the start address
+        address = self._next_instruction
+        if address == 0:
+            address = self._read_pc()
+
+        if fast:
+            self.log_to_ui('[*] fast run from %s to %s' % (hex(address), hex(self.end_ptr) if until else '-'))
+        elif until > 0:
+            self.log_to_ui('[*] start emulation from %s to %s' % (hex(address), hex(self.end_ptr)))
+        else:
+            if step_mode == STEP_MODE_NONE or step_mode == STEP_MODE_SINGLE:
+                self.log_to_ui('[*] stepping %s' % hex(address))
+            elif step_mode == STEP_MODE_FUNCTION:
+                self.log_to_ui('[*] stepping to next function call')
+        self._notify('on_emulator_start')
+
+        # invalidate prefs before start
+        self.invalidate_configurations()
+
+        # callbacks are executed again only when the file changed
+        try:
+            if self.callbacks.load(self.callbacks_path):
+                self.log_to_ui('[*] callbacks loaded, hooks: %s' % (', '.join(sorted(self.callbacks.hooks)) or 'none'))
+        except Exception as e:
+            self.log_to_ui('[*] failed to load callbacks: %s' % str(e))
+            # reset callbacks path
+            self.config.put(EMULATOR_CALLBACKS_PATH, '')
+            self.callbacks_path = ''
+            self.callbacks.unload()
+
+        self.fast_run = fast
+        self._run_count = count
+        self._run_timeout = timeout
+        self._request_stop = False
+        self.stop_reason = None
+
+        # until is 0 (i.e we are stepping)
+        if fast:
+            self.step_mode = STEP_MODE_NONE
+            if not until:
+                self.end_ptr = 0
+        elif until == 0 and step_mode == STEP_MODE_NONE:
+            self.step_mode = STEP_MODE_SINGLE
+        else:
+            self.step_mode = step_mode
+
+        self._start_address = address
+        if self.thumb:
+            if self._start_address % 2 == 0:
+                self._start_address = self._start_address | 1
+        else:
+            if self._start_address % 2 != 0:
+                self._start_address -= 1
+        self._end_address = self.end_ptr
+        self._setup_done = True
+        self._running = True
+        if self.launcher is not None and not synchronous:
+            self.launcher()
+            return None
+        self.run()
+        return self.run_result()
+
+    def stop(self, reason=STOP_USER):
+        batch = self._batch
+        if batch is not None:
+            batch.cancel()
+        if self.is_running():
+            if self.stop_reason is None:
+                self.stop_reason = reason
+            self.uc.emu_stop()
+
+    def log_to_ui(self, what):
+        self._notify('on_emulator_log', what)
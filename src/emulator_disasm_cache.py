@@ -0,0 +1,85 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+PAGE_SHIFT = 12
+
+
+class EmulatorDisasmCache(object):
+    """
+    decoded instructions keyed by address, cpu mode and instruction bytes.
+    entries are also indexed by code page so that emulated writes can drop them
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._pages = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def disasm(self, cs, mode, address, data):
+        key = (address, mode, data)
+        insn = self._entries.get(key)
+        if insn is not None:
+            self.hits += 1
+            return insn
+
+        self.misses += 1
+        insn = next(cs.disasm(data, address), None)
+        if insn is None:
+            return None
+
+        self._entries[key] = insn
+        first_page = address >> PAGE_SHIFT
+        last_page = (address + len(data) - 1) >> PAGE_SHIFT
+        for page in range(first_page, last_page + 1):
+            self._pages.setdefault(page, []).append(key)
+        return insn
+
+    def is_cached_page(self, address):
+        return (address >> PAGE_SHIFT) in self._pages
+
+    def invalidate(self, address, size=1):
+        """
+        drop every entry decoded from the pages touched by a write
+        """
+        if not self._pages:
+            return
+        first_page = address >> PAGE_SHIFT
+        last_page = (address + max(size, 1) - 1) >> PAGE_SHIFT
+        for page in range(first_page, last_page + 1):
+            keys = self._pages.pop(page, None)
+            if keys is None:
+                continue
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._pages.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,100 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+
+# instructions and milliseconds per run, 0 for no limit. both are enforced by unicorn
+DEFAULT_MAX_INSTRUCTIONS = 0
+DEFAULT_RUN_TIMEOUT = 0
+# milliseconds per batch variation when neither a count nor a timeout bounds it, unbounded
+# workers would never return and stop can't reach them
+DEFAULT_BATCH_TIMEOUT = 10000
+
+# loop iterations between two cpu state comparisons, 0 disables the loop detector
+DEFAULT_LOOP_THRESHOLD = 4096
+
+# why the last run stopped
+STOP_END = 'end'
+STOP_STEP = 'step'
+STOP_COUNT = 'count'
+STOP_TIMEOUT = 'timeout'
+STOP_LOOP = 'loop'
+STOP_ERROR = 'error'
+STOP_USER = 'stopped'
+
+
+def min_limit(*limits):
+    """
+    :return: the smallest limit, 0 (no limit) is ignored
+    """
+    limits = [limit for limit in limits if limit]
+    return min(limits) if limits else 0
+
+
+class EmulatorLoopDetector(object):
+    """
+    runaway loops spotted from block addresses only.
+
+    a block reached through a backward edge is a loop head. every threshold iterations of the same head
+    the cpu state is compared with the one of the previous check: when nothing changed the loop
+    can't go anywhere. a loop may only make progress in memory: without a count of the writes in the
+    state, read_memory digests the memory once the state repeats and the loop is stuck when the
+    digest repeats too
+    """
+
+    # heads tracked at once, the table is dropped when full
+    MAX_HEADS = 64
+
+    def __init__(self, threshold=DEFAULT_LOOP_THRESHOLD):
+        self.threshold = threshold
+        self.reset()
+
+    def reset(self):
+        self._last = -1
+        self._heads = {}
+
+    def on_block(self, address, read_state, read_memory=None):
+        """
+        :param read_state: callable returning a comparable snapshot of the cpu state
+        :param read_memory: callable returning a comparable digest of the memory, None when read_state
+                            already covers the memory writes
+        :return: True when address is the head of a loop which doesn't make progress
+        """
+        last = self._last
+        self._last = address
+        if address > last or self.threshold <= 0:
+            return False
+
+        head = self._heads.get(address)
+        if head is None:
+            if len(self._heads) >= self.MAX_HEADS:
+                self._heads.clear()
+            head = self._heads[address] = [0, None, None]
+        head[0] += 1
+        if head[0] % self.threshold:
+            return False
+
+        state = read_state()
+        if state != head[1]:
+            head[1] = state
+            head[2] = None
+            return False
+        if read_memory is None:
+            return True
+        memory = read_memory()
+        if memory == head[2]:
+            return True
+        head[2] = memory
+        return False
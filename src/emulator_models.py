@@ -0,0 +1,419 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import heapq
+
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant, QTimer
+from unicorn.unicorn_const import UC_MEM_READ, UC_MEM_WRITE, UC_MEM_FETCH
+
+from ucdwarf.src.emulator_access_log import parse_ranges
+from ucdwarf.src.emulator_trace import ColumnStore
+
+# dropped rows of a sorted selection are removed run by run up to this many runs, the model is reset otherwise
+MAX_REMOVE_RUNS = 64
+
+# rows filtered, sorted or merged per event loop iteration while a selection is built. bigger selections
+# take several iterations, the ui keeps running meanwhile
+REBUILD_BATCH = 65536
+
+ACCESS_KINDS = {
+    UC_MEM_READ: 'READ',
+    UC_MEM_WRITE: 'WRITE',
+    UC_MEM_FETCH: 'FETCH',
+}
+
+
+def parse_access_filter(text):
+    """
+    :param text: ranges and access kinds separated by commas or spaces, i.e '0x1000-0x2000, write'.
+                 a single address matches itself
+    :return: (ranges, kinds), both empty when anything goes
+    """
+    ranges = []
+    kinds = set()
+    names = {name.lower(): kind for kind, name in ACCESS_KINDS.items()}
+    for token in text.replace(',', ' ').split():
+        token = token.lower()
+        if token in names:
+            kinds.add(names[token])
+        elif '-' in token:
+            ranges.extend(parse_ranges(token))
+        else:
+            address = int(token, 0)
+            ranges.append((address, address + 1))
+    return ranges, kinds
+
+
+class ColumnTableModel(QAbstractTableModel):
+    """
+    table over a ColumnStore, nothing is stored per row: cells are formatted in data().
+
+    rows map to the absolute store indexes. with a filter or a sort the mapping goes through an array
+    of indexes, built here rather than by a proxy model, REBUILD_BATCH rows per event loop iteration.
+    new rows are inserted in bulk by sync()
+    """
+
+    # (header, store column)
+    COLUMNS = []
+    ALIGNMENTS = {}
+
+    def __init__(self, store, parent=None):
+        super().__init__(parent=parent)
+        self.store = store
+        # position of each column in the store rows
+        self._positions = [store.names.index(name) for _, name in self.COLUMNS]
+        # absolute index of row 0 and rows known to the views, without selection
+        self._first = 0
+        self._count = 0
+        # selected absolute indexes, None to show the whole store in order
+        self._rows = None
+        self._sort_column = -1
+        self._sort_order = Qt.AscendingOrder
+        # rows appended while sorted, the sort is applied again by sync(final=True)
+        self._sort_pending = False
+        # (first, total, generator) of the selection being built, see _rebuild
+        self._build = None
+        self._build_final = False
+        self._build_timer = QTimer(self)
+        self._build_timer.setSingleShot(True)
+        self._build_timer.setInterval(0)
+        self._build_timer.timeout.connect(self._build_step)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows) if self._rows is not None else self._count
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal:
+            if role == Qt.DisplayRole:
+                return self.COLUMNS[section][0]
+            if role == Qt.TextAlignmentRole:
+                return Qt.AlignCenter
+        return QVariant()
+
+    def absolute(self, row):
+        """
+        :return: store index of a row
+        """
+        if self._rows is not None:
+            return self._rows[row]
+        return self._first + row
+
+    def value(self, row, column):
+        return self.store.row(self.absolute(row))[self._positions[column]]
+
+    def format(self, column, value):
+        return str(value)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        if role == Qt.DisplayRole:
+            try:
+                return self.format(index.column(), self.value(index.row(), index.column()))
+            except IndexError:
+                # dropped by the store, the next sync removes it
+                return QVariant()
+        if role == Qt.UserRole:
+            try:
+                return self.value(index.row(), index.column())
+            except IndexError:
+                return QVariant()
+        if role == Qt.TextAlignmentRole:
+            return self.ALIGNMENTS.get(index.column(), QVariant())
+        return QVariant()
+
+    def is_filtered(self):
+        return False
+
+    def _select(self, start, stop):
+        """
+        :return: array with the indexes between start and stop passing the filter
+        """
+        return array('Q', range(start, stop))
+
+    def _sort_key(self, start, stop):
+        """
+        :return: (first, key), key of the indexes from first to stop. the values are copied, rows dropped
+                 by the store meanwhile keep their key
+        """
+        # stored rows only, the stores behind these models don't spill
+        column = self.store.column(self.COLUMNS[self._sort_column][1], start, stop)
+        first = max(start, self.store.first)
+        return first, lambda index: column[index - first]
+
+    def _build_rows(self, start, stop):
+        """
+        the selection of the store indexes between start and stop, built REBUILD_BATCH rows per step.
+        yields None after every step but the last one, which yields the rows
+        """
+        rows = array('Q')
+        for batch in range(start, stop, REBUILD_BATCH):
+            rows.extend(self._select(batch, min(batch + REBUILD_BATCH, stop)))
+            yield None
+        if self._sort_column >= 0:
+            first, key = self._sort_key(start, stop)
+            # dropped by the store while selecting
+            del rows[:bisect_left(rows, first)]
+            reverse = self._sort_order == Qt.DescendingOrder
+            runs = []
+            for batch in range(0, len(rows), REBUILD_BATCH):
+                runs.append(sorted(rows[batch:batch + REBUILD_BATCH], key=key, reverse=reverse))
+                yield None
+            merged = heapq.merge(*runs, key=key, reverse=reverse)
+            rows = array('Q')
+            while True:
+                known = len(rows)
+                rows.extend(islice(merged, REBUILD_BATCH))
+                if len(rows) == known:
+                    break
+                yield None
+        yield rows
+
+    def _reset(self, first, total, rows):
+        self.beginResetModel()
+        self._first = first
+        self._count = total - first
+        self._rows = rows
+        self._sort_pending = False
+        self.endResetModel()
+
+    def _rebuild(self):
+        self._build = None
+        self._build_timer.stop()
+        first = self.store.oldest()
+        total = len(self.store)
+        if not self.is_filtered() and self._sort_column < 0:
+            self._reset(first, total, None)
+            return
+        build = self._build_rows(first, total)
+        if total - first <= REBUILD_BATCH:
+            self._reset(first, total, list(build)[-1])
+            return
+        # empty until built, sync waits for it
+        self._reset(first, first, array('Q'))
+        self._build = (first, total, build)
+        self._build_final = False
+        self._build_timer.start()
+
+    def _build_step(self):
+        if self._build is None:
+            return
+        first, total, build = self._build
+        rows = next(build)
+        if rows is None:
+            self._build_timer.start()
+            return
+        self._build = None
+        if len(self.store) < total:
+            # cleared meanwhile
+            self._rebuild()
+            return
+        self._reset(first, total, rows)
+        # rows appended or dropped meanwhile
+        self.sync(final=self._build_final)
+
+    def sync(self, final=False):
+        """
+        bring the model up to date with the store, once per batch of appended rows
+        :param final: sort again the rows appended while sorted
+        """
+        if self._build is not None:
+            self._build_final = self._build_final or final
+            return
+        first = self.store.oldest()
+        total = len(self.store)
+        if total < self._first + self._count or (self._rows is None and first > self._first + self._count):
+            # cleared or dropped more than what is known
+            self._rebuild()
+            return
+
+        if first > self._first:
+            # oldest rows dropped by the store
+            if self._rows is None:
+                self.beginRemoveRows(QModelIndex(), 0, first - self._first - 1)
+                self._count -= first - self._first
+                self._first = first
+                self.endRemoveRows()
+            else:
+                self._drop_rows(first)
+                self._count = max(self._first + self._count - first, 0)
+                self._first = first
+
+        known = self._first + self._count
+        if total == known:
+            if final and self._sort_pending:
+                self._rebuild()
+            return
+
+        if self._rows is None:
+            self.beginInsertRows(QModelIndex(), self._count, self._count + total - known - 1)
+            self._count = total - self._first
+            self.endInsertRows()
+            return
+
+        self._count = total - self._first
+        if self._sort_column >= 0:
+            # sorting on every batch would stall the ui, new rows wait for the final sync
+            self._sort_pending = True
+            if not final:
+                return
+            self._rebuild()
+            return
+        rows = self._select(known, total)
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self._rows), len(self._rows) + len(rows) - 1)
+            self._rows.extend(rows)
+            self.endInsertRows()
+
+    def _drop_rows(self, first):
+        """
+        remove the selected rows below the store index first
+        """
+        if self._sort_column < 0:
+            # selected in store order, the dropped ones lead
+            dropped = bisect_left(self._rows, first)
+            if dropped:
+                self.beginRemoveRows(QModelIndex(), 0, dropped - 1)
+                del self._rows[:dropped]
+                self.endRemoveRows()
+            return
+
+        # spread over the sort order, removed per run of adjacent rows from the last one
+        runs = []
+        start = None
+        for row, index in enumerate(self._rows):
+            if index < first:
+                if start is None:
+                    start = row
+            elif start is not None:
+                runs.append((start, row))
+                start = None
+        if start is not None:
+            runs.append((start, len(self._rows)))
+        if len(runs) > MAX_REMOVE_RUNS:
+            # cheaper for the views than that many removals, the order is kept
+            self.beginResetModel()
+            self._rows = array('Q', (index for index in self._rows if index >= first))
+            self.endResetModel()
+            return
+        for start, stop in reversed(runs):
+            self.beginRemoveRows(QModelIndex(), start, stop - 1)
+            del self._rows[start:stop]
+            self.endRemoveRows()
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        self._sort_column = column
+        self._sort_order = order
+        self._rebuild()
+
+    def clear(self):
+        self._rebuild()
+
+
+class EmulatorAccessModel(ColumnTableModel):
+    """
+    the emulator access log, filtered by address ranges and access kinds
+    """
+
+    COLUMNS = [('Address', 'address'), ('Access', 'kind'), ('Value', 'value'), ('PC', 'pc')]
+    ALIGNMENTS = {0: Qt.AlignCenter, 1: Qt.AlignCenter, 3: Qt.AlignCenter}
+
+    def __init__(self, access_log, format_address, parent=None):
+        super().__init__(access_log, parent=parent)
+        self.format_address = format_address
+        self._ranges = []
+        self._kinds = set()
+
+    def set_filter(self, text):
+        """
+        :raise ValueError: invalid filter, see parse_access_filter
+        """
+        self._ranges, self._kinds = parse_access_filter(text)
+        self._rebuild()
+
+    def is_filtered(self):
+        return bool(self._ranges or self._kinds)
+
+    def _select(self, start, stop):
+        # straight from the columns, no row tuples
+        start = max(start, self.store.first)
+        kinds = self._kinds
+        ranges = self._ranges
+        selected = array('Q')
+        for i, (address, kind) in enumerate(zip(self.store.column('address', start, stop),
+                                                self.store.column('kind', start, stop))):
+            if kinds and kind not in kinds:
+                continue
+            if ranges and not any(begin <= address < end for begin, end in ranges):
+                continue
+            selected.append(start + i)
+        return selected
+
+    def format(self, column, value):
+        if column == 1:
+            return ACCESS_KINDS.get(value, str(value))
+        if column == 2:
+            return hex(value)
+        return self.format_address(value)
+
+
+class EmulatorRangesModel(ColumnTableModel):
+    """
+    ranges mapped into the emulator. ranges come one at a time from the emulator thread,
+    they are inserted in bulk on the next event loop iteration
+    """
+
+    COLUMNS = [('Memory', 'base'), ('Size', 'size')]
+    ALIGNMENTS = {0: Qt.AlignCenter}
+
+    def __init__(self, format_address, parent=None):
+        super().__init__(ColumnStore([('base', 'Q'), ('size', 'Q')], capacity=1 << 32), parent=parent)
+        self.format_address = format_address
+        self._flush_scheduled = False
+
+    def add(self, base, size):
+        self.store.append(base, size)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            QTimer.singleShot(0, self._flush)
+
+    def _flush(self):
+        self._flush_scheduled = False
+        self.sync(final=True)
+
+    def range_at(self, row):
+        """
+        :return: (base, size) of a row
+        """
+        return self.store.row(self.absolute(row))
+
+    def format(self, column, value):
+        if column == 0:
+            return self.format_address(value)
+        return '{0:,d}'.format(value)
+
+    def clear(self):
+        self.store.clear()
+        super().clear()
@@ -0,0 +1,264 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import hashlib
+import json
+import mmap
+import os
+import time
+
+from collections import OrderedDict
+
+PAGE_SIZE = 0x1000
+DEFAULT_PAGE_CACHE_SIZE = 512 * 1024 * 1024
+DEFAULT_PAGE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.dwarf', 'ucdwarf_page_cache')
+# seconds between two writes of the index, see save_later
+INDEX_SAVE_INTERVAL = 30
+# pages kept in memory for the current target, see EmulatorSessionPageCache
+DEFAULT_SESSION_PAGES = 16384
+
+
+def page_key(module, offset, protection):
+    """
+    :param module: module path, or something unique for anonymous ranges
+    :param offset: page offset inside the module
+    """
+    return '%s:%x:%s' % (module, offset, protection)
+
+
+def persistent_page(info):
+    """
+    :param info: {base, size, protection, file, offset} of the range holding the page
+    :return: True for pages later sessions can reuse: code mapped from a file. read only data
+             (.data.rel.ro, .got after relro, anonymous ranges) may hold pointers relocated for this session
+    """
+    protection = info['protection']
+    return bool(info.get('file')) and 'x' in protection and 'w' not in protection
+
+
+class EmulatorPageCache(object):
+    """
+    target pages persisted across setups and sessions.
+
+    pages are content addressed: keys map to the sha1 of the page and identical pages share a slot
+    of the data file, which is memory mapped for reads. least recently used keys are evicted
+    once the stored pages exceed max_size
+    """
+
+    def __init__(self, path=DEFAULT_PAGE_CACHE_PATH, max_size=DEFAULT_PAGE_CACHE_SIZE):
+        self.path = path
+        self.max_size = max_size
+
+        self._data_path = os.path.join(path, 'pages.bin')
+        self._index_path = os.path.join(path, 'index.json')
+
+        # key -> digest, least recently used first
+        self._keys = OrderedDict()
+        # digest -> [slot, references]
+        self._pages = {}
+        self._free = []
+        self._slots = 0
+
+        self._fd = None
+        self._mm = None
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self._index_path):
+            try:
+                with open(self._index_path, 'r') as f:
+                    index = json.load(f)
+                self._slots = index['slots']
+                self._pages = {digest: [slot, 0] for digest, slot in index['pages'].items()}
+                for key, digest in index['keys']:
+                    if digest in self._pages:
+                        self._keys[key] = digest
+                        self._pages[digest][1] += 1
+                used = set(page[0] for page in self._pages.values())
+                self._free = [slot for slot in range(self._slots) if slot not in used]
+            except (ValueError, KeyError, TypeError):
+                # broken index, start over
+                self._keys.clear()
+                self._pages = {}
+                self._free = []
+                self._slots = 0
+
+        self._fd = os.open(self._data_path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < self._slots * PAGE_SIZE:
+            os.ftruncate(self._fd, self._slots * PAGE_SIZE)
+
+    def _mapped(self, slot):
+        end = (slot + 1) * PAGE_SIZE
+        if self._mm is None or len(self._mm) < end:
+            if self._mm is not None:
+                self._mm.close()
+            self._mm = mmap.mmap(self._fd, self._slots * PAGE_SIZE, access=mmap.ACCESS_READ)
+        return self._mm
+
+    @property
+    def size(self):
+        return len(self._pages) * PAGE_SIZE
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def get(self, key):
+        digest = self._keys.get(key)
+        if digest is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._keys.move_to_end(key)
+        slot = self._pages[digest][0]
+        return self._mapped(slot)[slot * PAGE_SIZE:(slot + 1) * PAGE_SIZE]
+
+    def put(self, key, data):
+        if len(data) != PAGE_SIZE:
+            data = bytes(data).ljust(PAGE_SIZE, b'\x00')[:PAGE_SIZE]
+        digest = hashlib.sha1(data).hexdigest()
+
+        current = self._keys.get(key)
+        if current == digest:
+            self._keys.move_to_end(key)
+            return
+        if current is not None:
+            self._release(self._keys.pop(key))
+
+        page = self._pages.get(digest)
+        if page is None:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = self._slots
+                self._slots += 1
+            os.pwrite(self._fd, data, slot * PAGE_SIZE)
+            page = self._pages[digest] = [slot, 0]
+        page[1] += 1
+        self._keys[key] = digest
+        self._dirty = True
+
+        while self.size > self.max_size and self._keys:
+            _, digest = self._keys.popitem(last=False)
+            self._release(digest)
+
+    def _release(self, digest):
+        page = self._pages[digest]
+        page[1] -= 1
+        if page[1] <= 0:
+            del self._pages[digest]
+            self._free.append(page[0])
+        self._dirty = True
+
+    def invalidate(self, prefix=None):
+        """
+        drop every key starting with prefix, or the whole cache
+        """
+        for key in [key for key in self._keys if prefix is None or key.startswith(prefix)]:
+            self._release(self._keys.pop(key))
+        self.save()
+
+    def save_later(self):
+        """
+        save when the index changed and the last save is old enough, a whole index write per fault
+        would dominate fault storms
+        """
+        if self._dirty and time.monotonic() - self._saved_at >= INDEX_SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        if not self._dirty:
+            return
+        index = {
+            'slots': self._slots,
+            'pages': {digest: page[0] for digest, page in self._pages.items()},
+            'keys': list(self._keys.items())
+        }
+        tmp = self._index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp, self._index_path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def stats(self):
+        return {
+            'keys': len(self._keys),
+            'pages': len(self._pages),
+            'size': self.size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+    def close(self):
+        self.save()
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class EmulatorSessionPageCache(object):
+    """
+    read only pages which are not safe to persist, kept in memory while the target is the same.
+    least recently used pages are dropped past capacity
+    """
+
+    def __init__(self, capacity=DEFAULT_SESSION_PAGES):
+        self.capacity = capacity
+        self._pages = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+    def get(self, key):
+        data = self._pages.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._pages.move_to_end(key)
+        return data
+
+    def put(self, key, data):
+        self._pages[key] = bytes(data)
+        self._pages.move_to_end(key)
+        while len(self._pages) > self.capacity:
+            self._pages.popitem(last=False)
+
+    def clear(self):
+        self._pages.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            'pages': len(self._pages),
+            'capacity': self.capacity,
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,197 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import time
+
+from bisect import bisect_right
+
+import unicorn
+
+PAGE_SIZE = 0x1000
+PAGE_MASK = PAGE_SIZE - 1
+
+DEFAULT_FAULT_SIZE = 256 * 1024
+DEFAULT_PREFETCH_PAGES = 8
+
+# faults this close to the stack pointer also pull the pages around it
+STACK_WINDOW = 64 * 1024
+STACK_PAGES_BELOW = 2
+STACK_PAGES_ABOVE = 4
+
+# faults inside a module also pull the first pages of its writable file backed segments (.data, .got)
+MODULE_DATA_PAGES = 16
+
+
+def page_runs(pages):
+    """
+    :param pages: sorted page addresses
+    :return: [(address, size)] with contiguous pages merged
+    """
+    runs = []
+    for page in pages:
+        if runs and runs[-1][0] + runs[-1][1] == page:
+            runs[-1][1] += PAGE_SIZE
+        else:
+            runs.append([page, PAGE_SIZE])
+    return [(address, size) for address, size in runs]
+
+
+class EmulatorPager(object):
+    """
+    synchronous demand paging for unicorn.
+
+    a fault maps the faulting page plus predicted neighbours (surrounding pages, the stack around sp,
+    the data segments of the faulting module), capped at max_fault_size, with a single call to read_pages.
+    read_pages([(address, size)]) returns [(address, data)] for the readable parts only
+    """
+
+    def __init__(self, read_pages, max_fault_size=DEFAULT_FAULT_SIZE, prefetch_pages=DEFAULT_PREFETCH_PAGES):
+        self._read_pages = read_pages
+        self.max_fault_size = max_fault_size
+        self.prefetch_pages = prefetch_pages
+
+        # file backed segments, sorted [(base, end, file)], and the writable ones per file
+        self._segments = []
+        self._segment_starts = []
+        self._data_segments = {}
+
+        self.faults = 0
+        self.failed_faults = 0
+        self.fault_time = 0.0
+        self.max_fault_time = 0.0
+        self.bytes_mapped = 0
+
+    def reset(self):
+        self.set_modules([])
+        self.faults = 0
+        self.failed_faults = 0
+        self.fault_time = 0.0
+        self.max_fault_time = 0.0
+        self.bytes_mapped = 0
+
+    def set_modules(self, ranges):
+        """
+        :param ranges: [{base, size, protection, file}] of the target, only the file backed ones are kept
+        """
+        self._segments = []
+        self._data_segments = {}
+        for info in ranges:
+            if not info.get('file'):
+                continue
+            base = info['base']
+            if isinstance(base, str):
+                base = int(base, 16)
+            self._segments.append((base, base + info['size'], info['file']))
+            if 'w' in info.get('protection', ''):
+                self._data_segments.setdefault(info['file'], []).append((base, base + info['size']))
+        self._segments.sort()
+        self._segment_starts = [base for base, _, _ in self._segments]
+
+    def _module_data_pages(self, address):
+        i = bisect_right(self._segment_starts, address) - 1
+        if i < 0 or address >= self._segments[i][1]:
+            return []
+        pages = []
+        for begin, end in self._data_segments.get(self._segments[i][2], []):
+            pages += range(begin & ~PAGE_MASK, min(end, begin + MODULE_DATA_PAGES * PAGE_SIZE), PAGE_SIZE)
+        return pages
+
+    @staticmethod
+    def _mapped_regions(uc):
+        regions = sorted((begin, end) for begin, end, _ in uc.mem_regions())
+        return [begin for begin, _ in regions], regions
+
+    @staticmethod
+    def _is_mapped(page, starts, regions):
+        i = bisect_right(starts, page) - 1
+        return i >= 0 and page <= regions[i][1]
+
+    def plan(self, uc, address, size=1, sp=None):
+        """
+        :return: sorted pages to fetch for a fault at address, the faulting ones first in priority
+        """
+        first = address & ~PAGE_MASK
+        last = (address + max(size, 1) - 1) & ~PAGE_MASK
+        wanted = list(range(first, last + PAGE_SIZE, PAGE_SIZE))
+
+        predicted = [first - PAGE_SIZE] + [last + i * PAGE_SIZE for i in range(1, self.prefetch_pages + 1)]
+        if sp is not None and abs(address - sp) < STACK_WINDOW:
+            sp_page = sp & ~PAGE_MASK
+            predicted += [sp_page + i * PAGE_SIZE for i in range(-STACK_PAGES_BELOW, STACK_PAGES_ABOVE + 1)]
+        predicted += self._module_data_pages(address)
+
+        starts, regions = self._mapped_regions(uc)
+        max_pages = max(self.max_fault_size // PAGE_SIZE, len(wanted))
+        pages = []
+        seen = set()
+        for page in wanted + predicted:
+            if len(pages) >= max_pages:
+                break
+            if page < 0 or page in seen or self._is_mapped(page, starts, regions):
+                continue
+            seen.add(page)
+            pages.append(page)
+        return sorted(pages)
+
+    def fault(self, uc, address, size=1, sp=None):
+        """
+        :return: list of (address, size) mapped to satisfy the fault, empty if the address could not be mapped
+        """
+        started = time.perf_counter()
+        self.faults += 1
+
+        mapped = []
+        pages = self.plan(uc, address, size=size, sp=sp)
+        if pages:
+            for chunk_address, data in self._read_pages(page_runs(pages)):
+                chunk_size = (len(data) + PAGE_MASK) & ~PAGE_MASK
+                if chunk_size == 0:
+                    continue
+                try:
+                    uc.mem_map(chunk_address, chunk_size)
+                    uc.mem_write(chunk_address, bytes(data))
+                except unicorn.UcError:
+                    continue
+                mapped.append((chunk_address, chunk_size))
+                self.bytes_mapped += chunk_size
+
+        if not self.is_mapped(uc, address, size):
+            self.failed_faults += 1
+
+        elapsed = time.perf_counter() - started
+        self.fault_time += elapsed
+        self.max_fault_time = max(self.max_fault_time, elapsed)
+        return mapped
+
+    @classmethod
+    def is_mapped(cls, uc, address, size=1):
+        """
+        :return: True when every page of [address, address + size) is mapped in uc
+        """
+        starts, regions = cls._mapped_regions(uc)
+        first = address & ~PAGE_MASK
+        last = (address + max(size, 1) - 1) & ~PAGE_MASK
+        return all(cls._is_mapped(page, starts, regions) for page in range(first, last + PAGE_SIZE, PAGE_SIZE))
+
+    def stats(self):
+        return {
+            'faults': self.faults,
+            'failed_faults': self.failed_faults,
+            'bytes_mapped': self.bytes_mapped,
+            'fault_time': self.fault_time,
+            'avg_fault_time': self.fault_time / self.faults if self.faults else 0,
+            'max_fault_time': self.max_fault_time
+        }
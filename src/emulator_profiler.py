@@ -0,0 +1,143 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import struct
+
+from array import array
+from bisect import bisect_right
+
+import unicorn
+
+
+def resolve_module(address, modules, starts=None):
+    """
+    :param modules: sorted [(base, end, path)], end excluded
+    :return: index of the module holding address or -1
+    """
+    if starts is None:
+        starts = [base for base, _, _ in modules]
+    i = bisect_right(starts, address) - 1
+    if i >= 0 and address < modules[i][1]:
+        return i
+    return -1
+
+
+class EmulatorProfiler(object):
+    """
+    executions per basic block through a single UC_HOOK_BLOCK, no per instruction work.
+
+    blocks are indexed once by address, sizes and counts are kept in arrays.
+    while enabled the hook is attached to every run, fast runs included
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._uc = None
+        self._hook = None
+        self.clear()
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def clear(self):
+        self._index = {}
+        self.addresses = array('Q')
+        self.sizes = array('I')
+        self.counts = array('Q')
+
+    def attach(self, uc):
+        if not self.enabled or self._hook is not None:
+            return
+        self._uc = uc
+        self._hook = uc.hook_add(unicorn.UC_HOOK_BLOCK, self._on_block)
+
+    def detach(self):
+        if self._hook is not None:
+            try:
+                self._uc.hook_del(self._hook)
+            except unicorn.UcError:
+                pass
+        self._hook = None
+        self._uc = None
+
+    def _on_block(self, uc, address, size, user_data):
+        i = self._index.get(address)
+        if i is None:
+            i = len(self.addresses)
+            self._index[address] = i
+            self.addresses.append(address)
+            self.sizes.append(size)
+            self.counts.append(0)
+        self.counts[i] += 1
+
+    def executions(self):
+        return sum(self.counts)
+
+    def hotspots(self, count=20, modules=None):
+        """
+        :return: the most executed blocks, [{address, size, executions, share, module, offset}]
+        """
+        total = self.executions()
+        order = sorted(range(len(self.addresses)), key=lambda i: self.counts[i], reverse=True)
+        if count:
+            order = order[:count]
+        starts = [base for base, _, _ in modules] if modules else None
+
+        hotspots = []
+        for i in order:
+            address = self.addresses[i]
+            hotspot = {
+                'address': address,
+                'size': self.sizes[i],
+                'executions': self.counts[i],
+                'share': self.counts[i] / total if total else 0,
+                'module': None,
+                'offset': None
+            }
+            if modules:
+                module = resolve_module(address, modules, starts)
+                if module >= 0:
+                    hotspot['module'] = modules[module][2]
+                    hotspot['offset'] = address - modules[module][0]
+            hotspots.append(hotspot)
+        return hotspots
+
+    def export_drcov(self, path, modules):
+        """
+        drcov (version 2) coverage file, readable by lighthouse, dragondance and friends.
+        blocks outside of the modules are not exported
+        :param modules: sorted [(base, end, path)], end excluded
+        :return: number of blocks exported
+        """
+        starts = [base for base, _, _ in modules]
+        blocks = []
+        for i, address in enumerate(self.addresses):
+            module = resolve_module(address, modules, starts)
+            if module >= 0:
+                blocks.append(struct.pack('<IHH', address - modules[module][0], min(self.sizes[i], 0xffff), module))
+
+        with open(path, 'wb') as f:
+            header = 'DRCOV VERSION: 2\n'
+            header += 'DRCOV FLAVOR: ucdwarf\n'
+            header += 'Module Table: version 2, count %d\n' % len(modules)
+            header += 'Columns: id, base, end, entry, checksum, timestamp, path\n'
+            for module_id, (base, end, module_path) in enumerate(modules):
+                header += '%3d, 0x%016x, 0x%016x, 0x%016x, 0x%08x, 0x%08x, %s\n' % (
+                    module_id, base, end, 0, 0, 0, module_path)
+            header += 'BB Table: %d bbs\n' % len(blocks)
+            f.write(header.encode('utf8'))
+            f.write(b''.join(blocks))
+        return len(blocks)
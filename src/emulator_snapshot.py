@@ -0,0 +1,158 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import ctypes
+import json
+import mmap
+import os
+
+import unicorn
+
+PAGE_SIZE = 0x1000
+PAGE_MASK = PAGE_SIZE - 1
+
+# bytes requested to the agent per read while dumping
+DUMP_CHUNK_SIZE = 16 * 1024 * 1024
+
+
+class SnapshotRegister(object):
+    def __init__(self, value, thumb=False):
+        self.value = value
+        self.thumb = thumb
+
+
+class SnapshotContext(object):
+    """
+    stand-in for the dwarf context of the thread the snapshot was taken from
+    """
+
+    is_native_context = True
+
+    def __init__(self, registers, thumb=False):
+        for reg, value in registers.items():
+            self.__dict__[reg] = SnapshotRegister(value, thumb=thumb and reg == 'pc')
+
+
+class MemorySnapshot(object):
+    """
+    full process memory dumped once in a file: page aligned range contents, plus a json index (path.json)
+    with ranges, protections, arch and the registers of a thread.
+
+    ranges are mapped into unicorn with mem_map_ptr over a private (copy on write) mmap of the file,
+    so nothing is copied and emulated writes never reach the file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + '.json', 'r') as f:
+            self.index = json.load(f)
+
+        self.arch = self.index.get('arch')
+        self.ranges = self.index['ranges']
+
+        self._file = None
+        self._mm = None
+        self._buffers = []
+
+    @staticmethod
+    def dump(path, ranges, read_pages, arch=None, registers=None, thumb=False):
+        """
+        :param ranges: [{base, size, protection, file}] as reported by the agent (base as hex string)
+        :param read_pages: [(address, size)] -> [(address, data)] of the readable parts
+        """
+        index = {
+            'arch': arch,
+            'thumb': thumb,
+            'registers': registers or {},
+            'ranges': []
+        }
+        offset = 0
+        with open(path, 'wb') as f:
+            for info in ranges:
+                base = int(info['base'], 16)
+                size = (info['size'] + PAGE_MASK) & ~PAGE_MASK
+                f.truncate(offset + size)
+                for chunk in range(base, base + size, DUMP_CHUNK_SIZE):
+                    chunk_size = min(DUMP_CHUNK_SIZE, base + size - chunk)
+                    for address, data in read_pages([(chunk, chunk_size)]):
+                        f.seek(offset + address - base)
+                        f.write(data)
+                index['ranges'].append({
+                    'base': base,
+                    'size': size,
+                    'protection': info['protection'],
+                    'file': info.get('file'),
+                    'offset': offset
+                })
+                offset += size
+
+        with open(path + '.json', 'w') as f:
+            json.dump(index, f)
+        return index
+
+    @staticmethod
+    def save_uc(path, uc, arch=None, registers=None, thumb=False):
+        """
+        dump the memory currently mapped in a unicorn instance
+        """
+        ranges = []
+        for begin, end, perms in sorted(uc.mem_regions()):
+            protection = ('r' if perms & unicorn.UC_PROT_READ else '-') + \
+                         ('w' if perms & unicorn.UC_PROT_WRITE else '-') + \
+                         ('x' if perms & unicorn.UC_PROT_EXEC else '-')
+            ranges.append({'base': hex(begin), 'size': end - begin + 1, 'protection': protection})
+
+        def read_pages(runs):
+            return [(address, bytes(uc.mem_read(address, size))) for address, size in runs]
+
+        return MemorySnapshot.dump(path, ranges, read_pages, arch=arch, registers=registers, thumb=thumb)
+
+    def context(self):
+        return SnapshotContext(self.index.get('registers', {}), thumb=self.index.get('thumb', False))
+
+    def map_into(self, uc):
+        """
+        :return: list of (base, size) mapped
+        """
+        self.close()
+        self._file = open(self.path, 'rb')
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return []
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        mapped = []
+        for info in self.ranges:
+            buffer = (ctypes.c_char * info['size']).from_buffer(self._mm, info['offset'])
+            try:
+                uc.mem_map_ptr(info['base'], info['size'], unicorn.UC_PROT_ALL, ctypes.addressof(buffer))
+            except unicorn.UcError:
+                # overlaps something already mapped
+                continue
+            self._buffers.append(buffer)
+            mapped.append((info['base'], info['size']))
+        return mapped
+
+    def close(self):
+        """
+        only call this once the unicorn instance using the mapping is gone
+        """
+        self._buffers = []
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
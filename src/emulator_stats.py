@@ -0,0 +1,89 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import time
+
+
+class EmulatorStats(object):
+    """
+    counters and timings of the emulator since the last setup.
+
+    instructions and blocks are only counted by traced runs, fast runs and the untraced segments of scoped
+    runs have no hook to count them. the instructions total is None once such a run happened, the traced
+    ones are still in traced_instructions
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.runs = 0
+        # runs which executed instructions without counting them
+        self.uncounted_runs = 0
+        self.instructions = 0
+        self.blocks = 0
+        self.memory_accesses = 0
+        # seconds spent inside the hooks, callbacks time is part of the hooks time
+        self.hook_code_time = 0.0
+        self.hook_mem_time = 0.0
+        self.callbacks_time = 0.0
+        # listener notifications (signals with qt) and events delivered through them
+        self.notifications = 0
+        self.events = 0
+        # wall clock of all runs and of the traced ones
+        self.run_time = 0.0
+        self.traced_run_time = 0.0
+
+        self._run_started = None
+        self._run_traced = False
+
+    def run_started(self, traced):
+        self.runs += 1
+        self._run_started = time.perf_counter()
+        self._run_traced = traced
+
+    def run_stopped(self):
+        if self._run_started is None:
+            return
+        elapsed = time.perf_counter() - self._run_started
+        self.run_time += elapsed
+        if self._run_traced:
+            self.traced_run_time += elapsed
+        self._run_started = None
+
+    def instructions_per_second(self):
+        elapsed = self.traced_run_time
+        if self._run_started is not None and self._run_traced:
+            # live value while running
+            elapsed += time.perf_counter() - self._run_started
+        return self.instructions / elapsed if elapsed > 0 else 0
+
+    def as_dict(self):
+        return {
+            'runs': self.runs,
+            'running': self._run_started is not None,
+            'instructions': None if self.uncounted_runs else self.instructions,
+            'traced_instructions': self.instructions,
+            'blocks': self.blocks,
+            'memory_accesses': self.memory_accesses,
+            'hook_code_time': self.hook_code_time,
+            'hook_mem_time': self.hook_mem_time,
+            'callbacks_time': self.callbacks_time,
+            'notifications': self.notifications,
+            'events': self.events,
+            'run_time': self.run_time,
+            'instructions_per_second': self.instructions_per_second()
+        }
@@ -0,0 +1,202 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import threading
+
+from collections import OrderedDict
+
+import unicorn
+
+PAGE_SHIFT = 12
+PAGE_SIZE = 1 << PAGE_SHIFT
+
+# bytes read per address, longer strings are cut
+TELESCOPE_READ_SIZE = 64
+TELESCOPE_MAX_LENGTH = 50
+DEFAULT_TELESCOPE_CACHE_SIZE = 4096
+
+
+def format_telescope(data, pointer_size):
+    """
+    :param data: bytes at the address
+    :return: the nul terminated utf8 string data starts with, the pointer sized value in hex otherwise.
+             '' for no data
+    """
+    if not data:
+        return ''
+    end = data.find(b'\x00')
+    if end > 0:
+        try:
+            text = data[:end].decode('utf8')
+            if text.isprintable():
+                return text
+        except UnicodeDecodeError:
+            pass
+    elif end < 0 and len(data) >= TELESCOPE_READ_SIZE:
+        # no terminator within the read
+        try:
+            text = data.decode('utf8')
+            if text.isprintable():
+                return text[:TELESCOPE_MAX_LENGTH] + '...'
+        except UnicodeDecodeError:
+            pass
+    return '0x%s' % bytes(data[:pointer_size]).hex()
+
+
+class EmulatorTelescope(object):
+    """
+    what emulator addresses point to, string or pointer sized hex, for the Code tab annotations.
+
+    one bounded read per address. results are kept in a lru cache keyed by address and indexed by page,
+    emulated writes drop the pages they touch. addresses unicorn doesn't have are queued and read from
+    the target in batches by fetch_pending(), which is blocking and meant for a worker thread.
+    read_target([(address, size)]) returns [(address, data)] for the readable parts only
+    """
+
+    def __init__(self, read_target=None, capacity=DEFAULT_TELESCOPE_CACHE_SIZE):
+        self._read_target = read_target
+        self.capacity = capacity
+        self.pointer_size = 8
+
+        # address -> telescope, least recently used first
+        self._entries = OrderedDict()
+        self._pages = {}
+        # addresses waiting for the target
+        self._pending = OrderedDict()
+        # resolve() and fetch_pending() run in the ui thread, invalidate() in the emulator one
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.target_reads = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def resolve(self, uc, address):
+        """
+        :return: the telescope of address, None while it's waiting for the target
+        """
+        with self._lock:
+            telescope = self._entries.get(address)
+            if telescope is not None:
+                self.hits += 1
+                self._entries.move_to_end(address)
+                return telescope
+            if address in self._pending:
+                return None
+            self.misses += 1
+
+        data = self._read(uc, address)
+        if data is None:
+            with self._lock:
+                self._pending[address] = None
+            return None
+        telescope = format_telescope(data, self.pointer_size)
+        with self._lock:
+            self._store(address, telescope)
+        return telescope
+
+    @staticmethod
+    def _read(uc, address):
+        if uc is None:
+            return None
+        try:
+            return bytes(uc.mem_read(address, TELESCOPE_READ_SIZE))
+        except unicorn.UcError:
+            pass
+        # the read may cross into an unmapped page, stop at the page end
+        size = PAGE_SIZE - (address & (PAGE_SIZE - 1))
+        if size < TELESCOPE_READ_SIZE:
+            try:
+                return bytes(uc.mem_read(address, size))
+            except unicorn.UcError:
+                pass
+        return None
+
+    def _store(self, address, telescope):
+        self._entries[address] = telescope
+        self._entries.move_to_end(address)
+        first_page = address >> PAGE_SHIFT
+        last_page = (address + TELESCOPE_READ_SIZE - 1) >> PAGE_SHIFT
+        for page in range(first_page, last_page + 1):
+            self._pages.setdefault(page, set()).add(address)
+        while len(self._entries) > self.capacity:
+            evicted, _ = self._entries.popitem(last=False)
+            for page in range(evicted >> PAGE_SHIFT, ((evicted + TELESCOPE_READ_SIZE - 1) >> PAGE_SHIFT) + 1):
+                addresses = self._pages.get(page)
+                if addresses is not None:
+                    addresses.discard(evicted)
+                    if not addresses:
+                        del self._pages[page]
+
+    def has_pending(self):
+        return len(self._pending) > 0
+
+    def fetch_pending(self):
+        """
+        read the queued addresses from the target with a single round trip
+        :return: number of addresses resolved
+        """
+        with self._lock:
+            addresses = list(self._pending)
+        if not addresses:
+            return 0
+        chunks = {}
+        if self._read_target is not None:
+            self.target_reads += 1
+            for address, data in self._read_target([(address, TELESCOPE_READ_SIZE) for address in addresses]):
+                chunks.setdefault(address, data)
+        with self._lock:
+            for address in addresses:
+                # unreadable addresses are resolved too, as nothing
+                if self._pending.pop(address, 0) is None:
+                    self._store(address, format_telescope(chunks.get(address), self.pointer_size))
+        return len(addresses)
+
+    def invalidate(self, address, size=1):
+        """
+        drop the telescopes read from the pages touched by a write
+        """
+        if not self._pages:
+            return
+        first_page = address >> PAGE_SHIFT
+        last_page = (address + max(size, 1) - 1) >> PAGE_SHIFT
+        with self._lock:
+            for page in range(first_page, last_page + 1):
+                addresses = self._pages.pop(page, None)
+                if addresses is None:
+                    continue
+                for cached in addresses:
+                    self._entries.pop(cached, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._pages.clear()
+            self._pending.clear()
+            self.hits = 0
+            self.misses = 0
+            self.target_reads = 0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'pending': len(self._pending),
+            'hits': self.hits,
+            'misses': self.misses,
+            'target_reads': self.target_reads
+        }
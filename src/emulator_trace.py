@@ -0,0 +1,254 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import os
+import struct
+import tempfile
+
+from array import array
+
+DEFAULT_TRACE_SIZE = 1000000
+
+
+class ColumnSpill(object):
+    """
+    rows dropped by a ColumnStore, packed into a temporary file and read back one at a time.
+
+    the emulator thread appends while views read: positional i/o only, the file offset is never moved
+    """
+
+    def __init__(self, typecodes, first=0):
+        self._struct = struct.Struct('<' + ''.join(typecodes))
+        self._file = tempfile.TemporaryFile(prefix='ucdwarf_spill_')
+        # absolute index of the first spilled row
+        self.first = first
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, columns, count):
+        pack = self._struct.pack
+        data = b''.join(pack(*row) for row in zip(*(column[:count] for column in columns)))
+        offset = self.count * self._struct.size
+        while data:
+            written = os.pwrite(self._file.fileno(), data, offset)
+            data = data[written:]
+            offset += written
+        # rows are readable once fully written
+        self.count += count
+
+    def row(self, index):
+        local = index - self.first
+        if local < 0 or local >= self.count:
+            raise IndexError('row %d is not spilled' % index)
+        try:
+            data = os.pread(self._file.fileno(), self._struct.size, local * self._struct.size)
+        except (OSError, ValueError):
+            # closed by a clear
+            raise IndexError('row %d is not spilled' % index)
+        if len(data) != self._struct.size:
+            raise IndexError('row %d is not spilled' % index)
+        return self._struct.unpack(data)
+
+    def size(self):
+        return self.count * self._struct.size
+
+    def close(self):
+        self._file.close()
+
+
+class ColumnStore(object):
+    """
+    rows stored as typed array columns (no python object per row).
+
+    indexes are absolute: they keep counting from the first row ever appended.
+    when capacity is reached the oldest half is dropped, so appends stay amortized O(1). with spill
+    enabled dropped rows go to a temporary file instead and remain readable through row().
+    columns support the buffer protocol, i.e. numpy.frombuffer(store.column('address'), 'u8')
+    """
+
+    def __init__(self, columns, capacity=DEFAULT_TRACE_SIZE):
+        self._names = [name for name, _ in columns]
+        self._columns = [array(typecode) for _, typecode in columns]
+        self.capacity = capacity
+        # absolute index of the first stored row
+        self.first = 0
+        self._spill = None
+
+    def __len__(self):
+        return self.first + len(self._columns[0])
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            return [self.row(i) for i in range(max(start, self.first), stop, step)]
+        if item < 0:
+            item += len(self)
+        return self.row(item)
+
+    def _local(self, index):
+        local = index - self.first
+        if local < 0 or local >= len(self._columns[0]):
+            raise IndexError('row %d is not stored' % index)
+        return local
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    def append(self, *values):
+        for column, value in zip(self._columns, values):
+            column.append(value)
+        if len(self._columns[0]) >= self.capacity:
+            self._check_capacity()
+
+    @property
+    def spill(self):
+        return self._spill is not None
+
+    @spill.setter
+    def spill(self, enabled):
+        if enabled and self._spill is None:
+            self._spill = ColumnSpill([column.typecode for column in self._columns], first=self.first)
+        elif not enabled and self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def oldest(self):
+        """
+        :return: absolute index of the first readable row, spilled ones included
+        """
+        if self._spill is not None and len(self._spill):
+            return self._spill.first
+        return self.first
+
+    def spilled_size(self):
+        return self._spill.size() if self._spill is not None else 0
+
+    def row(self, index):
+        if index < self.first and self._spill is not None:
+            return self._spill.row(index)
+        local = self._local(index)
+        return tuple(column[local] for column in self._columns)
+
+    def column(self, name, start=None, stop=None):
+        """
+        :return: array slice of the column between the absolute indexes start and stop
+        """
+        column = self._columns[self._names.index(name)]
+        start = self.first if start is None else max(start, self.first)
+        stop = len(self) if stop is None else min(stop, len(self))
+        return column[start - self.first:max(start, stop) - self.first]
+
+    def _check_capacity(self):
+        stored = len(self._columns[0])
+        if stored >= self.capacity:
+            drop = stored - self.capacity // 2
+            if self._spill is not None:
+                self._spill.append(self._columns, drop)
+            for column in self._columns:
+                del column[:drop]
+            self.first += drop
+            self._on_drop(self.first)
+
+    def _on_drop(self, first):
+        pass
+
+    def clear(self):
+        for column in self._columns:
+            del column[:]
+        self.first = 0
+        if self._spill is not None:
+            self.spill = False
+            self.spill = True
+
+
+class EmulatorTrace(ColumnStore):
+    """
+    executed instructions: address, size and cpu mode, with optional register deltas
+    """
+
+    def __init__(self, capacity=DEFAULT_TRACE_SIZE, track_registers=False):
+        super().__init__([('address', 'Q'), ('size', 'B'), ('mode', 'B')], capacity=capacity)
+        self.track_registers = track_registers
+
+        self._append_address = self._columns[0].append
+        self._append_size = self._columns[1].append
+        self._append_mode = self._columns[2].append
+
+        # absolute index -> {reg: value} changed before that instruction
+        self._deltas = {}
+        self._last_regs = {}
+        # registers before the first stored row, deltas of dropped rows are folded in here
+        self._base_regs = {}
+
+    def append(self, address, size, mode, regs=None):
+        if regs is not None:
+            last = self._last_regs
+            delta = {reg: value for reg, value in regs.items() if last.get(reg) != value}
+            if delta:
+                self._deltas[len(self)] = delta
+            self._last_regs = regs
+
+        self._append_address(address)
+        self._append_size(size)
+        self._append_mode(mode & 0xff)
+        if len(self._columns[0]) >= self.capacity:
+            self._check_capacity()
+
+    def _on_drop(self, first):
+        deltas = {}
+        for index, delta in self._deltas.items():
+            if index < first:
+                self._base_regs.update(delta)
+            else:
+                deltas[index] = delta
+        self._deltas = deltas
+
+    def addresses(self, start=None, stop=None):
+        return self.column('address', start, stop)
+
+    def find(self, address, start=None, stop=None):
+        """
+        :return: absolute indexes of the executions of address
+        """
+        start = self.first if start is None else max(start, self.first)
+        addresses = self.column('address', start, stop)
+        return [start + i for i, value in enumerate(addresses) if value == address]
+
+    def last(self):
+        if len(self._columns[0]) == 0:
+            return None
+        return self.row(len(self) - 1)
+
+    def registers_at(self, index):
+        """
+        :return: tracked registers as they were right before executing the instruction at index
+        """
+        self._local(index)
+        regs = dict(self._base_regs)
+        for i, delta in self._deltas.items():
+            if i > index:
+                break
+            regs.update(delta)
+        return regs
+
+    def clear(self):
+        super().clear()
+        self._deltas = {}
+        self._last_regs = {}
+        self._base_regs = {}
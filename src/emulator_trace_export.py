@@ -0,0 +1,416 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+TRACE_MAGIC = b'UCDTRACE'
+TRACE_VERSION = 2
+
+# instructions between register snapshots, each chunk of the file starts with one
+DEFAULT_SNAPSHOT_INTERVAL = 16384
+# chunks waiting for the writer thread, the emulation blocks past that
+WRITE_QUEUE_SIZE = 32
+# decoded chunks kept by the reader
+READER_CACHE_SIZE = 4
+
+RECORD_INSTRUCTION = 0
+RECORD_MEMORY = 1
+
+# magic, version, metadata size
+_FILE_HEADER = struct.Struct('<8sHI')
+# first instruction index, instructions, raw size, compressed size, pages. followed by the pages the memory
+# records of the chunk touch, as page numbers, so that lookups skip the chunks which don't have them
+_CHUNK_HEADER = struct.Struct('<QIIII')
+_PAGE_SHIFT = 12
+# tag, address, size, cpu mode, changed registers. followed by (register, value) per change
+_INSTRUCTION = struct.Struct('<BQBBB')
+_REGISTER = struct.Struct('<BQ')
+# tag, access, address, size, data size. followed by the data
+_MEMORY = struct.Struct('<BBQHH')
+
+_MASK = 0xffffffffffffffff
+
+
+def setup_export_path(path):
+    """
+    :return: path with the current time before the extension, plus a counter when taken.
+             each setup gets its own file instead of truncating the one of the previous setup
+    """
+    base, extension = os.path.splitext(path)
+    base = '%s-%s' % (base, time.strftime('%Y%m%d-%H%M%S'))
+    candidate = base + extension
+    counter = 1
+    while os.path.exists(candidate):
+        counter += 1
+        candidate = '%s-%d%s' % (base, counter, extension)
+    return candidate
+
+
+class EmulatorTraceWriter(object):
+    """
+    streams executed instructions and memory accesses into a zlib compressed file.
+
+    records are packed in the calling thread, compression and writes happen in a writer thread.
+    the file is a sequence of chunks, each one starting with a snapshot of the registers followed
+    by the instructions (with the registers they changed) and the memory accesses they made.
+    chunks are complete on disk after each flush(), the file can be read while still written
+    """
+
+    def __init__(self, path, registers, arch=None, snapshot_interval=DEFAULT_SNAPSHOT_INTERVAL):
+        """
+        :param registers: names of the register values passed to instruction()
+        """
+        self.path = path
+        self.registers = list(registers)
+        self.snapshot_interval = max(int(snapshot_interval), 1)
+
+        self.instructions = 0
+        self.accesses = 0
+        self.bytes_written = 0
+        self.error = None
+
+        self._file = open(path, 'wb')
+        metadata = json.dumps({
+            'arch': arch,
+            'registers': self.registers,
+            'snapshot_interval': self.snapshot_interval
+        }).encode('utf8')
+        self._file.write(_FILE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, len(metadata)) + metadata)
+
+        self._chunk = bytearray()
+        self._chunk_first = 0
+        self._chunk_count = 0
+        self._chunk_pages = set()
+        self._last = None
+
+        self._queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._write_loop, name='ucdwarf-trace-writer', daemon=True)
+        self._thread.start()
+
+    def instruction(self, address, size, mode, values):
+        """
+        :param values: register values before the instruction, in the order of registers
+        """
+        if self._chunk_count >= self.snapshot_interval:
+            self.flush()
+        if not self._chunk:
+            self._start_chunk(values)
+            changed = ()
+        else:
+            changed = [(i, value) for i, (value, last) in enumerate(zip(values, self._last)) if value != last]
+        self._last = values
+
+        self._chunk += _INSTRUCTION.pack(RECORD_INSTRUCTION, address, size, mode & 0xff, len(changed))
+        for i, value in changed:
+            self._chunk += _REGISTER.pack(i, value & _MASK)
+        self._chunk_count += 1
+        self.instructions += 1
+
+    def memory(self, access, address, data, size=None):
+        """
+        :param data: bytes read or written, may be shorter than size when unicorn doesn't tell
+        """
+        if not self._chunk:
+            if self._last is None:
+                return
+            # the access belongs to the last instruction of the previous chunk
+            self._start_chunk(self._last)
+        size = len(data) if size is None else size
+        self._chunk += _MEMORY.pack(RECORD_MEMORY, access, address, size, len(data))
+        self._chunk += data
+        if data:
+            self._chunk_pages.add(address >> _PAGE_SHIFT)
+            # a few bytes at most, one page or two
+            self._chunk_pages.add((address + len(data) - 1) >> _PAGE_SHIFT)
+        self.accesses += 1
+
+    def _start_chunk(self, values):
+        self._chunk_first = self.instructions
+        self._chunk += struct.pack('<%dQ' % len(values), *[value & _MASK for value in values])
+
+    def flush(self):
+        """
+        hand the current chunk to the writer thread
+        """
+        if not self._chunk:
+            return
+        self._queue.put((self._chunk_first, self._chunk_count, bytes(self._chunk), sorted(self._chunk_pages)))
+        self._chunk = bytearray()
+        self._chunk_count = 0
+        self._chunk_pages = set()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue
+            first, count, raw, pages = item
+            try:
+                # zlib drops the gil while compressing
+                compressed = zlib.compress(raw, 6)
+                header = _CHUNK_HEADER.pack(first, count, len(raw), len(compressed), len(pages))
+                header += struct.pack('<%dQ' % len(pages), *pages)
+                self._file.write(header)
+                self._file.write(compressed)
+                self._file.flush()
+                self.bytes_written += len(header) + len(compressed)
+            except (OSError, zlib.error) as e:
+                self.error = str(e)
+
+    def close(self):
+        """
+        flush and wait for the writer thread
+        """
+        if self._thread is None:
+            return
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'instructions': self.instructions,
+            'accesses': self.accesses,
+            'bytes_written': self.bytes_written,
+            'error': self.error
+        }
+
+
+class TraceChunk(object):
+    """
+    a decoded chunk: instructions as array columns, register changes and memory accesses
+    by local instruction index
+    """
+
+    def __init__(self, first, count, raw, registers):
+        self.first = first
+        self.addresses = array('Q')
+        self.sizes = array('B')
+        self.modes = array('B')
+        # local index -> [(register, value)]
+        self.changes = {}
+        # (local index, access, address, size, data)
+        self.accesses = []
+
+        snapshot_size = 8 * registers
+        self.snapshot = list(struct.unpack_from('<%dQ' % registers, raw, 0))
+        offset = snapshot_size
+        local = -1
+        while offset < len(raw):
+            tag = raw[offset]
+            if tag == RECORD_INSTRUCTION:
+                _, address, size, mode, changed = _INSTRUCTION.unpack_from(raw, offset)
+                offset += _INSTRUCTION.size
+                local += 1
+                self.addresses.append(address)
+                self.sizes.append(size)
+                self.modes.append(mode)
+                if changed:
+                    self.changes[local] = [_REGISTER.unpack_from(raw, offset + i * _REGISTER.size)
+                                           for i in range(changed)]
+                    offset += changed * _REGISTER.size
+            elif tag == RECORD_MEMORY:
+                _, access, address, size, data_size = _MEMORY.unpack_from(raw, offset)
+                offset += _MEMORY.size
+                self.accesses.append((local, access, address, size, raw[offset:offset + data_size]))
+                offset += data_size
+            else:
+                raise ValueError('invalid record %d at %d' % (tag, offset))
+        self._access_locals = [access[0] for access in self.accesses]
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def registers_at(self, local):
+        """
+        :return: register values before the instruction at the local index
+        """
+        values = list(self.snapshot)
+        for i in range(local + 1):
+            for register, value in self.changes.get(i, ()):
+                values[register] = value
+        return values
+
+    def accesses_of(self, local):
+        start = bisect_right(self._access_locals, local - 1)
+        stop = bisect_right(self._access_locals, local)
+        return self.accesses[start:stop]
+
+    def accesses_until(self, local):
+        """
+        :return: accesses made by the instructions up to the local index, included
+        """
+        return self.accesses[:bisect_right(self._access_locals, local)]
+
+
+class EmulatorTraceReader(object):
+    """
+    replay of a file written by EmulatorTraceWriter, without unicorn nor the target.
+
+    only chunk headers are read when opening, chunks are decompressed on demand. registers at an index
+    come from the snapshot of its chunk plus the changes up to it. memory is what the trace saw:
+    the last bytes read or written at each address, looked up in the chunks whose header lists its page
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        header = self._file.read(_FILE_HEADER.size)
+        if len(header) < _FILE_HEADER.size:
+            raise ValueError('not a trace file')
+        magic, version, metadata_size = _FILE_HEADER.unpack(header)
+        if magic != TRACE_MAGIC:
+            raise ValueError('not a trace file')
+        if version != TRACE_VERSION:
+            raise ValueError('unsupported trace version %d' % version)
+        self.metadata = json.loads(self._file.read(metadata_size).decode('utf8'))
+        self.arch = self.metadata.get('arch')
+        self.registers = self.metadata['registers']
+
+        # (first, count, offset of the compressed data, compressed size)
+        self._chunks = []
+        self._firsts = []
+        # page -> positions of the chunks with memory records in it, ascending
+        self._page_chunks = {}
+        self._cache = OrderedDict()
+        self._data_offset = _FILE_HEADER.size + metadata_size
+        self._count = 0
+        self.reload()
+
+    def reload(self):
+        """
+        pick up the chunks appended since the file was opened
+        """
+        offset = self._chunks[-1][2] + self._chunks[-1][3] if self._chunks else self._data_offset
+        self._file.seek(0, 2)
+        end = self._file.tell()
+        while offset + _CHUNK_HEADER.size <= end:
+            self._file.seek(offset)
+            first, count, _, compressed_size, pages = _CHUNK_HEADER.unpack(self._file.read(_CHUNK_HEADER.size))
+            data_offset = offset + _CHUNK_HEADER.size + 8 * pages
+            if data_offset + compressed_size > end:
+                # still being written
+                break
+            position = len(self._chunks)
+            for page in struct.unpack('<%dQ' % pages, self._file.read(8 * pages)):
+                self._page_chunks.setdefault(page, []).append(position)
+            self._chunks.append((first, count, data_offset, compressed_size))
+            self._firsts.append(first)
+            self._count = max(self._count, first + count)
+            offset = data_offset + compressed_size
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        self._file.close()
+        self._cache.clear()
+
+    def _chunk(self, position):
+        chunk = self._cache.get(position)
+        if chunk is not None:
+            self._cache.move_to_end(position)
+            return chunk
+        first, count, data_offset, compressed_size = self._chunks[position]
+        self._file.seek(data_offset)
+        raw = zlib.decompress(self._file.read(compressed_size))
+        chunk = self._cache[position] = TraceChunk(first, count, raw, len(self.registers))
+        while len(self._cache) > READER_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return chunk
+
+    def _locate(self, index):
+        if index < 0:
+            index += self._count
+        if index < 0 or index >= self._count:
+            raise IndexError('instruction %d is not in the trace' % index)
+        position = bisect_right(self._firsts, index) - 1
+        chunk = self._chunk(position)
+        return position, chunk, index - chunk.first
+
+    def instruction(self, index):
+        """
+        :return: (address, size, cpu mode) of the instruction at index
+        """
+        _, chunk, local = self._locate(index)
+        return chunk.addresses[local], chunk.sizes[local], chunk.modes[local]
+
+    def registers_at(self, index):
+        """
+        :return: {register: value} before executing the instruction at index
+        """
+        _, chunk, local = self._locate(index)
+        return dict(zip(self.registers, chunk.registers_at(local)))
+
+    def accesses(self, index):
+        """
+        :return: [(access, address, size, data)] made by the instruction at index
+        """
+        position, chunk, local = self._locate(index)
+        accesses = [access[1:] for access in chunk.accesses_of(local)]
+        if local == len(chunk) - 1:
+            # records of the last instruction may be in the next chunk
+            for next_position in range(position + 1, len(self._chunks)):
+                following = self._chunk(next_position)
+                accesses += [access[1:] for access in following.accesses_of(-1)]
+                if len(following):
+                    break
+        return accesses
+
+    def memory_at(self, index, address, size):
+        """
+        :return: the size bytes at address right before executing the instruction at index,
+                 None when the trace didn't see all of them
+        """
+        position, chunk, local = self._locate(index)
+        data = bytearray(size)
+        missing = set(range(size))
+        # previous chunks with records in the pages, the newest is popped first
+        positions = set()
+        for page in range(address >> _PAGE_SHIFT, ((address + max(size, 1) - 1) >> _PAGE_SHIFT) + 1):
+            chunks = self._page_chunks.get(page, ())
+            positions.update(chunks[:bisect_left(chunks, position)])
+        positions = sorted(positions)
+        # newest first: accesses before the instruction, then the previous chunks
+        accesses = chunk.accesses_until(local - 1)
+        while True:
+            for _, _, access_address, _, access_data in reversed(accesses):
+                start = max(address, access_address)
+                stop = min(address + size, access_address + len(access_data))
+                for byte in range(start, stop):
+                    if byte - address in missing:
+                        missing.discard(byte - address)
+                        data[byte - address] = access_data[byte - access_address]
+                if not missing:
+                    return bytes(data)
+            if not positions:
+                return None
+            accesses = self._chunk(positions.pop()).accesses
@@ -0,0 +1,63 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+from bisect import bisect_right
+
+
+class EmulatorTraceRanges(object):
+    """
+    the address ranges traced by start runs, everything when empty.
+
+    ranges are kept sorted and merged, end excluded. start runs are split in segments at their
+    boundaries, the memory hook is only attached to the segments inside them
+    """
+
+    def __init__(self, ranges=None):
+        self.set(ranges or [])
+
+    def __len__(self):
+        return len(self._ranges)
+
+    def __iter__(self):
+        return iter(self._ranges)
+
+    def set(self, ranges):
+        merged = []
+        for start, end in sorted(ranges):
+            if end <= start:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self._ranges = [tuple(r) for r in merged]
+        self._starts = [start for start, _ in self._ranges]
+
+    def add(self, start, end):
+        self.set(self._ranges + [(start, end)])
+
+    def clear(self):
+        self.set([])
+
+    def overlaps(self, start, end):
+        """
+        :return: True when [start, end) shares at least a byte with a range
+        """
+        i = bisect_right(self._starts, end - 1) - 1
+        return i >= 0 and start < self._ranges[i][1]
+
+    def __contains__(self, address):
+        return self.overlaps(address, address + 1)
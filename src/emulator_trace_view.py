@@ -0,0 +1,184 @@
+"""
+Dwarf - Copyright (C) 2019 Giovanni Rocca (iGio90)
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>
+"""
+import capstone
+
+from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QPainter, QFontDatabase, QPalette
+from PyQt5.QtWidgets import QAbstractScrollArea
+
+from ucdwarf.src.emulator_disasm_cache import EmulatorDisasmCache
+
+# columns, in characters
+MNEMONIC_WIDTH = 8
+OPERANDS_WIDTH = 40
+
+
+class EmulatorTraceView(QAbstractScrollArea):
+    """
+    the Code tab. one row per executed instruction of the emulator trace (spilled rows included),
+    nothing is kept per row: rows are read, decoded and annotated only when painted.
+
+    the view follows the last instruction while scrolled to the bottom
+    """
+
+    onRowDoubleClicked = pyqtSignal(int, int, name='onRowDoubleClicked')
+
+    def __init__(self, emulator, format_address, annotate=None, parent=None):
+        """
+        :param format_address: callable(address) -> str
+        :param annotate: callable(trace index) -> str or None
+        """
+        super().__init__(parent=parent)
+        self.emulator = emulator
+        self.format_address = format_address
+        self.annotate = annotate
+
+        self.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAsNeeded)
+        self.verticalScrollBar().setSingleStep(1)
+
+        # own decoder, rows may be in a cpu mode other than the running one
+        self._disasm_cache = EmulatorDisasmCache()
+        self._cs = {}
+        self._oldest = 0
+        self.selected = -1
+
+    def clear(self):
+        self._disasm_cache.clear()
+        self._cs = {}
+        self._oldest = 0
+        self.selected = -1
+        self.refresh()
+
+    def _row_height(self):
+        return self.fontMetrics().height()
+
+    def _visible_rows(self):
+        return max(self.viewport().height() // self._row_height(), 1)
+
+    def refresh(self):
+        """
+        sync the scroll range with the trace, once per events batch
+        """
+        trace = self.emulator.trace
+        oldest = trace.oldest()
+        rows = len(trace) - oldest
+        bar = self.verticalScrollBar()
+        follow = bar.value() >= bar.maximum()
+        shift = oldest - self._oldest
+        self._oldest = oldest
+
+        visible = self._visible_rows()
+        bar.setRange(0, max(rows - visible, 0))
+        bar.setPageStep(visible)
+        if follow:
+            bar.setValue(bar.maximum())
+        elif shift:
+            # rows were dropped, keep the same instructions in view
+            bar.setValue(max(bar.value() - shift, 0))
+        self.horizontalScrollBar().setRange(
+            0, max(self.fontMetrics().width('0' * (24 + MNEMONIC_WIDTH + OPERANDS_WIDTH)) -
+                   self.viewport().width(), 0))
+        self.viewport().update()
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.refresh()
+
+    def _index_at(self, y):
+        return self._oldest + self.verticalScrollBar().value() + y // self._row_height()
+
+    def mousePressEvent(self, event):
+        index = self._index_at(event.pos().y())
+        self.selected = index if index < len(self.emulator.trace) else -1
+        self.viewport().update()
+        super().mousePressEvent(event)
+
+    def mouseDoubleClickEvent(self, event):
+        index = self._index_at(event.pos().y())
+        try:
+            address, _, _ = self.emulator.trace.row(index)
+        except IndexError:
+            return
+        self.onRowDoubleClicked.emit(index, address)
+
+    def _disasm(self, address, size, mode):
+        uc = self.emulator.uc
+        cs = self.emulator.cs
+        if uc is None or cs is None:
+            return None
+        if cs.arch != capstone.CS_ARCH_ARM:
+            # only arm switches mode while running
+            mode = cs.mode
+        decoder = self._cs.get(mode)
+        if decoder is None:
+            decoder = self._cs[mode] = capstone.Cs(cs.arch, mode)
+            # groups tell flow changes apart
+            decoder.detail = True
+        try:
+            data = bytes(uc.mem_read(address, size))
+        except Exception:
+            return None
+        return self._disasm_cache.disasm(decoder, mode, address, data)
+
+    def paintEvent(self, event):
+        trace = self.emulator.trace
+        painter = QPainter(self.viewport())
+        palette = self.palette()
+        height = self._row_height()
+        ascent = self.fontMetrics().ascent()
+        char = self.fontMetrics().width('0')
+        left = -self.horizontalScrollBar().value() + char
+
+        first = self._oldest + self.verticalScrollBar().value()
+        last = min(first + self._visible_rows() + 1, len(trace))
+        y = 0
+        for index in range(first, last):
+            try:
+                address, size, mode = trace.row(index)
+            except IndexError:
+                y += height
+                continue
+
+            if index == self.selected:
+                painter.fillRect(0, y, self.viewport().width(), height, palette.color(QPalette.Highlight))
+
+            text = self.format_address(address)
+            painter.setPen(palette.color(QPalette.Disabled, QPalette.Text))
+            painter.drawText(left, y + ascent, text)
+            x = left + char * (len(text) + 2)
+
+            insn = self._disasm(address, size, mode)
+            painter.setPen(palette.color(QPalette.Text))
+            if insn is None:
+                painter.drawText(x, y + ascent, '??')
+            else:
+                painter.drawText(x, y + ascent, insn.mnemonic)
+                painter.drawText(x + char * MNEMONIC_WIDTH, y + ascent, insn.op_str)
+
+            if self.annotate is not None:
+                annotation = self.annotate(index)
+                if annotation:
+                    painter.setPen(palette.color(QPalette.Link))
+                    painter.drawText(x + char * (MNEMONIC_WIDTH + OPERANDS_WIDTH), y + ascent, annotation)
+
+            if insn is not None and (capstone.CS_GRP_JUMP in insn.groups or capstone.CS_GRP_CALL in insn.groups or
+                                     capstone.CS_GRP_RET in insn.groups):
+                # flow changes close a block
+                painter.setPen(palette.color(QPalette.Mid))
+                painter.drawLine(0, y + height - 1, self.viewport().width(), y + height - 1)
+            y += height
@@ -15,16 +15,41 @@ import capstone
 
 from dwarf.lib.types.range import Range
 from dwarf.ui.dialogs.dialog_input import InputDialog
-from dwarf.ui.widgets.disasm_view import DisassemblyView
 from dwarf.ui.widgets.list_view import DwarfListView
-from ucdwarf.src.emulator import STEP_MODE_NONE, STEP_MODE_SINGLE, STEP_MODE_FUNCTION
-from PyQt5.QtCore import Qt
+from ucdwarf.src.emulator import (STEP_MODE_NONE, STEP_MODE_SINGLE, STEP_MODE_FUNCTION, EVENT_INSTRUCTION,
+                                  TelescopeThread)
+from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QStandardItem, QStandardItemModel
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QTabWidget, QToolBar, QDialog, QLabel, QPushButton,
-                             QComboBox)
+                             QComboBox, QMenu, QLineEdit, QTableView, QAbstractItemView, QHeaderView)
 from ucdwarf.src.dialog_emulator_configs import EmulatorConfigsDialog
-from unicorn import UcError, unicorn_const
-from unicorn.unicorn_const import UC_MEM_READ, UC_MEM_FETCH, UC_MEM_WRITE
+from ucdwarf.src.emulator_models import EmulatorAccessModel, EmulatorRangesModel
+from ucdwarf.src.emulator_trace_view import EmulatorTraceView
+from unicorn import unicorn_const
+from unicorn.unicorn_const import UC_MEM_READ
+
+# latest instructions of the Code tab with register and memory annotations
+ANNOTATIONS_WINDOW = 100000
+
+# rows of the Stats tab: emulator stats key, label
+STATS_ROWS = [
+    ('instructions', 'instructions'),
+    ('traced_instructions', 'traced instructions'),
+    ('blocks', 'basic blocks'),
+    ('memory_accesses', 'memory accesses'),
+    ('instructions_per_second', 'instructions/s'),
+    ('run_time', 'run time'),
+    ('hook_code_time', 'code hook time'),
+    ('hook_mem_time', 'memory hook time'),
+    ('callbacks_time', 'callbacks time'),
+    ('faults', 'unmapped faults'),
+    ('fault_time', 'fault time'),
+    ('bytes_mapped', 'bytes mapped'),
+    ('notifications', 'signals'),
+    ('events', 'events'),
+    ('disasm_hits', 'disasm cache hits'),
+    ('disasm_misses', 'disasm cache misses'),
+]
 
 
 class EmulatorPanel(QWidget):
@@ -47,6 +72,7 @@ class EmulatorPanel(QWidget):
         self._toolbar_container = QHBoxLayout()
         self._toolbar = QToolBar()
         self._toolbar.addAction('Start', self.handle_start)
+        self._toolbar.addAction('Run', self.handle_run)
         self._toolbar.addAction('Step', self.handle_step)
         self._toolbar.addAction('Step next call', self.handle_step_next_call)
         self._toolbar.addAction('Stop', self.handle_stop)
@@ -92,9 +118,7 @@ class EmulatorPanel(QWidget):
         layout.addLayout(self._toolbar_container)
 
         self.tabs = QTabWidget()
-        self.assembly = DisassemblyView(self.app)
-        self.assembly.display_jumps = False
-        self.assembly.follow_jumps = False
+        self.assembly = EmulatorTraceView(self.emulator, self._format_address, annotate=self._annotation)
         #self.memory_table = HexEditor(self.app)
         #self.memory_table._read_only = True
         self.tabs.addTab(self.assembly, 'Code')
@@ -104,23 +128,50 @@ class EmulatorPanel(QWidget):
 
         self.ranges_list = DwarfListView(self.app)
         self.ranges_list.doubleClicked.connect(self.ranges_item_double_clicked)
-        self._ranges_model = QStandardItemModel(0, 2)
-        self._ranges_model.setHeaderData(0, Qt.Horizontal, 'Memory')
-        self._ranges_model.setHeaderData(0, Qt.Horizontal, Qt.AlignCenter, Qt.TextAlignmentRole)
-        self._ranges_model.setHeaderData(1, Qt.Horizontal, 'Size')
+        self.ranges_list.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.ranges_list.customContextMenuRequested.connect(self._on_ranges_context_menu)
+        self._ranges_model = EmulatorRangesModel(self._format_address, parent=self)
         self.ranges_list.setModel(self._ranges_model)
+        # natural order until a header is clicked
+        self.ranges_list.header().setSortIndicator(-1, Qt.AscendingOrder)
+        self.ranges_list.setSortingEnabled(True)
         self.tabs.addTab(self.ranges_list, 'Ranges')
 
-        self._access_list = DwarfListView(self.app)
+        access_container = QWidget()
+        access_layout = QVBoxLayout(access_container)
+        access_layout.setContentsMargins(0, 0, 0, 0)
+        self._access_filter = QLineEdit()
+        self._access_filter.setPlaceholderText('filter: 0x1000-0x2000, read, write, fetch')
+        self._access_filter.returnPressed.connect(self._on_access_filter)
+        access_layout.addWidget(self._access_filter)
+        # a tree view lays out every row on inserts, the log can hold millions
+        self._access_list = QTableView()
+        self._access_list.setShowGrid(False)
+        self._access_list.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self._access_list.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self._access_list.verticalHeader().hide()
+        self._access_list.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self._access_list.horizontalHeader().setStretchLastSection(True)
         self._access_list.doubleClicked.connect(self.access_item_double_clicked)
-        self._access_model = QStandardItemModel(0, 3)
-        self._access_model.setHeaderData(0, Qt.Horizontal, 'Address')
-        self._access_model.setHeaderData(0, Qt.Horizontal, Qt.AlignCenter, Qt.TextAlignmentRole)
-        self._access_model.setHeaderData(1, Qt.Horizontal, 'Access')
-        self._access_model.setHeaderData(1, Qt.Horizontal, Qt.AlignCenter, Qt.TextAlignmentRole)
-        self._access_model.setHeaderData(2, Qt.Horizontal, 'Value')
+        self._access_model = EmulatorAccessModel(self.emulator.access_log, self._format_address, parent=self)
         self._access_list.setModel(self._access_model)
-        self.tabs.addTab(self._access_list, 'Access')
+        self._access_list.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        self._access_list.setSortingEnabled(True)
+        access_layout.addWidget(self._access_list)
+        self.tabs.addTab(access_container, 'Access')
+
+        self._stats_list = DwarfListView(self.app)
+        self._stats_model = QStandardItemModel(0, 2)
+        self._stats_model.setHeaderData(0, Qt.Horizontal, 'Counter')
+        self._stats_model.setHeaderData(1, Qt.Horizontal, 'Value')
+        self._stats_items = {}
+        for key, label in STATS_ROWS:
+            _value = QStandardItem()
+            self._stats_items[key] = _value
+            self._stats_model.appendRow([QStandardItem(label), _value])
+        self._stats_list.setModel(self._stats_model)
+        self.tabs.addTab(self._stats_list, 'Stats')
+        self.tabs.currentChanged.connect(lambda index: self._update_stats())
 
         layout.setSpacing(0)
         self.setLayout(layout)
@@ -131,13 +182,19 @@ class EmulatorPanel(QWidget):
         self.emulator.onEmulatorStart.connect(self.on_emulator_start)
         self.emulator.onEmulatorStop.connect(self.on_emulator_stop)
         # self.emulator.onEmulatorStep.connect(self.on_emulator_step)
-        self.emulator.onEmulatorHook.connect(self.on_emulator_hook)
-        self.emulator.onEmulatorMemoryHook.connect(self.on_emulator_memory_hook)
+        self.emulator.onEmulatorEvents.connect(self.on_emulator_events)
         self.emulator.onEmulatorMemoryRangeMapped.connect(self.on_emulator_memory_range_mapped)
         self.emulator.onEmulatorLog.connect(self.on_emulator_log)
 
+        # register operand waiting for its value: (trace index, register name)
         self._require_register_result = None
         self._last_instruction_address = 0
+        # trace index -> [[name, value, telescope]], the telescope is resolved when first painted
+        self._annotations = {}
+        # telescopes of addresses the emulator doesn't have, read from the target in batches
+        self._telescope_thread = TelescopeThread(self.emulator.telescope, parent=self)
+        self._telescope_thread.finished.connect(self._on_telescope_fetched)
+        self._telescope_fetch_scheduled = False
 
     def _on_cpu_selection(self, cpu):
         self._uc_user_arch = unicorn_const.__dict__['UC_ARCH_' + cpu.upper()]
@@ -162,13 +219,15 @@ class EmulatorPanel(QWidget):
         return super().resizeEvent(event)
 
     def handle_clear(self):
-        self.ranges_list.clear()
-        self._access_list.clear()
-        self.assembly._lines.clear()
-        self.assembly.viewport().update()
+        self._annotations = {}
+        self._require_register_result = None
         # self.memory_table.setRowCount(0)
         self.console.clear()
         self.emulator.clean()
+        self._ranges_model.clear()
+        self._access_model.clear()
+        self.assembly.clear()
+        self._update_stats()
 
     def handle_options(self):
         EmulatorConfigsDialog.show_dialog(self.app.dwarf)
@@ -189,6 +248,24 @@ class EmulatorPanel(QWidget):
             #    self.console.log('cannot start emulator. err: %d' % err)
             #    return
 
+    def handle_run(self):
+        ph = ''
+        if self.until_address > 0:
+            ph = hex(self.until_address)
+        address, inp = InputDialog.input_pointer(self.app, input_content=ph, hint='pointer to last instruction')
+        if address > 0:
+            self.until_address = address
+            self.app.console_panel.show_console_tab('emulator')
+            try:
+                self.emulator.emulate(self.until_address, user_arch=self._uc_user_arch,
+                                      user_mode=self._uc_user_mode, cs_arch=self._cs_user_arch,
+                                      cs_mode=self._cs_user_mode, fast=True)
+            except self.emulator.EmulatorAlreadyRunningError:
+                self.console.log('Emulator already running')
+            except self.emulator.EmulatorSetupFailedError as error:
+                self.until_address = 0
+                self.console.log(error)
+
     def handle_step(self):
         self.app.console_panel.show_console_tab('emulator')
 
@@ -219,56 +296,72 @@ class EmulatorPanel(QWidget):
     def handle_stop(self):
         self.emulator.stop()
 
-    def on_emulator_hook(self, instruction):
-        # @PinkiePonkie why setting context here (which is triggered each instruction) and later, set it again
-        # in emulator_stop? step = double hit in set_context, running emulation on more than 1 instruction
-        # doesn't need spam of set_context
-        # self.app.context_panel.set_context(0, 2, self.emulator.current_context)
+    def on_emulator_events(self, events):
+        for event in events:
+            if event[0] == EVENT_INSTRUCTION:
+                self.on_emulator_hook(event[1], event[2], event[3])
+            else:
+                self.on_emulator_memory_hook(event[1:])
+        self._trim_annotations()
+        self._access_model.sync()
+        self._update_stats()
+
+        # repaint once per batch
+        self.assembly.refresh()
+
+    def _annotate(self, index, name, value):
+        self._annotations.setdefault(index, []).append([name, value, None])
+
+    def _trim_annotations(self):
+        if len(self._annotations) < ANNOTATIONS_WINDOW * 2:
+            return
+        oldest = len(self.emulator.trace) - ANNOTATIONS_WINDOW
+        self._annotations = {index: annotation for index, annotation in self._annotations.items() if index >= oldest}
+
+    def _annotation(self, index):
+        annotation = self._annotations.get(index)
+        if annotation is None:
+            return None
+        parts = []
+        for item in annotation:
+            name, value, telescope = item
+            if not isinstance(value, int):
+                parts.append('%s = ?' % name)
+                continue
+            if telescope is None and name != 'jump':
+                # only for painted rows
+                telescope = self.emulator.telescope.resolve(self.emulator.uc, value)
+                if telescope is None:
+                    # not in the emulator, painted again once read from the target
+                    self._schedule_telescope_fetch()
+                else:
+                    item[2] = telescope
+            if telescope and telescope != 'None':
+                parts.append('%s = %s (%s)' % (name, hex(value), telescope))
+            else:
+                parts.append('%s = %s' % (name, hex(value)))
+        return ', '.join(parts)
 
-        # check if the previous hook is waiting for a register result
+    def on_emulator_hook(self, instruction, regs, index):
+        # check if the previous instruction is waiting for a register result
         if self._require_register_result is not None:
-            row = 1
-            if len(self._require_register_result) == 1:
-                res = 'jump = %s' % (hex(self._require_register_result[0]))
-            else:
-                res = '%s = %s' % (
-                    self._require_register_result[1], hex(self.emulator.uc.reg_read(self._require_register_result[0])))
-            if len(self.assembly._lines) > 1:
-                if self.assembly._lines[len(self.assembly._lines) - row] is None:
-                    row = 2
-
-                telescope = self.get_telescope(self.emulator.uc.reg_read(self._require_register_result[0]))
-                if telescope is not None and telescope != 'None':
-                    res += ' (' + telescope + ')'
-
-                self.assembly._lines[len(self.assembly._lines) - row].string = res
-                # invalidate
-                self._require_register_result = None
+            previous, reg = self._require_register_result
+            self._annotate(previous, reg, regs.get(reg))
+            self._require_register_result = None
 
         # check if the code jumped
         self._last_instruction_address = instruction.address
 
-        self.assembly.add_instruction(instruction)
-
-        # add empty line if jump
         if instruction.is_jump or instruction.is_call:
-            self.assembly.add_instruction(None)
-            self._require_register_result = [
-                instruction.jump_address if instruction.is_jump else instruction.call_address
-            ]
+            self._annotate(index, 'jump', instruction.jump_address if instruction.is_jump else instruction.call_address)
         else:
             # implicit regs read are notified later through mem access
             if len(instruction.regs_read) == 0:
                 if len(instruction.operands) > 0:
                     for i in instruction.operands:
                         if i.type == capstone.CS_OP_REG:
-                            self._require_register_result = [
-                                i.value.reg,
-                                instruction.reg_name(i.value.reg)
-                            ]
+                            self._require_register_result = (index, instruction.reg_name(i.value.reg))
                             break
-        self.assembly.verticalScrollBar().setValue(len(self.assembly._lines))
-        self.assembly.viewport().update()
 
         if instruction.is_call:
             range_ = Range.build_or_get(self.app.dwarf, instruction.address)
@@ -305,108 +398,66 @@ class EmulatorPanel(QWidget):
         self.app.console_panel.show_console_tab('emulator')
         self.console.log(log)
 
-    def on_emulator_memory_hook(self, data):
-        uc, access, address, value = data
-        _address = QStandardItem()
+    def _format_address(self, address):
         if self.ranges_list.uppercase_hex:
             if self.app.dwarf.pointer_size > 4:
-                str_frmt = '0x{0:016X}'.format(address)
-            else:
-                str_frmt = '0x{0:08X}'.format(address)
-        else:
-            if self.app.dwarf.pointer_size > 4:
-                str_frmt = '0x{0:016x}'.format(address)
+                return '0x{0:016X}'.format(address)
+            return '0x{0:08X}'.format(address)
+        if self.app.dwarf.pointer_size > 4:
+            return '0x{0:016x}'.format(address)
+        return '0x{0:08x}'.format(address)
+
+    def _update_stats(self):
+        if not self._stats_list.isVisible():
+            return
+        stats = self.emulator.get_stats()
+        for key, _value in self._stats_items.items():
+            value = stats.get(key, 0)
+            if value is None:
+                # not counted
+                _value.setText('-')
+            elif key.endswith('_time'):
+                _value.setText('%.3fs' % value)
+            elif isinstance(value, float):
+                _value.setText('{0:,.0f}'.format(value))
             else:
-                str_frmt = '0x{0:08x}'.format(address)
-        _address.setText(str_frmt)
-        _address.setTextAlignment(Qt.AlignCenter)
+                _value.setText('{0:,d}'.format(value))
+
+    def _on_access_filter(self):
+        try:
+            self._access_model.set_filter(self._access_filter.text())
+        except ValueError:
+            self.console.log('invalid access filter: %s' % self._access_filter.text())
+
+    def on_emulator_memory_hook(self, data):
+        access, address, value, index = data
 
-        _access = QStandardItem()
         if access == UC_MEM_READ:
-            _access.setText('READ')
-        elif access == UC_MEM_WRITE:
-            _access.setText('WRITE')
-        elif access == UC_MEM_FETCH:
-            _access.setText('FETCH')
-        _access.setTextAlignment(Qt.AlignCenter)
-
-        _value = QStandardItem()
-        _value.setText(str(value))
-
-        self._access_model.appendRow([_address, _access, _value])
-
-        res = None
-        row = 1
-        if len(self.assembly._lines) > 1:
-            if self.assembly._lines[len(self.assembly._lines) - row] is None:
-                row = 2
-            if access == UC_MEM_READ:
-                if self._require_register_result is not None:
-                    if len(self._require_register_result) > 1:
-                        res = '%s = %s' % (self._require_register_result[1], hex(value))
-            else:
-                if self.assembly._lines[len(self.assembly._lines) - row].string:
-                    res = '%s, %s = %s' % (
-                        self.assembly._lines[len(self.assembly._lines) - row].string, hex(address), hex(value))
-                else:
-                    res = '%s = %s' % (hex(address), hex(value))
-            if res is not None:
-                telescope = self.get_telescope(value)
-                if telescope is not None and telescope != 'None':
-                    res += ' (' + telescope + ')'
-                # invalidate
+            if self._require_register_result is not None and self._require_register_result[0] == index:
+                self._annotate(index, self._require_register_result[1], value)
                 self._require_register_result = None
-                self.assembly._lines[len(self.assembly._lines) - row].string = res
-
-    def get_telescope(self, address):
-        try:
-            size = self.app.dwarf.pointer_size
-            telescope = self.emulator.uc.mem_read(address, size)
-            try:
-                for i in range(len(telescope)):
-                    if int(telescope[i]) == 0x0 and i != 0:
-                        st = telescope.decode('utf8')
-                        return st
-                st = telescope.decode('utf8')
-                if len(st) != size:
-                    return '0x%s' % telescope.hex()
-                while True:
-                    telescope = self.emulator.uc.mem_read(address + size, 1)
-                    if int(telescope) == 0x0:
-                        break
-                    st += telescope.decode('utf8')
-                    size += 1
-                return st
-            except:
-                return '0x%s' % telescope.hex()
-        except UcError as e:
-            # read from js
-            telescope = self.app.dwarf.dwarf_api('getAddressTs', address)
-            if telescope is None:
-                return None
-            telescope = str(telescope[1]).replace('\n', ' ')
-            if len(telescope) > 50:
-                telescope = telescope[:50] + '...'
-            return telescope
+        else:
+            self._annotate(index, hex(address), value)
+            self._require_register_result = None
+
+    def _schedule_telescope_fetch(self):
+        # once the whole view is painted, a single read for every missing address
+        if not self._telescope_fetch_scheduled:
+            self._telescope_fetch_scheduled = True
+            QTimer.singleShot(0, self._fetch_telescope)
+
+    def _fetch_telescope(self):
+        self._telescope_fetch_scheduled = False
+        if not self._telescope_thread.isRunning() and self.emulator.telescope.has_pending():
+            self._telescope_thread.start()
+
+    def _on_telescope_fetched(self):
+        self._telescope_thread.wait()
+        self.assembly.viewport().update()
 
     def on_emulator_memory_range_mapped(self, data):
         address, size = data
-        _address = QStandardItem()
-        if self.ranges_list.uppercase_hex:
-            if self.app.dwarf.pointer_size > 4:
-                str_frmt = '0x{0:016X}'.format(address)
-            else:
-                str_frmt = '0x{0:08X}'.format(address)
-        else:
-            if self.app.dwarf.pointer_size > 4:
-                str_frmt = '0x{0:016x}'.format(address)
-            else:
-                str_frmt = '0x{0:08x}'.format(address)
-        _address.setText(str_frmt)
-        _address.setTextAlignment(Qt.AlignCenter)
-        _size = QStandardItem()
-        _size.setText("{0:,d}".format(int(size)))
-        self._ranges_model.appendRow([_address, _size])
+        self._ranges_model.add(address, int(size))
 
     def on_emulator_setup(self, data):
         user_arch = data[0]
@@ -422,37 +473,44 @@ class EmulatorPanel(QWidget):
 
     def on_emulator_stop(self):
         self.plugin.emulator_context_widget.set_context(0, self.emulator.current_context)
+        self._update_stats()
 
-        # check if the previous hook is waiting for a register result
+        # check if the last instruction is waiting for a register result
         if self._require_register_result is not None:
-            row = 1
-            if len(self._require_register_result) == 1:
-                res = 'jump = %s' % (hex(self._require_register_result[0]))
-            else:
-                res = '%s = %s' % (
-                    self._require_register_result[1], hex(self.emulator.uc.reg_read(self._require_register_result[0])))
-                telescope = self.get_telescope(self.emulator.uc.reg_read(self._require_register_result[0]))
-                if telescope is not None and telescope != 'None':
-                    res += ' (' + telescope + ')'
-
-            if len(self.assembly._lines) > 1:
-                if self.assembly._lines[len(self.assembly._lines) - row] is None:
-                    row = 2
-                self.assembly._lines[len(self.assembly._lines) - row].string = res
-                # invalidate
-                self._require_register_result = None
+            index, reg = self._require_register_result
+            self._annotate(index, reg, getattr(self.emulator.current_context, reg, None))
+            self._require_register_result = None
+        self.assembly.refresh()
+        self._access_model.sync(final=True)
 
     def ranges_item_double_clicked(self, model_index):
-        row = self._ranges_model.itemFromIndex(model_index).row()
+        row = model_index.row()
         if row != -1:
-            item = self._ranges_model.item(row, 0).text()
+            item = self._ranges_model.range_at(row)[0]
             #self.memory_table.read_memory(item)
             self.tabs.setCurrentIndex(1)
 
+    def _on_ranges_context_menu(self, pos):
+        menu = QMenu(self.ranges_list)
+        index = self.ranges_list.indexAt(pos)
+        if index.isValid():
+            address, size = self._ranges_model.range_at(index.row())
+            menu.addAction('Trace this range', lambda: self._trace_range(address, size))
+        menu.addAction('Trace everything', self._trace_everything)
+        menu.exec_(self.ranges_list.viewport().mapToGlobal(pos))
+
+    def _trace_range(self, address, size):
+        ranges = self.emulator.add_trace_range(address, address + size)
+        self.console.log('tracing %s' % ', '.join('%s-%s' % (hex(start), hex(end)) for start, end in ranges))
+
+    def _trace_everything(self):
+        self.emulator.clear_trace_ranges()
+        self.console.log('tracing everything')
+
     def access_item_double_clicked(self, model_index):
-        row = self._access_model.itemFromIndex(model_index).row()
+        row = model_index.row()
         if row != -1:
-            item = self._access_model.item(row, 0).text()
+            item = self._access_model.value(row, 0)
             #self.memory_table.read_memory(item)
             self.tabs.setCurrentIndex(1)
 